@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Decode latency by format and size: the full-size read_image_from_url path
+against the decoder layer's reduced decode for an inference size
+
+Images are served from a local HTTP server, so both columns include the same
+download cost; the difference is the decode.
+
+Usage: python bench_decoder.py [--runs 20] [--max-side 640]
+"""
+
+import argparse
+import statistics
+import time
+
+import cv2
+import numpy as np
+
+import main
+from local_server import LocalServer
+
+SIZES = [(640, 480), (1920, 1080), (4032, 3024)]
+FORMATS = {
+    "jpeg": (".jpg", [cv2.IMWRITE_JPEG_QUALITY, 90]),
+    "png": (".png", []),
+    "webp": (".webp", [cv2.IMWRITE_WEBP_QUALITY, 85]),
+    "avif": (".avif", [cv2.IMWRITE_AVIF_QUALITY, 60]),
+}
+
+
+def photo_like(width, height):
+    """Smooth gradients plus noise, so sizes and decode costs resemble a photo"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.dstack([x * 255 // width, y * 255 // height, (x + y) * 127 // (width + height)])
+    noise = rng.integers(-12, 12, size=(height, width, 3))
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def median_ms(fn, runs):
+    fn()
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--max-side", type=int, default=640)
+    args = parser.parse_args()
+
+    print(f"{'format':<6} {'size':>10} {'bytes':>9} {'full ms':>9} {'decoder ms':>11} {'speedup':>8}")
+    with LocalServer() as server:
+        for width, height in SIZES:
+            image = photo_like(width, height)
+            for fmt, (ext, params) in FORMATS.items():
+                try:
+                    ok, buf = cv2.imencode(ext, image, params)
+                except cv2.error:
+                    ok = False
+                if not ok:
+                    print(f"{fmt:<6} {width}x{height:>5}  (encoder not available)")
+                    continue
+                url = server.route(f"/{fmt}-{width}{ext}", body=buf.tobytes())
+                full = median_ms(lambda: main.read_image_from_url(url), args.runs)
+                fast = median_ms(lambda: main.read_decoded_from_url(url, args.max_side), args.runs)
+                print(f"{fmt:<6} {f'{width}x{height}':>10} {len(buf):>9} {full:>9.1f} {fast:>11.1f} {full / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.INFO)
+    main_bench()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+p95 /predict latency under overload with the adaptive resolution policy on and off
+
+Requests arrive open-loop at --rate per second, faster than one worker can
+serve them at full resolution. The stand-in model holds a single device lock
+and takes time proportional to imgsz², like a CPU-bound YOLO forward pass.
+
+Usage: python bench_resolution.py [--rate 30] [--seconds 10] [--full-ms 50]
+"""
+
+import argparse
+import threading
+import time
+from collections import Counter
+
+import main
+from fake_yolo import FakeYOLO, fake_registry
+from health import LatencyWindow, percentile
+from local_server import LocalServer, sample_image_bytes
+from resolution import ResolutionPolicy
+
+
+class ScaledCostYOLO(FakeYOLO):
+    """Inference time grows with the square of the input size; one image at a time"""
+
+    def __init__(self, full_seconds, **kwargs):
+        super().__init__(**kwargs)
+        self.full_seconds = full_seconds
+        self.device = threading.Lock()
+
+    def predict(self, source=None, verbose=False, **kwargs):
+        imgsz = kwargs.get("imgsz", 640)
+        with self.device:
+            time.sleep(self.full_seconds * (imgsz / 640) ** 2)
+        return super().predict(source=source, verbose=verbose, **kwargs)
+
+
+def run(policy, rate, seconds, full_seconds, image_url):
+    main.registry = fake_registry(ScaledCostYOLO(full_seconds))
+    main.registry.get()
+    main.resolution = policy
+    main.monitor.latency = LatencyWindow()
+    client = main.app.test_client()
+    latencies, sizes, lock = [], Counter(), threading.Lock()
+
+    def one():
+        started = time.perf_counter()
+        response = client.post("/predict", json={"url": image_url}).get_json()
+        with lock:
+            latencies.append(time.perf_counter() - started)
+            sizes[response["resolution"]["imgsz"]] += 1
+
+    threads = []
+    start = time.perf_counter()
+    for i in range(int(rate * seconds)):
+        # Open loop: arrivals don't wait for earlier responses
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        thread = threading.Thread(target=one)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return latencies, sizes
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=float, default=30, help="Requests per second")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--full-ms", type=float, default=50, help="Inference time at imgsz 640")
+    parser.add_argument("--slo-ms", type=float, default=500)
+    args = parser.parse_args()
+
+    print(f"capacity at 640: {1000 / args.full_ms:.0f} req/s, offered: {args.rate:.0f} req/s")
+    with LocalServer() as server:
+        image_url = server.route("/frame.jpg", body=sample_image_bytes(1280, 720))
+        for label, enabled in (("policy off", False), ("policy on", True)):
+            policy = ResolutionPolicy(enabled=enabled, latency_slo_ms=args.slo_ms)
+            latencies, sizes = run(policy, args.rate, args.seconds, args.full_ms / 1000, image_url)
+            mix = ", ".join(f"{size}: {n}" for size, n in sorted(sizes.items()))
+            print(f"{label:<12} p50 {percentile(latencies, 50) * 1000:8.0f} ms   "
+                  f"p95 {percentile(latencies, 95) * 1000:8.0f} ms   imgsz {mix}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Response building cost at 10, 100 and 1000 detections: dicts through jsonify
+against the per-model response tables, with all fields and with a subset
+
+Each row converts one fake ultralytics result into detections and encodes the
+/predict body, which is the work between model.predict returning and the
+response being handed to the server. The jsonify column uses the per-box
+conversion /predict had before the tables. A second table does the same for a
+segmentation result, where a subset without "polygon" also skips the masks.
+
+Usage: python bench_response.py [--counts 10,100,1000] [--runs 200] [--fields bbox,class_id,confidence]
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from fake_yolo import FakeResult
+from main import app, iter_detections
+from response_tables import ResponseTable, encode_response, parse_fields
+from task_outputs import BOXES_ONLY, TaskOptions
+
+NAMES = dict(enumerate((
+    "person|bicycle|car|motorcycle|airplane|bus|train|truck|boat|traffic light|fire hydrant|stop sign|"
+    "parking meter|bench|bird|cat|dog|horse|sheep|cow|elephant|bear|zebra|giraffe|backpack|umbrella|"
+    "handbag|tie|suitcase|frisbee|skis|snowboard|sports ball|kite|baseball bat|baseball glove|skateboard|"
+    "surfboard|tennis racket|bottle|wine glass|cup|fork|knife|spoon|bowl|banana|apple|sandwich|orange|"
+    "broccoli|carrot|hot dog|pizza|donut|cake|chair|couch|potted plant|bed|dining table|toilet|tv|laptop|"
+    "mouse|remote|keyboard|cell phone|microwave|oven|toaster|sink|refrigerator|book|clock|vase|scissors|"
+    "teddy bear|hair drier|toothbrush").split("|")))
+HEAD = {"success": True, "model": "yolov8n", "resolution": {"imgsz": 640, "reason": "default"}}
+
+
+def fake_result(count, seed=0, task="detect"):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        x, y = rng.uniform(0, 1800), rng.uniform(0, 1000)
+        rows.append((rng.randrange(len(NAMES)), rng.random(), x, y, x + rng.uniform(5, 120), y + rng.uniform(5, 80)))
+    return FakeResult(rows, (1080, 1920), task)
+
+
+def per_box_detections(result, names):
+    """The conversion /predict used before the response tables: one dict and five round() calls per box"""
+    boxes = result.boxes
+    detections = []
+    for class_id, confidence, bbox in zip(boxes.cls.tolist(), boxes.conf.tolist(), boxes.xyxy.tolist()):
+        class_id = int(class_id)
+        detections.append({
+            "class_id": class_id,
+            "class_name": names[class_id],
+            "confidence": round(confidence, 3),
+            "bbox": {"x1": round(bbox[0], 2), "y1": round(bbox[1], 2), "x2": round(bbox[2], 2), "y2": round(bbox[3], 2)},
+        })
+    return detections
+
+
+def median_us(fn, runs):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", default="10,100,1000")
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--fields", default="bbox,class_id,confidence")
+    args = parser.parse_args()
+
+    table = ResponseTable(NAMES)
+    full = table.writer()
+    subset = table.writer(parse_fields(args.fields))
+
+    def jsonify_path(result):
+        detections = per_box_detections(result, NAMES)
+        # What jsonify does outside debug mode
+        return app.json.dumps({**HEAD, "detections": detections, "count": len(detections)}, separators=(",", ":"))
+
+    def table_path(result, writer, options=BOXES_ONLY):
+        return encode_response(HEAD, list(iter_detections(result, table.names, options=options)), writer)
+
+    print(f"{'boxes':>5} {'jsonify µs':>11} {'tables µs':>10} {'speedup':>8} "
+          f"{'subset µs':>10} {'bytes':>8} {'subset bytes':>13}")
+    for count in [int(c) for c in args.counts.split(",")]:
+        result = fake_result(count)
+        assert table_path(result, full) == jsonify_path(result)
+        before = median_us(lambda: jsonify_path(result), args.runs)
+        after = median_us(lambda: table_path(result, full), args.runs)
+        trimmed = median_us(lambda: table_path(result, subset), args.runs)
+        print(f"{count:>5} {before:>11.0f} {after:>10.0f} {before / after:>7.2f}x "
+              f"{trimmed:>10.0f} {len(table_path(result, full)):>8} {len(table_path(result, subset)):>13}")
+
+    # Options are derived from the fields the way /predict does it
+    full_options = TaskOptions.from_request({})
+    subset_options = TaskOptions.from_request({}, parse_fields(args.fields))
+    print(f"\nsegment {'full µs':>9} {'subset µs':>10} {'saving':>8}")
+    for count in [int(c) for c in args.counts.split(",")]:
+        result = fake_result(count, task="segment")
+        before = median_us(lambda: table_path(result, full, full_options), args.runs)
+        after = median_us(lambda: table_path(result, subset, subset_options), args.runs)
+        print(f"{count:>7} {before:>9.0f} {after:>10.0f} {before / after:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Fill a result store with synthetic runs and time typical /search queries
+
+Usage: python bench_result_store.py [--path bench.db] [--runs 1000000] [--per-run 10]
+"""
+
+import argparse
+import os
+import random
+import time
+
+from result_store import ResultStore
+
+NAMES = ["person", "bicycle", "car", "motorcycle", "bus", "truck", "dog", "cat"]
+
+
+def fill(store, runs, per_run, seed=0):
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    start_ts = time.time() - runs
+    for i in range(runs):
+        detections = []
+        for _ in range(rng.randint(0, 2 * per_run)):
+            class_id = rng.randrange(len(NAMES))
+            detections.append({"class_id": class_id, "class_name": NAMES[class_id],
+                               "confidence": round(rng.random(), 4),
+                               "bbox": {"x1": 1.0, "y1": 2.0, "x2": 3.0, "y2": 4.0}})
+        store.record(f"http://img/{i}.jpg", "yolov8n", (480, 640), detections, ts=start_ts + i)
+        if i % 2000 == 0:
+            # Let the writer keep up instead of dropping records
+            store.flush(timeout=60)
+    store.flush(timeout=600)
+    return time.perf_counter() - started
+
+
+def timed(label, fn, repeat=20):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results, _ = fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    print(f"{label:<44}{samples[len(samples) // 2] * 1000:>9.2f} ms median"
+          f"{samples[-1] * 1000:>9.2f} ms max  ({len(results)} results)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--path", default="bench_results.db")
+    parser.add_argument("--runs", type=int, default=200000)
+    parser.add_argument("--per-run", type=int, default=10, help="Average detections per run")
+    parser.add_argument("--keep", action="store_true", help="Reuse an existing database")
+    args = parser.parse_args()
+
+    if not args.keep and os.path.exists(args.path):
+        os.remove(args.path)
+    store = ResultStore(args.path, flush_interval=0.05)
+    if not args.keep:
+        seconds = fill(store, args.runs, args.per_run)
+        stats = store.stats()
+        print(f"wrote {stats['written_runs']} runs / {stats['written_detections']} detections "
+              f"in {seconds:.1f}s ({stats['written_detections'] / seconds:,.0f} rows/s, "
+              f"{stats['dropped']} dropped)")
+
+    now = time.time()
+    _, cursor = store.search(class_ids=[4], limit=100)
+    timed("class=bus, first page", lambda: store.search(class_ids=[4], limit=100))
+    timed("class=bus, second page", lambda: store.search(class_ids=[4], limit=100, cursor=cursor))
+    timed("class=dog, confidence >= 0.95", lambda: store.search(class_ids=[6], min_confidence=0.95))
+    timed("class=car or bus, first page", lambda: store.search(class_ids=[2, 4], limit=100))
+    timed("confidence >= 0.999, any class", lambda: store.search(min_confidence=0.999))
+    timed("class=car, last hour", lambda: store.search(class_ids=[2], since=now - 3600))
+    timed("class=car, a day-old window", lambda: store.search(class_ids=[2], since=now - 90000,
+                                                               until=now - 86400))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Concurrent get/put throughput of the shared result cache across processes
+
+Each process runs a read-mostly mix over a skewed key set (a few hot keys,
+a long tail), like repeat traffic for popular images, against one shared
+file. For comparison, the hit rate a per-worker dict of the same total size
+would have got on the same traffic is printed alongside.
+
+Usage: python bench_shared_cache.py [--processes 1,2,4,8] [--seconds 3] [--keys 20000]
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from shared_cache import SharedCache
+
+VALUE = b"x" * 1500
+
+
+def worker(path, size_bytes, seconds, keys, put_ratio, seed, processes, results):
+    cache = SharedCache(path, size_bytes=size_bytes, slot_bytes=2048)
+    rng = random.Random(seed)
+    local = {}
+    # Same total memory, split between workers that can't see each other's entries
+    local_limit = max(1, size_bytes // 2048 // processes)
+    ops = gets = hits = local_hits = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(200):
+            key = f"img-{int(keys * rng.random() ** 3)}"
+            if rng.random() < put_ratio:
+                cache.put(key, VALUE)
+            else:
+                gets += 1
+                value = cache.get(key)
+                hits += value is not None
+                if key in local:
+                    local_hits += 1
+                else:
+                    if value is None:
+                        cache.put(key, VALUE)
+                    if len(local) >= local_limit:
+                        local.pop(next(iter(local)))
+                    local[key] = VALUE
+            ops += 1
+    results.put((ops, gets, hits, local_hits))
+
+
+def run(processes, seconds, keys, put_ratio, size_bytes):
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache")
+        SharedCache(path, size_bytes=size_bytes, slot_bytes=2048)
+        results = context.Queue()
+        started = time.perf_counter()
+        workers = [context.Process(target=worker, args=(path, size_bytes, seconds, keys, put_ratio, i, processes, results))
+                   for i in range(processes)]
+        for process in workers:
+            process.start()
+        totals = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+        elapsed = time.perf_counter() - started
+    ops = sum(t[0] for t in totals)
+    gets = sum(t[1] for t in totals)
+    return {
+        "processes": processes,
+        "ops_per_s": ops / elapsed,
+        "shared_hit_rate": sum(t[2] for t in totals) / max(gets, 1),
+        "per_worker_hit_rate": sum(t[3] for t in totals) / max(gets, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", default="1,2,4,8")
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--keys", type=int, default=20000)
+    parser.add_argument("--put-ratio", type=float, default=0.05)
+    parser.add_argument("--size-mb", type=float, default=8)
+    args = parser.parse_args()
+
+    print(f"{'procs':>5} {'ops/s':>10} {'shared hit':>11} {'per-worker hit':>15}")
+    for processes in [int(p) for p in args.processes.split(",")]:
+        r = run(processes, args.seconds, args.keys, args.put_ratio, int(args.size_mb * 1e6))
+        print(f"{r['processes']:>5} {r['ops_per_s']:>10.0f} {r['shared_hit_rate']:>11.1%} "
+              f"{r['per_worker_hit_rate']:>15.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Offline bulk detection over a directory tree or a manifest of paths/URLs
+
+    python bulk_detect.py /data/images --output detections.ndjson
+    python bulk_detect.py manifest.txt --output out/ --format parquet --shard 0/4
+
+Images flow through prefetch -> decode -> batched inference -> write stages
+connected by bounded queues. Progress is checkpointed next to the output, so
+re-running the same command resumes where the last run stopped. Delivery is
+at-least-once: after a crash the last few records may be written twice.
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+
+_DONE = object()
+
+
+def iter_sources(source):
+    """Yield image paths under a directory, or the entries of a manifest file"""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for filename in sorted(files):
+                if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                    yield os.path.join(root, filename)
+    else:
+        with open(source) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield line
+
+
+def shard_filter(sources, shard, shards):
+    for i, source in enumerate(sources):
+        if i % shards == shard:
+            yield source
+
+
+class Checkpoint:
+    """Low watermark of finished items plus the few finished out of order above it"""
+
+    def __init__(self, path):
+        self.path = path
+        self.watermark = 0
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.watermark = state["watermark"]
+            self.done = set(state["done"])
+
+    def is_done(self, index):
+        return index < self.watermark or index in self.done
+
+    def mark(self, index):
+        self.done.add(index)
+        while self.watermark in self.done:
+            self.done.remove(self.watermark)
+            self.watermark += 1
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"watermark": self.watermark, "done": sorted(self.done)}, f)
+        os.replace(tmp, self.path)
+
+
+class NdjsonWriter:
+    def __init__(self, path):
+        self.f = open(path, "a", encoding="utf-8")
+
+    def write(self, record):
+        self.f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def flush(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+class ParquetWriter:
+    """Buffers records and writes one part file per flush into an output directory"""
+
+    def __init__(self, path):
+        import pyarrow as pa
+
+        self.pa = pa
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.rows = []
+        self.part = len([f for f in os.listdir(path) if f.endswith(".parquet")])
+        bbox = pa.struct([(k, pa.float32()) for k in ("x1", "y1", "x2", "y2")])
+        detection = pa.struct([("class_id", pa.int32()), ("class_name", pa.string()),
+                               ("confidence", pa.float32()), ("bbox", bbox)])
+        self.schema = pa.schema([
+            ("source", pa.string()), ("width", pa.int32()), ("height", pa.int32()),
+            ("count", pa.int32()), ("error", pa.string()), ("detections", pa.list_(detection)),
+        ])
+
+    def write(self, record):
+        self.rows.append(record)
+
+    def flush(self):
+        if not self.rows:
+            return
+        import pyarrow.parquet as pq
+
+        rows = [{name: row.get(name) for name in self.schema.names} for row in self.rows]
+        table = self.pa.Table.from_pylist(rows, schema=self.schema)
+        pq.write_table(table, os.path.join(self.path, f"part-{self.part:05d}.parquet"))
+        self.part += 1
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+
+def read_bytes(source, session=None):
+    if source.startswith(("http://", "https://")):
+        import requests
+
+        response = (session or requests).get(source, timeout=30)
+        response.raise_for_status()
+        return response.content
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def decode(data):
+    import cv2
+    import numpy as np
+
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Failed to decode image")
+    return image
+
+
+def run_stage(fn, in_q, out_q, workers, name):
+    """Start `workers` threads mapping fn over in_q; the last one to finish forwards _DONE"""
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def loop():
+        state = {}
+        while True:
+            item = in_q.get()
+            if item is _DONE:
+                in_q.put(_DONE)  # let sibling threads see it too
+                break
+            if "error" not in item:
+                try:
+                    fn(item, state)
+                except Exception as e:
+                    item["error"] = str(e)
+            out_q.put(item)
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                out_q.put(_DONE)
+
+    threads = [threading.Thread(target=loop, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+class BulkDetector:
+    """Streams sources through the bounded prefetch/decode/inference/write pipeline"""
+
+    def __init__(self, writer, predict_batch, checkpoint=None, batch_size=16, batch_timeout=0.05,
+                 fetch_workers=16, decode_workers=None, queue_size=64, checkpoint_every=5.0):
+        self.writer = writer
+        self.predict_batch = predict_batch
+        self.checkpoint = checkpoint or Checkpoint(None)
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.fetch_workers = fetch_workers
+        self.decode_workers = decode_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.checkpoint_every = checkpoint_every
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.queues = {}
+
+    def _fetch(self, item, state):
+        if "session" not in state and item["source"].startswith(("http://", "https://")):
+            import requests
+            state["session"] = requests.Session()
+        item["data"] = read_bytes(item["source"], state.get("session"))
+
+    def _decode(self, item, state):
+        item["image"] = decode(item.pop("data"))
+
+    def _infer(self, in_q, out_q):
+        finished = False
+        while not finished:
+            batch = []
+            item = in_q.get()
+            deadline = time.monotonic() + self.batch_timeout
+            while True:
+                if item is _DONE:
+                    finished = True
+                    break
+                if "error" in item:
+                    out_q.put(item)
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = in_q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    results = self.predict_batch([entry["image"] for entry in batch])
+                    for entry, detections in zip(batch, results):
+                        entry["detections"] = detections
+                except Exception as e:
+                    for entry in batch:
+                        entry["error"] = f"Inference failed: {e}"
+                for entry in batch:
+                    out_q.put(entry)
+        out_q.put(_DONE)
+
+    def _record(self, item):
+        record = {"source": item["source"]}
+        if "error" in item:
+            record["error"] = item["error"]
+        else:
+            height, width = item["image"].shape[:2]
+            record.update(width=width, height=height,
+                          count=len(item["detections"]), detections=item["detections"])
+        return record
+
+    def _write(self, in_q):
+        last_save = time.monotonic()
+        while True:
+            item = in_q.get()
+            if item is _DONE:
+                break
+            self.writer.write(self._record(item))
+            self.checkpoint.mark(item["index"])
+            self.processed += 1
+            if "error" in item:
+                self.failed += 1
+            if time.monotonic() - last_save >= self.checkpoint_every:
+                # Output first, then checkpoint: a crash can only repeat records, never lose them
+                self.writer.flush()
+                self.checkpoint.save()
+                last_save = time.monotonic()
+        self.writer.close()
+        self.checkpoint.save()
+
+    def run(self, sources, limit=None, progress=None):
+        fetch_q = queue.Queue(self.queue_size)
+        decode_q = queue.Queue(self.queue_size)
+        infer_q = queue.Queue(self.queue_size)
+        write_q = queue.Queue(self.queue_size)
+        self.queues = {"fetch": fetch_q, "decode": decode_q, "infer": infer_q, "write": write_q}
+
+        run_stage(self._fetch, fetch_q, decode_q, self.fetch_workers, "fetch")
+        run_stage(self._decode, decode_q, infer_q, self.decode_workers, "decode")
+        threading.Thread(target=self._infer, args=(infer_q, write_q), daemon=True).start()
+        writer = threading.Thread(target=self._write, args=(write_q,), daemon=True)
+        writer.start()
+
+        started = time.monotonic()
+        queued = 0
+        for index, source in enumerate(sources):
+            if self.checkpoint.is_done(index):
+                self.skipped += 1
+                continue
+            if limit is not None and queued >= limit:
+                break
+            fetch_q.put({"index": index, "source": source})
+            queued += 1
+        fetch_q.put(_DONE)
+
+        while writer.is_alive():
+            writer.join(timeout=1.0)
+            if progress:
+                progress(self, time.monotonic() - started)
+        return self.processed
+
+
+def print_progress(detector, elapsed, stream=sys.stderr):
+    rate = detector.processed / elapsed if elapsed else 0.0
+    depths = " ".join(f"{name}={q.qsize()}" for name, q in detector.queues.items())
+    stream.write(f"\r⏱️  {detector.processed} done ({detector.failed} failed, "
+                 f"{detector.skipped} resumed) | {rate:.1f} img/s | queues {depths}   ")
+    stream.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline bulk YOLO detection")
+    parser.add_argument("source", help="Directory of images or manifest file of paths/URLs")
+    parser.add_argument("--output", required=True, help="NDJSON file or Parquet directory")
+    parser.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.ckpt)")
+    parser.add_argument("--model", default=None, help="Model name (default: MODEL_NAME)")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--fetch-workers", type=int, default=16)
+    parser.add_argument("--decode-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--shard", default="0/1", help="k/n: process every n-th item starting at k")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many new items")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    shard, shards = (int(x) for x in args.shard.split("/"))
+
+    # Reuse the service's model registry and box conversion
+    import main as app
+
+    def predict(images):
+        return app.predict_batch(images, args.model)
+
+    writer = ParquetWriter(args.output) if args.format == "parquet" else NdjsonWriter(args.output)
+    checkpoint = Checkpoint(args.checkpoint or f"{args.output.rstrip('/')}.ckpt")
+    detector = BulkDetector(writer, predict, checkpoint, batch_size=args.batch_size,
+                            fetch_workers=args.fetch_workers, decode_workers=args.decode_workers,
+                            queue_size=args.queue_size)
+
+    started = time.monotonic()
+    detector.run(shard_filter(iter_sources(args.source), shard, shards),
+                 limit=args.limit, progress=print_progress)
+    elapsed = time.monotonic() - started
+    print_progress(detector, elapsed)
+    sys.stderr.write("\n")
+    print(f"✅ {detector.processed} images in {elapsed:.1f}s "
+          f"({detector.failed} failed, {detector.skipped} skipped from checkpoint)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import heapq
+import random
+import uuid
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from forklocal import ForkLocal
+from upstream import host_of
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_JOB_WORKERS = int(os.environ.get("CALLBACK_JOB_WORKERS", 2))
+CALLBACK_MAX_PENDING = int(os.environ.get("CALLBACK_MAX_PENDING", 100))
+CALLBACK_DELIVERY_WORKERS = int(os.environ.get("CALLBACK_DELIVERY_WORKERS", 4))
+CALLBACK_MAX_PER_HOST = int(os.environ.get("CALLBACK_MAX_PER_HOST", 2))
+CALLBACK_MAX_ATTEMPTS = int(os.environ.get("CALLBACK_MAX_ATTEMPTS", 6))
+CALLBACK_BACKOFF_BASE = float(os.environ.get("CALLBACK_BACKOFF_BASE", 1.0))
+CALLBACK_BACKOFF_MAX = float(os.environ.get("CALLBACK_BACKOFF_MAX", 300))
+CALLBACK_TIMEOUT = float(os.environ.get("CALLBACK_TIMEOUT", 10))
+DEAD_LETTER_DIR = os.environ.get("DEAD_LETTER_DIR", "dead_letters")
+
+# Receiver answers worth trying again; anything else in 4xx is the receiver rejecting the payload
+RETRY_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class InvalidCallback(ValueError):
+    """The callback_url can't be used"""
+
+
+class CallbacksBusy(Exception):
+    """Too many callback jobs are already waiting for inference"""
+
+
+def validate_callback_url(url):
+    if not isinstance(url, str) or not url:
+        raise InvalidCallback("'callback_url' must be a non-empty string")
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.netloc:
+        raise InvalidCallback("'callback_url' must be an absolute http(s) URL")
+    return url
+
+
+def backoff_delay(attempt, base=CALLBACK_BACKOFF_BASE, cap=CALLBACK_BACKOFF_MAX, rng=random):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]"""
+    return rng.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class Delivery:
+    def __init__(self, job_id, url, payload, attempts=0):
+        self.job_id = job_id
+        self.url = url
+        self.host = host_of(url)
+        self.payload = payload
+        self.attempts = attempts
+        self.last_error = None
+
+    def to_dict(self):
+        return {"job_id": self.job_id, "url": self.url, "payload": self.payload,
+                "attempts": self.attempts, "last_error": self.last_error, "failed_at": time.time()}
+
+
+class DeadLetterStore:
+    """Undeliverable callbacks, one JSON file per job, so they survive restarts"""
+
+    def __init__(self, directory=DEAD_LETTER_DIR):
+        self.directory = directory
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def add(self, delivery):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(delivery.job_id)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(delivery.to_dict(), f)
+        os.replace(tmp, path)
+
+    def job_ids(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith(".json"))
+
+    def load(self, job_id):
+        with open(self._path(job_id)) as f:
+            return json.load(f)
+
+    def remove(self, job_id):
+        try:
+            os.remove(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+class CallbackDispatcher:
+    """Runs detection jobs off the request thread and POSTs their results to callback URLs
+
+    Deliveries wait in a time-ordered heap, so retries sleeping out their
+    backoff and hosts at their concurrency cap never hold a delivery thread.
+    """
+
+    def __init__(self, job_workers=CALLBACK_JOB_WORKERS, max_pending=CALLBACK_MAX_PENDING,
+                 delivery_workers=CALLBACK_DELIVERY_WORKERS, max_per_host=CALLBACK_MAX_PER_HOST,
+                 max_attempts=CALLBACK_MAX_ATTEMPTS, backoff_base=CALLBACK_BACKOFF_BASE,
+                 backoff_max=CALLBACK_BACKOFF_MAX, timeout=CALLBACK_TIMEOUT,
+                 dead_letters=None, clock=time.monotonic):
+        self.job_workers = job_workers
+        self.max_pending = max_pending
+        self.delivery_workers = delivery_workers
+        self.max_per_host = max_per_host
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.dead_letters = dead_letters or DeadLetterStore()
+        self.clock = clock
+        self.counts = Counter()
+        self._heap = []
+        self._sequence = 0
+        self._active = Counter()
+        self._pending_jobs = 0
+        self._cond = threading.Condition()
+        self._jobs = ForkLocal(self._start_jobs)
+        self._delivery = ForkLocal(self._start_delivery)
+
+    def _start_jobs(self):
+        return ThreadPoolExecutor(self.job_workers, thread_name_prefix="callback-job")
+
+    def _start_delivery(self):
+        """This process's delivery threads; returns the session they share"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=self.max_per_host)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        self._heap, self._active = [], Counter()
+        for i in range(self.delivery_workers):
+            threading.Thread(target=self._deliver_loop, name=f"callback-delivery-{i}",
+                             daemon=True).start()
+        return session
+
+    # -- jobs ---------------------------------------------------------------
+
+    def submit(self, callback_url, work):
+        """Run work() in the background and deliver its return value; returns the job id"""
+        with self._cond:
+            if self._pending_jobs >= self.max_pending:
+                raise CallbacksBusy(f"{self._pending_jobs} callback jobs are already queued")
+            self._pending_jobs += 1
+        job_id = uuid.uuid4().hex
+        self._jobs.get().submit(self._run_job, job_id, callback_url, work)
+        self.counts["accepted"] += 1
+        return job_id
+
+    def _run_job(self, job_id, callback_url, work):
+        try:
+            try:
+                payload = work()
+            except Exception as e:
+                logger.error(f"Callback job {job_id} failed: {str(e)}")
+                payload = {"success": False, "error": f"Prediction failed: {str(e)}"}
+            self.enqueue(Delivery(job_id, callback_url, {"job_id": job_id, **payload}))
+        finally:
+            # Only after the delivery is queued, so wait_idle never sees a gap
+            with self._cond:
+                self._pending_jobs -= 1
+
+    # -- delivery -----------------------------------------------------------
+
+    def enqueue(self, delivery, delay=0.0):
+        self._delivery.get()
+        with self._cond:
+            self._sequence += 1
+            heapq.heappush(self._heap, (self.clock() + delay, self._sequence, delivery))
+            self._cond.notify()
+
+    def _next_delivery(self):
+        """Earliest due delivery whose host is under its cap; blocks until there is one"""
+        with self._cond:
+            while True:
+                now = self.clock()
+                wait = None
+                for item in sorted(self._heap):
+                    due, _, delivery = item
+                    if due > now:
+                        wait = due - now
+                        break
+                    if self._active[delivery.host] < self.max_per_host:
+                        self._heap.remove(item)
+                        heapq.heapify(self._heap)
+                        self._active[delivery.host] += 1
+                        return delivery
+                # Woken again by a new delivery or by a host slot being released
+                self._cond.wait(wait)
+
+    def _deliver_loop(self):
+        while True:
+            delivery = self._next_delivery()
+            try:
+                self._attempt(delivery)
+            finally:
+                with self._cond:
+                    self._active[delivery.host] -= 1
+                    self._cond.notify_all()
+
+    def _attempt(self, delivery):
+        delivery.attempts += 1
+        retry = True
+        try:
+            response = self._delivery.get().post(delivery.url, json=delivery.payload, timeout=self.timeout)
+            if 200 <= response.status_code < 300:
+                self.counts["delivered"] += 1
+                logger.info(f"✅ Delivered callback {delivery.job_id} after {delivery.attempts} attempt(s)")
+                return
+            delivery.last_error = f"HTTP {response.status_code}"
+            retry = response.status_code in RETRY_STATUSES
+        except Exception as e:
+            delivery.last_error = f"{type(e).__name__}: {str(e)}"
+
+        if retry and delivery.attempts < self.max_attempts:
+            delay = backoff_delay(delivery.attempts - 1, self.backoff_base, self.backoff_max)
+            self.counts["retried"] += 1
+            logger.warning(f"Callback {delivery.job_id} to {delivery.host} failed ({delivery.last_error}), "
+                           f"retrying in {delay:.1f}s")
+            self.enqueue(delivery, delay)
+            return
+        self.counts["dead_lettered"] += 1
+        logger.error(f"Callback {delivery.job_id} to {delivery.host} given up after "
+                     f"{delivery.attempts} attempt(s): {delivery.last_error}")
+        try:
+            self.dead_letters.add(delivery)
+        except OSError as e:
+            logger.error(f"Could not write dead letter for {delivery.job_id}: {str(e)}")
+
+    def redeliver(self, job_id):
+        """Move a dead-lettered callback back onto the delivery queue"""
+        record = self.dead_letters.load(job_id)
+        self.dead_letters.remove(job_id)
+        self.enqueue(Delivery(record["job_id"], record["url"], record["payload"]))
+
+    def wait_idle(self, timeout=10.0):
+        """Block until no jobs or deliveries are outstanding (used by tests and shutdown)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._cond:
+                if not self._pending_jobs and not self._heap and not sum(self._active.values()):
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def stats(self):
+        with self._cond:
+            return {
+                **{key: self.counts[key] for key in ("accepted", "delivered", "retried", "dead_lettered")},
+                "pending_jobs": self._pending_jobs,
+                "queued_deliveries": len(self._heap),
+                "in_flight": {host: n for host, n in self._active.items() if n},
+                "dead_letters": len(self.dead_letters.job_ids()),
+            }
@@ -21,14 +21,32 @@ def check_api_status():
     
     print()
     
-    # Test health endpoint
-    print("🏥 Checking health endpoint...")
+    # Test liveness endpoint
+    print("🏥 Checking liveness endpoint...")
     try:
-        response = requests.get(f"{base_url}/health", timeout=10)
-        print(f"Health endpoint status: {response.status_code}")
+        response = requests.get(f"{base_url}/healthz", timeout=10)
+        print(f"Liveness status: {response.status_code}")
         print(f"Response: {response.text[:200]}")
     except Exception as e:
-        print(f"Health endpoint failed: {e}")
+        print(f"Liveness endpoint failed: {e}")
+    
+    print()
+    
+    # Test readiness endpoint (runs a cached self-test inference)
+    print("🚦 Checking readiness endpoint...")
+    try:
+        response = requests.get(f"{base_url}/readyz", timeout=60)
+        print(f"Readiness status: {response.status_code}")
+        if response.headers.get("Content-Type", "").startswith("application/json"):
+            report = response.json()
+            print(f"   Status: {report.get('status')} {report.get('reasons', [])}")
+            print(f"   Queue depth: {report.get('queue_depth')}")
+            print(f"   p95 latency: {report.get('p95_latency_ms')} ms")
+            print(f"   Backend: {report.get('self_test', {}).get('backend')}")
+        else:
+            print(f"Response: {response.text[:200]}")
+    except Exception as e:
+        print(f"Readiness endpoint failed: {e}")
 
 if __name__ == "__main__":
     check_api_status()
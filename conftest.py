@@ -0,0 +1,37 @@
+"""
+Fixtures shared by the local tests
+
+Tests swap the app's module-level state (main.registry, main.upstream, ...)
+with monkeypatch.setattr(main, ...), so it is put back however the test ends.
+"""
+
+import pytest
+
+import main
+from fake_yolo import FakeYOLO, fake_registry
+from local_server import LocalServer
+
+
+@pytest.fixture
+def model():
+    return FakeYOLO()
+
+
+@pytest.fixture
+def registry(monkeypatch, model):
+    """A registry serving `model` under every name, installed as main.registry"""
+    registry = fake_registry(model)
+    monkeypatch.setattr(main, "registry", registry)
+    return registry
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+@pytest.fixture
+def server():
+    """A local image host / callback receiver; see LocalServer.route"""
+    with LocalServer() as server:
+        yield server
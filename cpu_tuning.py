@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+CPU budget detection and per-worker thread/affinity settings, plus an auto-tuner
+
+    python cpu_tuning.py show
+    python cpu_tuning.py autotune corpus/ --workers 1,2,4 --threads 1,2,4 --output tuning.json
+
+Each gunicorn worker runs PyTorch, OpenMP and OpenCV thread pools sized for
+the whole machine by default, so N workers start N times as many busy
+threads as there are cores. Here the cores actually available to the
+container (affinity mask and cgroup CPU quota) are split between the workers
+and every pool in a worker is sized to its share. gunicorn.conf.py applies
+this in post_fork; `autotune` measures worker x thread combinations against
+a replay corpus (see replay.py) and writes the fastest one to TUNING_CONFIG,
+which gunicorn picks up on its next start.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+CPU_TUNING = os.environ.get("CPU_TUNING", "1") == "1"
+CPU_AFFINITY = os.environ.get("CPU_AFFINITY")
+WORKER_THREADS = os.environ.get("WORKER_THREADS")
+TORCH_INTEROP_THREADS = int(os.environ.get("TORCH_INTEROP_THREADS", 1))
+TUNING_CONFIG = os.environ.get("TUNING_CONFIG", "tuning.json")
+
+# Read by OpenMP, MKL, OpenBLAS and numexpr when their pools start
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def cgroup_cpu_limit(root="/sys/fs/cgroup"):
+    """CPUs allowed by the cgroup quota (may be fractional), or None when unlimited"""
+    try:
+        with open(os.path.join(root, "cpu.max")) as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as f:
+            quota = int(f.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as f:
+            period = int(f.read())
+        return quota / period if quota > 0 and period > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus(cgroup_root="/sys/fs/cgroup"):
+    """(cpu ids this process may run on, how many of them the quota lets it keep busy)"""
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = list(range(os.cpu_count() or 1))
+    limit = cgroup_cpu_limit(cgroup_root)
+    usable = len(cpus) if limit is None else max(1, min(len(cpus), math.floor(limit + 0.01)))
+    return cpus, usable
+
+
+def split_cpus(cpus, usable, workers, threads=None):
+    """Per-worker (cpu ids, thread count) for `workers` workers sharing `usable` cores
+
+    Cores are dealt out in contiguous blocks so a worker's threads share
+    caches; with more workers than cores, workers share cores round-robin.
+    """
+    workers = max(1, workers)
+    cpus = cpus[:max(usable, 1)]
+    plans = []
+    for slot in range(workers):
+        if len(cpus) >= workers:
+            block = cpus[slot * len(cpus) // workers:(slot + 1) * len(cpus) // workers]
+        else:
+            block = [cpus[slot % len(cpus)]]
+        plans.append((block, threads or len(block)))
+    return plans
+
+
+def load_config(path=TUNING_CONFIG):
+    """The auto-tuner's chosen settings, or {} when there is no config file"""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable tuning config {path}: {str(e)}")
+        return {}
+
+
+class WorkerTuning:
+    """Thread and affinity settings for one worker slot, applied once per process"""
+
+    def __init__(self, config=None):
+        config = load_config() if config is None else config
+        self.config = config
+        self.workers = config.get("workers")
+        threads = WORKER_THREADS or config.get("threads")
+        self.threads = int(threads) if threads else None
+        affinity = CPU_AFFINITY if CPU_AFFINITY is not None else config.get("affinity", False)
+        self.affinity = affinity in (True, "1", "true")
+        self.applied = None
+        self._pid = None
+
+    def worker_count(self, default=1):
+        return int(os.environ.get("WEB_CONCURRENCY") or self.workers or default)
+
+    def claim_slot(self, taken, workers):
+        """Lowest slot not used by a live worker, so a recycled worker takes over its predecessor's cores"""
+        free = sorted(set(range(workers)) - set(taken))
+        return free[0] if free else 0
+
+    def configure(self, slot=0, workers=1):
+        """Size this process's thread pools (and optionally pin it) for its share of the CPUs"""
+        if not CPU_TUNING:
+            return None
+        cpus, usable = available_cpus()
+        block, threads = split_cpus(cpus, usable, workers, self.threads)[slot % max(1, workers)]
+        for name in THREAD_ENV_VARS:
+            os.environ[name] = str(threads)
+        if self.affinity and hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(0, block)
+            except OSError as e:
+                logger.warning(f"Could not pin worker to CPUs {block}: {str(e)}")
+        self.applied = {"slot": slot, "workers": workers, "threads": threads,
+                        "cpus": block if self.affinity else None, "usable_cpus": usable}
+        self._pid = os.getpid()
+        # OpenCV's pthreads pool ignores OMP_NUM_THREADS, so it is sized here whether or
+        # not the app was preloaded; torch is resized now if preloaded, else at warm-up
+        self.apply_pools()
+        logger.info(f"✅ Worker slot {slot}/{workers}: {threads} threads"
+                    + (f" pinned to CPUs {block}" if self.affinity else ""))
+        return self.applied
+
+    def apply_pools(self, torch=None, cv2=None):
+        """Set OpenCV's pool size, and torch's intra-op and inter-op pool sizes, in this process"""
+        if self.applied is None or self._pid != os.getpid():
+            return
+        if cv2 is None:
+            try:
+                import cv2
+            except ImportError:
+                cv2 = None
+        if cv2 is not None:
+            cv2.setNumThreads(self.applied["threads"])
+        if torch is None:
+            if "torch" not in sys.modules:
+                return
+            torch = sys.modules["torch"]
+        torch.set_num_threads(self.applied["threads"])
+        try:
+            torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+        except RuntimeError:
+            # Only settable before the first parallel work in the process
+            pass
+
+
+tuning = WorkerTuning()
+
+
+def default_sweep(usable):
+    """Worker counts and thread counts worth trying on this many cores"""
+    workers = sorted({1, 2, max(1, usable // 2), usable})
+    threads = sorted({1, 2, max(1, usable // 2), usable})
+    return workers, threads
+
+
+def summarize(results, elapsed):
+    from health import percentile
+
+    latencies = [r["latency_ms"] for r in results if r["status"] == 200]
+    return {
+        "requests": len(results),
+        "errors": sum(r["status"] != 200 for r in results),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def choose_best(runs, max_p99_ms=None):
+    """Highest throughput among error-free runs within the p99 budget (lower p99 breaks ties)"""
+    eligible = [run for run in runs if not run["errors"] and run["p99_ms"] is not None
+                and (max_p99_ms is None or run["p99_ms"] <= max_p99_ms)]
+    if not eligible:
+        return None
+    return max(eligible, key=lambda run: (run["throughput_rps"], -run["p99_ms"]))
+
+
+def gunicorn_launcher(port, affinity):
+    """Start `gunicorn -c gunicorn.conf.py main:app` for one combination; returns (url, stop)"""
+    from router import wait_until_up
+
+    def launch(workers, threads):
+        env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), WORKER_THREADS=str(threads),
+                   CPU_TUNING="1", CPU_AFFINITY="1" if affinity else "0", TUNING_CONFIG="")
+        process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"],
+                                   env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+        url = f"http://127.0.0.1:{port}"
+        if not wait_until_up(url, timeout=120):
+            process.terminate()
+            raise RuntimeError(f"gunicorn with {workers} workers did not start")
+
+        def stop():
+            process.terminate()
+            process.wait()
+        return url, stop
+    return launch
+
+
+def autotune(corpus, launch, workers_list, threads_list, concurrency=8, rounds=3, usable=None,
+             max_p99_ms=None, allow_oversubscription=False):
+    """Replay the corpus against each worker x thread combination; returns (best, runs)"""
+    from local_server import LocalServer
+    from replay import http_sender, replay_corpus
+
+    usable = usable or available_cpus()[1]
+    runs = []
+    with LocalServer() as images:
+        for workers in workers_list:
+            for threads in threads_list:
+                if workers * threads > usable and not allow_oversubscription:
+                    continue
+                url, stop = launch(workers, threads)
+                try:
+                    send = http_sender(url)
+                    # One warm-up pass so model loading isn't measured
+                    replay_corpus(corpus, send, concurrency, image_server=images)
+                    results, started = [], time.perf_counter()
+                    for _ in range(rounds):
+                        results += replay_corpus(corpus, send, concurrency, image_server=images)
+                    run = {"workers": workers, "threads": threads,
+                           **summarize(results, time.perf_counter() - started)}
+                finally:
+                    stop()
+                runs.append(run)
+                logger.info(f"{workers} workers x {threads} threads: {run['throughput_rps']} req/s, "
+                            f"p99 {run['p99_ms']} ms, {run['errors']} errors")
+    return choose_best(runs, max_p99_ms), runs
+
+
+def parse_list(value):
+    return [int(v) for v in value.split(",") if v.strip()] if value else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("show", help="Print the detected CPU budget and the per-worker split")
+    tune = commands.add_parser("autotune", help="Sweep worker x thread combinations and save the best")
+    tune.add_argument("corpus", help="Replay corpus directory (REPLAY_RECORD_DIR)")
+    tune.add_argument("--workers", help="Comma-separated worker counts (default: 1, 2, cores/2, cores)")
+    tune.add_argument("--threads", help="Comma-separated threads per worker (default: 1, 2, cores/2, cores)")
+    tune.add_argument("--concurrency", type=int, default=8)
+    tune.add_argument("--rounds", type=int, default=3)
+    tune.add_argument("--max-p99-ms", type=float, default=None)
+    tune.add_argument("--affinity", action="store_true", help="Pin each worker to its cores")
+    tune.add_argument("--oversubscribe", action="store_true", help="Also try workers x threads > cores")
+    tune.add_argument("--port", type=int, default=5099)
+    tune.add_argument("--output", default=TUNING_CONFIG or "tuning.json")
+    args = parser.parse_args(argv)
+
+    cpus, usable = available_cpus()
+    if args.command == "show":
+        workers = tuning.worker_count()
+        print(json.dumps({"cpus": cpus, "cgroup_limit": cgroup_cpu_limit(), "usable": usable,
+                          "workers": workers, "config": tuning.config,
+                          "split": [{"cpus": block, "threads": threads}
+                                    for block, threads in split_cpus(cpus, usable, workers, tuning.threads)]},
+                         indent=2))
+        return 0
+
+    default_workers, default_threads = default_sweep(usable)
+    best, runs = autotune(args.corpus, gunicorn_launcher(args.port, args.affinity),
+                          parse_list(args.workers) or default_workers, parse_list(args.threads) or default_threads,
+                          args.concurrency, args.rounds, usable, args.max_p99_ms, args.oversubscribe)
+    print(f"{'workers':>7} {'threads':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for run in runs:
+        print(f"{run['workers']:>7} {run['threads']:>7} {run['throughput_rps']:>8} {run['p50_ms']:>8} "
+              f"{run['p99_ms']:>8} {run['errors']:>6}")
+    if best is None:
+        print("No combination ran without errors within the p99 budget; nothing written")
+        return 1
+    config = {"workers": best["workers"], "threads": best["threads"], "affinity": args.affinity,
+              "usable_cpus": usable, "tuned_at": time.time(), "runs": runs}
+    with open(args.output, "w") as f:
+        json.dump(config, f, indent=2)
+    print(f"✅ Best: {best['workers']} workers x {best['threads']} threads, written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
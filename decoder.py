@@ -0,0 +1,217 @@
+import os
+import struct
+import logging
+
+from task_outputs import scale_extras
+
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 50_000_000))
+# Decode large JPEGs at 1/2, 1/4 or 1/8 size when that still covers the inference size
+DECODE_SCALING = os.environ.get("DECODE_SCALING", "1") == "1"
+
+# cv2.IMREAD_REDUCED_COLOR_2/4/8, spelled out so importing this module stays cheap.
+# OpenCV's wheels decode JPEG with libjpeg-turbo, which scales in the DCT domain
+# for these modes instead of decoding full size and resizing.
+REDUCED_MODES = {2: 17, 4: 33, 8: 65}
+IMREAD_COLOR = 1
+
+# ISO-BMFF brands of AVIF and HEIF/HEIC files
+AVIF_BRANDS = {b"avif", b"avis"}
+HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"mif1", b"msf1"}
+
+
+class ImageRejected(ValueError):
+    """The image can't or shouldn't be decoded; status is the HTTP status to answer with"""
+
+    status = 400
+
+
+class UnsupportedImage(ImageRejected):
+    status = 415
+
+
+class ImageTooLarge(ImageRejected):
+    status = 413
+
+
+class ImageInfo:
+    """Format and size read from an image's header (width/height None when unknown)"""
+
+    def __init__(self, format, width=None, height=None):
+        self.format = format
+        self.width = width
+        self.height = height
+
+
+class Decoded:
+    """A decoded image plus how it maps back onto the original
+
+    scale is (sx, sy): original pixels per decoded pixel along each axis,
+    (1.0, 1.0) unless the JPEG was decoded at a reduced size.
+    """
+
+    def __init__(self, image, format=None, scale=(1.0, 1.0)):
+        self.image = image
+        self.format = format
+        self.scale = scale
+
+    @property
+    def scaled(self):
+        return self.scale != (1.0, 1.0)
+
+    @property
+    def full_shape(self):
+        """Shape of the image at its original size"""
+        height, width = self.image.shape[:2]
+        return (round(height * self.scale[1]), round(width * self.scale[0])) + self.image.shape[2:]
+
+
+def jpeg_dimensions(data):
+    """(width, height) from a JPEG's SOF header without decoding, or None"""
+    if not data.startswith(b"\xff\xd8"):
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        # SOF0-SOF15 carry the frame size, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + length
+    return None
+
+
+def webp_dimensions(data):
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30:
+        width, height = struct.unpack_from("<HH", data, 26)
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(data) >= 25 and data[20] == 0x2F:
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    return None
+
+
+def isobmff_dimensions(data, limit=1 << 16):
+    """Largest 'ispe' (image spatial extents) property in the header: the primary image, not a thumbnail"""
+    best = None
+    position = data.find(b"ispe", 0, limit)
+    while position != -1 and position + 16 <= len(data):
+        width, height = struct.unpack_from(">II", data, position + 8)
+        if best is None or width * height > best[0] * best[1]:
+            best = (width, height)
+        position = data.find(b"ispe", position + 4, limit)
+    return best
+
+
+def sniff(data):
+    """ImageInfo from the magic bytes and header, or None if the format isn't recognized"""
+    if data.startswith(b"\xff\xd8\xff"):
+        size = jpeg_dimensions(data)
+        return ImageInfo("jpeg", *(size or (None, None)))
+    if data.startswith(b"\x89PNG\r\n\x1a\n") and len(data) >= 24:
+        return ImageInfo("png", *struct.unpack_from(">II", data, 16))
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ImageInfo("webp", *(webp_dimensions(data) or (None, None)))
+    if data[4:8] == b"ftyp":
+        brand = data[8:12]
+        if brand in AVIF_BRANDS or brand in HEIF_BRANDS:
+            compatible = {data[i:i + 4] for i in range(16, min(len(data), 64), 4)}
+            kind = "avif" if brand in AVIF_BRANDS or AVIF_BRANDS & compatible else "heif"
+            return ImageInfo(kind, *(isobmff_dimensions(data) or (None, None)))
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        return ImageInfo("gif", *struct.unpack_from("<HH", data, 6))
+    if data[:2] == b"BM" and len(data) >= 26:
+        width, height = struct.unpack_from("<ii", data, 18)
+        return ImageInfo("bmp", abs(width), abs(height))
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return ImageInfo("tiff")
+    return None
+
+
+def check_size(width, height, max_pixels=None):
+    max_pixels = MAX_IMAGE_PIXELS if max_pixels is None else max_pixels
+    if max_pixels and width and height and width * height > max_pixels:
+        raise ImageTooLarge(f"Image is {width}x{height}, over the {max_pixels} pixel limit")
+
+
+def reduction_for(info, max_side):
+    """Largest JPEG DCT scale denominator that keeps the longest side at least max_side"""
+    if not max_side or info.format != "jpeg" or not info.width:
+        return 1
+    longest = max(info.width, info.height)
+    for factor in (8, 4, 2):
+        if -(-longest // factor) >= max_side:
+            return factor
+    return 1
+
+
+def decode(data, max_side=None, max_pixels=None, scaling=None):
+    """Decoded BGR image for encoded bytes, checked against the pixel limit before decoding
+
+    With max_side (the largest inference size), a JPEG whose longest side is
+    at least twice that is decoded at a reduced size, which costs a fraction
+    of a full decode; YOLO would have shrunk it to max_side anyway.
+    """
+    import cv2
+    import numpy as np
+
+    scaling = DECODE_SCALING if scaling is None else scaling
+    info = sniff(data)
+    if info is not None:
+        if info.format == "heif":
+            raise UnsupportedImage("HEIF/HEIC images are not supported; send JPEG, PNG, WebP or AVIF")
+        check_size(info.width, info.height, max_pixels)
+    factor = reduction_for(info, max_side) if info is not None and scaling else 1
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    image = cv2.imdecode(buffer, REDUCED_MODES[factor] if factor > 1 else IMREAD_COLOR)
+    if image is None:
+        if info is not None and info.format == "avif":
+            raise UnsupportedImage("AVIF decoding is not available in this OpenCV build")
+        raise ValueError("Failed to decode image")
+    if info is None or not info.width:
+        # Formats without a readable header are only checked once decoded
+        check_size(image.shape[1], image.shape[0], max_pixels)
+    fmt = info.format if info is not None else None
+    if factor == 1:
+        return Decoded(image, fmt)
+    height, width = image.shape[:2]
+    # EXIF orientation may have rotated the image relative to the header's size
+    full_w, full_h = (info.width, info.height)
+    if (width > height) != (full_w > full_h) and full_w != full_h:
+        full_w, full_h = full_h, full_w
+    return Decoded(image, fmt, (full_w / width, full_h / height))
+
+
+def scale_detections(detections, scale):
+    """Detections from a reduced decode mapped to original-image coordinates
+
+    Lists stay lists; generators (streamed responses) are mapped lazily.
+    """
+    sx, sy = scale
+
+    def scaled(detection):
+        bbox = detection["bbox"]
+        return {**detection, **scale_extras(detection, sx, sy), "bbox": {
+            "x1": round(bbox["x1"] * sx, 2),
+            "y1": round(bbox["y1"] * sy, 2),
+            "x2": round(bbox["x2"] * sx, 2),
+            "y2": round(bbox["y2"] * sy, 2),
+        }}
+
+    if isinstance(detections, list):
+        return [scaled(detection) for detection in detections]
+    return (scaled(detection) for detection in detections)
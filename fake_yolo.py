@@ -0,0 +1,145 @@
+"""
+Lightweight stand-in for ultralytics.YOLO used by the local tests
+"""
+
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_NAMES = {0: "person", 1: "bicycle", 2: "car", 3: "motorcycle", 47: "apple"}
+
+DEFAULT_DETECTIONS = [
+    # class_id, confidence, x1, y1, x2, y2
+    (2, 0.931, 10.0, 12.0, 40.0, 44.0),
+    (0, 0.875, 5.0, 6.0, 20.0, 30.0),
+    (47, 0.512, 1.5, 2.5, 8.25, 9.75),
+]
+
+
+class FakeBoxes:
+    """Mimics ultralytics Boxes: whole-array attributes plus per-box iteration"""
+
+    def __init__(self, rows):
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, 6)
+        self.cls = rows[:, 0]
+        self.conf = rows[:, 1]
+        self.xyxy = rows[:, 2:6]
+
+    def __len__(self):
+        return len(self.cls)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            box = FakeBoxes.__new__(FakeBoxes)
+            box.cls = self.cls[i:i + 1]
+            box.conf = self.conf[i:i + 1]
+            box.xyxy = self.xyxy[i:i + 1]
+            yield box
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self
+
+
+class FakeMasks:
+    """Mimics ultralytics Masks: each box filled in a letterboxed (size x size) grid, plus outlines
+
+    Counts reads of .data and .xy so tests can check masks aren't decoded needlessly.
+    """
+
+    def __init__(self, rows, orig_shape, size=64):
+        self.rows = np.asarray(rows, dtype=np.float32).reshape(-1, 6)
+        self.orig_shape = orig_shape
+        self.size = size
+        self.reads = 0
+
+    @property
+    def data(self):
+        self.reads += 1
+        height, width = self.orig_shape
+        gain = min(self.size / max(height, 1), self.size / max(width, 1))
+        pad_y, pad_x = (self.size - height * gain) / 2, (self.size - width * gain) / 2
+        masks = np.zeros((len(self.rows), self.size, self.size), dtype=np.float32)
+        for i, (_, _, x1, y1, x2, y2) in enumerate(self.rows):
+            masks[i, int(y1 * gain + pad_y):int(np.ceil(y2 * gain + pad_y)),
+                  int(x1 * gain + pad_x):int(np.ceil(x2 * gain + pad_x))] = 1.0
+        return masks
+
+    @property
+    def xy(self):
+        self.reads += 1
+        return [np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], dtype=np.float32)
+                for _, _, x1, y1, x2, y2 in self.rows]
+
+
+class FakeKeypoints:
+    """Mimics ultralytics Keypoints: (N, 3, 3) corners and centre of each box with a visibility
+
+    Counts reads of .data, like FakeMasks.
+    """
+
+    def __init__(self, rows):
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, 6)
+        x1, y1, x2, y2 = rows[:, 2], rows[:, 3], rows[:, 4], rows[:, 5]
+        points = [(x1, y1), ((x1 + x2) / 2, (y1 + y2) / 2), (x2, y2)]
+        self._data = np.stack([np.stack([x, y, np.full_like(x, 0.9)], axis=-1) for x, y in points], axis=1)
+        self.reads = 0
+
+    @property
+    def data(self):
+        self.reads += 1
+        return self._data
+
+
+class FakeResult:
+    def __init__(self, rows, orig_shape, task="detect"):
+        self.boxes = FakeBoxes(rows)
+        self.orig_shape = orig_shape
+        self.masks = FakeMasks(rows, orig_shape) if task == "segment" else None
+        self.keypoints = FakeKeypoints(rows) if task == "pose" else None
+
+
+class FakeYOLO:
+    """Returns a fixed set of detections for every image it is given"""
+
+    def __init__(self, names=None, detections=None, delay=0.0, task="detect", overrides=None):
+        self.names = dict(names or DEFAULT_NAMES)
+        # Like a checkpoint trained at 640
+        self.overrides = {"imgsz": 640} if overrides is None else dict(overrides)
+        self.detections = list(DEFAULT_DETECTIONS if detections is None else detections)
+        self.delay = delay
+        self.task = task
+        self.calls = 0
+        self.images_seen = 0
+        self.last_kwargs = {}
+        self.last_shapes = []
+        self.last_results = []
+        self._lock = threading.Lock()
+
+    def predict(self, source=None, verbose=False, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        with self._lock:
+            self.calls += 1
+            self.images_seen += len(images)
+            self.last_kwargs = dict(kwargs)
+            self.last_shapes = [getattr(image, "shape", None) for image in images]
+        if self.delay:
+            time.sleep(self.delay)
+        results = []
+        self.last_results = results
+        for image in images:
+            shape = getattr(image, "shape", (0, 0))[:2]
+            results.append(FakeResult(self.detections, shape, self.task))
+        return results
+
+
+def fake_registry(model=None, default="base", **kwargs):
+    """ModelRegistry whose every model is `model` (a fresh FakeYOLO by default)"""
+    from model_registry import ModelRegistry
+
+    model = model or FakeYOLO()
+    return ModelRegistry(model_dir=kwargs.pop("model_dir", "/nonexistent"), default=default,
+                         loader=lambda path: model, **kwargs)
@@ -0,0 +1,44 @@
+import os
+import threading
+import weakref
+
+_instances = weakref.WeakSet()
+
+
+class ForkLocal:
+    """One value per process, built by factory the first time it is used in that process
+
+    Threads, pools, pooled sockets and locks don't survive a fork: a gunicorn
+    worker inherits the master's objects but none of the threads behind
+    them, and a lock some master thread held stays held forever. Objects that
+    may be created before the fork keep that state in a ForkLocal, and each
+    worker builds its own on first use.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self.factory()
+                    self._pid = os.getpid()
+        return self._value
+
+    def peek(self):
+        """The value if this process already built it, else None; never builds"""
+        return self._value if self._pid == os.getpid() else None
+
+
+def _after_fork_in_child():
+    # The child is single-threaded here, so nobody can be holding the new locks
+    for local in list(_instances):
+        local._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
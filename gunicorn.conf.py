@@ -0,0 +1,56 @@
+import gc
+import os
+
+from cpu_tuning import tuning
+from memory_profile import current_rss, stages
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+# WEB_CONCURRENCY wins; otherwise the worker count `cpu_tuning.py autotune` picked
+workers = tuning.worker_count()
+
+# PRELOAD_MODEL=1 imports main.py (and loads the weights) once in the master;
+# forked workers then share those pages instead of each holding a copy
+preload_app = os.environ.get("PRELOAD_MODEL") == "1"
+
+# Recycle a worker once its RSS passes this many MB (0 disables the check)
+MAX_WORKER_RSS_MB = int(os.environ.get("MAX_WORKER_RSS_MB", 0))
+
+max_requests = int(os.environ.get("MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", 0))
+
+
+def when_ready(server):
+    """Freeze everything the master allocated before the first fork
+
+    The cyclic GC writes to the header of every object it tracks, so a
+    collection in a worker would copy each page it touches. gc.freeze() moves
+    the preloaded objects out of the GC's reach and keeps those pages shared.
+    """
+    if preload_app:
+        gc.collect()
+        gc.freeze()
+        stages.mark("master_frozen")
+        server.log.info(f"Froze {gc.get_freeze_count()} objects before forking workers")
+
+
+def pre_fork(server, worker):
+    """Give the new worker a CPU slot no live worker holds (runs in the master)"""
+    taken = [getattr(w, "cpu_slot", None) for w in server.WORKERS.values()]
+    worker.cpu_slot = tuning.claim_slot(taken, workers)
+
+
+def post_fork(server, worker):
+    stages.mark("worker_forked")
+    # Split the container's cores between workers instead of every worker sizing for all of them
+    tuning.configure(getattr(worker, "cpu_slot", 0), workers)
+
+
+def post_request(worker, req, environ, resp):
+    """Gracefully restart a worker that has grown past MAX_WORKER_RSS_MB"""
+    if not MAX_WORKER_RSS_MB:
+        return
+    rss = current_rss()
+    if rss > MAX_WORKER_RSS_MB * 1024 * 1024:
+        worker.log.info(f"Worker {worker.pid} RSS {rss / 1e6:.1f} MB over "
+                        f"{MAX_WORKER_RSS_MB} MB limit, recycling")
+        worker.alive = False
@@ -0,0 +1,164 @@
+import os
+import math
+import time
+import base64
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+SELF_TEST_INTERVAL = float(os.environ.get("SELF_TEST_INTERVAL", 30))
+READY_MAX_P95_MS = float(os.environ.get("READY_MAX_P95_MS", 5000))
+READY_MAX_QUEUE = int(os.environ.get("READY_MAX_QUEUE", 8))
+LATENCY_WINDOW_S = float(os.environ.get("LATENCY_WINDOW_S", 60))
+
+# 32x32 JPEG used for the readiness self-test, so it exercises decode and inference
+SELF_TEST_JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDAA0JCgsKCA0LCgsODg0PEyAVExISEyccHhcgLikxMC4p"
+    "LSwzOko+MzZGNywtQFdBRkxOUlNSMj5aYVpQYEpRUk//2wBDAQ4ODhMREyYVFSZPNS01T09PT09P"
+    "T09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT0//wAARCAAgACADASIA"
+    "AhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUFBAQA"
+    "AAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3"
+    "ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKTlJWWl5iZmqKjpKWm"
+    "p6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEA"
+    "AwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAECAxEEBSEx"
+    "BhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYkNOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElK"
+    "U1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3"
+    "uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwDgY7T2"
+    "q3Hae1aUdp7V7fRh8Q7XQQmeER2ntVuO09q9srzrUbbdq142Os7n/wAeNe1hMY5OzR1Uqt2Uo7T2"
+    "r1KuLjtPatGNrs9bmb/v4a+LweLUU0zyqVVI6OuUurbdf3DY6ysf1NaMYuT1nl/77NSpaljk5JPJ"
+    "Jr2sPiFe6OuEz//Z"
+)
+
+
+def decode_self_test_image():
+    import cv2
+    import numpy as np
+    return cv2.imdecode(np.frombuffer(SELF_TEST_JPEG, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def model_backend(model):
+    """Describe what the model runs on, e.g. {"type": "YOLO", "device": "cpu"}"""
+    backend = {"type": type(model).__name__}
+    try:
+        backend["device"] = str(next(model.model.parameters()).device)
+    except Exception:
+        backend["device"] = str(getattr(model, "device", "unknown"))
+    return backend
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+class LatencyWindow:
+    """Latencies of recent requests, kept for the last window_s seconds"""
+
+    def __init__(self, window_s=LATENCY_WINDOW_S, maxlen=2048):
+        self.window_s = window_s
+        self._samples = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, now=None):
+        with self._lock:
+            self._samples.append((now or time.monotonic(), seconds))
+
+    def recent(self, now=None):
+        cutoff = (now or time.monotonic()) - self.window_s
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            return [seconds for _, seconds in self._samples]
+
+    def p95_ms(self):
+        p95 = percentile(self.recent(), 95)
+        return None if p95 is None else round(p95 * 1000, 1)
+
+
+class HealthMonitor:
+    """Tracks in-flight requests and latency, and caches a periodic self-test inference"""
+
+    def __init__(self, self_test, interval=SELF_TEST_INTERVAL,
+                 max_p95_ms=READY_MAX_P95_MS, max_queue=READY_MAX_QUEUE):
+        self.self_test = self_test
+        self.interval = interval
+        self.max_p95_ms = max_p95_ms
+        self.max_queue = max_queue
+        self.latency = LatencyWindow()
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._test_lock = threading.Lock()
+        self._last_test = None
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+        return time.perf_counter()
+
+    def request_finished(self, started):
+        with self._lock:
+            self.in_flight -= 1
+        self.latency.record(time.perf_counter() - started)
+
+    def _run_self_test(self):
+        start = time.perf_counter()
+        try:
+            backend = self.self_test()
+            result = {"ok": True, "backend": backend}
+        except Exception as e:
+            logger.error(f"Self-test inference failed: {str(e)}")
+            result = {"ok": False, "error": str(e)}
+        result["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        result["checked_at"] = time.time()
+        result["_monotonic"] = time.monotonic()
+        self._last_test = result
+        return result
+
+    def self_test_result(self):
+        """Last self-test, re-running it at most once per interval
+
+        Only one caller runs the test; concurrent health checks get the cached
+        result instead of queueing up inferences behind it.
+        """
+        last = self._last_test
+        if last is not None and time.monotonic() - last["_monotonic"] < self.interval:
+            return last
+        if not self._test_lock.acquire(blocking=last is None):
+            return last
+        try:
+            last = self._last_test
+            if last is not None and time.monotonic() - last["_monotonic"] < self.interval:
+                return last
+            return self._run_self_test()
+        finally:
+            self._test_lock.release()
+
+    def liveness(self):
+        return {"status": "alive", "pid": os.getpid(), "in_flight": self.in_flight}
+
+    def readiness(self):
+        """(ready, report) for the load balancer"""
+        test = self.self_test_result()
+        p95 = self.latency.p95_ms()
+        reasons = []
+        if not test["ok"]:
+            reasons.append("self-test failed")
+        if p95 is not None and p95 > self.max_p95_ms:
+            reasons.append(f"p95 latency {p95}ms over {self.max_p95_ms}ms")
+        if self.in_flight > self.max_queue:
+            reasons.append(f"queue depth {self.in_flight} over {self.max_queue}")
+        report = {
+            "status": "ready" if not reasons else "not_ready",
+            "reasons": reasons,
+            "pid": os.getpid(),
+            "queue_depth": self.in_flight,
+            "p95_latency_ms": p95,
+            "recent_requests": len(self.latency.recent()),
+            "self_test": {k: v for k, v in test.items() if not k.startswith("_")},
+        }
+        return not reasons, report
@@ -0,0 +1,106 @@
+"""
+Scriptable HTTP server on 127.0.0.1 used as an image host / callback receiver in local tests
+"""
+
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def sample_image_bytes(width=64, height=48, ext=".jpg", quality=90):
+    """Encode a small gradient image so tests have real bytes to decode"""
+    import cv2
+    import numpy as np
+
+    y, x = np.mgrid[0:height, 0:width]
+    image = np.dstack([x * 255 // max(1, width - 1), y * 255 // max(1, height - 1),
+                       np.full_like(x, 128)]).astype(np.uint8)
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if ext in (".jpg", ".jpeg") else []
+    ok, buf = cv2.imencode(ext, image, params)
+    assert ok
+    return buf.tobytes()
+
+
+class Route:
+    def __init__(self, status=200, body=b"", content_type="application/octet-stream",
+                 delay=0.0, handler=None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.delay = delay
+        self.handler = handler
+
+
+class LocalServer:
+    """Threaded HTTP server whose routes, delays and failures tests can change on the fly"""
+
+    def __init__(self):
+        self.routes = {}
+        self.hits = Counter()
+        self.received = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _serve(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                path = self.path.split("?")[0]
+                with server._lock:
+                    server.hits[path] += 1
+                    server.received.append((self.command, self.path, dict(self.headers), body))
+                route = server.routes.get(path)
+                if route is None:
+                    status, headers, payload = 404, {}, b"not found"
+                else:
+                    if route.delay:
+                        time.sleep(route.delay)
+                    if route.handler is not None:
+                        status, headers, payload = route.handler(self, body)
+                    else:
+                        status, headers, payload = route.status, {}, route.body
+                    headers.setdefault("Content-Type", route.content_type)
+                try:
+                    self.send_response(status)
+                    for key, value in headers.items():
+                        self.send_header(key, value)
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            do_GET = _serve
+            do_POST = _serve
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def route(self, path, **kwargs):
+        self.routes[path] = Route(**kwargs)
+        return self.url(path)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.port}{path}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,40 +1,75 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, has_request_context
 import os
+import math
+import time
 import logging
 import traceback
 
+from callbacks import CallbackDispatcher, CallbacksBusy, InvalidCallback, validate_callback_url
+from decoder import ImageRejected, check_size, decode, jpeg_dimensions, scale_detections
+from health import HealthMonitor, decode_self_test_image, model_backend
+from memory_profile import stages, memory_breakdown
+from model_registry import ModelRegistry
+from phash import DedupCache
+from roi import InvalidROI, crop_views, decode_jpeg_rois, offset_detections, parse_rois
+from rate_limit import RateLimiter, inference_cost
+from render import MIMETYPES, Renderer, parse_render_options, render_key
+from resolution import ResolutionPolicy
+from response_tables import encode_response, parse_fields
+from replay import ReplayRecorder
+from result_store import ResultStore, parse_time
+from shared_cache import SharedCache, decode_entry, encode_entry, result_key
+from singleflight import CoalesceTimeout, SingleFlight, request_key
+from streaming import parse_stream_option, stream_response
+from task_outputs import BOXES_ONLY, TaskOptions, chunk_extras, to_numpy
+from tracing import STATUS_ERROR, Tracer, redact_url
+from upstream import UpstreamGuard, UpstreamUnavailable
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+stages.mark("app_import")
 
-# Global variable to store the model (lazy loading)
+# Models are loaded lazily by name from MODEL_DIR; `model` is the default one
+registry = ModelRegistry()
 model = None
 model_loading_error = None
 
-def load_model():
-    """Load YOLOv8 model with comprehensive error handling"""
+DOWNLOAD_TIMEOUT = float(os.environ.get("DOWNLOAD_TIMEOUT", 15))
+upstream = UpstreamGuard()
+dedup = DedupCache()
+results_store = ResultStore.from_env()
+callbacks = CallbackDispatcher()
+resolution = ResolutionPolicy()
+renderer = Renderer()
+recorder = ReplayRecorder.from_env()
+# Opened before gunicorn forks when the app is preloaded; every worker maps the same file
+shared_cache = SharedCache.from_env()
+coalescer = SingleFlight()
+tracer = Tracer.from_env()
+
+def load_model(name=None):
+    """Load a YOLOv8 model through the registry with comprehensive error handling"""
     global model, model_loading_error
     
-    if model is not None:
+    if registry.is_resident(name):
         return True
     
     try:
         logger.info("Starting YOLOv8 model loading...")
         
-        # Import ultralytics only when needed
-        from ultralytics import YOLO
-        import cv2
-        import numpy as np
-        
-        logger.info("Dependencies imported successfully")
-        logger.info("Loading YOLOv8n model...")
-        
-        model = YOLO("yolov8n.pt")
+        handle = registry.get(name)
+        if handle.name == registry.default:
+            model = handle.model
+        model_loading_error = None
         logger.info("✅ Model loaded successfully!")
         return True
         
+    except KeyError:
+        raise
+        
     except Exception as e:
         error_msg = f"Failed to load YOLO model: {str(e)}"
         logger.error(error_msg)
@@ -42,24 +77,97 @@ def load_model():
         model_loading_error = error_msg
         return False
 
+# With gunicorn --preload the master loads the weights once and every forked
+# worker shares those pages copy-on-write (see gunicorn.conf.py)
+if os.environ.get("PRELOAD_MODEL") == "1":
+    try:
+        model = registry.preload().model
+        stages.mark("model_preload")
+    except Exception as e:
+        model_loading_error = f"Failed to preload YOLO model: {str(e)}"
+        logger.error(model_loading_error)
+
+def download_image_bytes(url):
+    """Download raw image bytes, failing fast on hosts and URLs known to be bad"""
+    import requests
+    
+    upstream.check(url)
+    
+    logger.info(f"Downloading image from: {url}")
+    started = time.perf_counter()
+    try:
+        with tracer.span("download") as span:
+            if span.recording:
+                span.set_attribute("url.full", redact_url(url))
+            response = requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+            span.set_attribute("http.response.status_code", response.status_code)
+            response.raise_for_status()
+            content = response.content
+            span.set_attribute("image.bytes", len(content))
+    except requests.HTTPError as e:
+        elapsed = time.perf_counter() - started
+        if e.response.status_code >= 500:
+            upstream.record_failure(url, elapsed)
+        else:
+            # The host answered, so it is up (and a half-open probe is settled)
+            upstream.record_success(url)
+            if e.response.status_code in (404, 410):
+                upstream.remember_bad_url(url, f"HTTP {e.response.status_code}", elapsed)
+        raise
+    except requests.RequestException:
+        # Connection errors, timeouts, broken bodies, redirect loops...
+        upstream.record_failure(url, time.perf_counter() - started)
+        raise
+    
+    upstream.record_success(url)
+    if has_request_context():
+        # Left out of the request's Server-Timing, which covers only this server's own work
+        g.download_ms = g.get("download_ms", 0.0) + (time.perf_counter() - started) * 1000
+        if recorder is not None:
+            # Kept for the replay recorder once the response is known
+            g.image_bytes = content
+    return content
+
+def decode_content(content, url=None, started=None, max_side=None):
+    """Decode image bytes into a decoder.Decoded; rejected and undecodable URLs are negatively cached
+    
+    The format and size are read from the header first, so oversized and
+    unsupported images are refused before any pixels are decoded.
+    """
+    try:
+        with tracer.span("decode", {"image.bytes": len(content)}) as span:
+            decoded = decode(content, max_side)
+            span.set_attribute("image.format", decoded.format or "unknown")
+            span.set_attribute("decode.scale", decoded.scale[0])
+        return decoded
+    except ValueError as e:
+        if url is not None:
+            elapsed = time.perf_counter() - started if started else 0.0
+            reason = str(e) if isinstance(e, ImageRejected) else "undecodable"
+            upstream.remember_bad_url(url, reason, elapsed)
+        raise
+
+def decode_image(content, url=None, started=None):
+    """Decode image bytes at full size"""
+    return decode_content(content, url, started).image
+
+def read_decoded_from_url(url, max_side=None):
+    """Download and decode image from URL; large JPEGs come back reduced towards max_side"""
+    try:
+        started = time.perf_counter()
+        decoded = decode_content(download_image_bytes(url), url, started, max_side)
+        logger.info("✅ Image loaded successfully")
+        return decoded
+        
+    except Exception as e:
+        logger.error(f"Failed to load image: {str(e)}")
+        raise
+
 def read_image_from_url(url):
     """Download and decode image from URL"""
     try:
-        import requests
-        import cv2
-        import numpy as np
-        
-        logger.info(f"Downloading image from: {url}")
-        response = requests.get(url, stream=True, timeout=15)
-        response.raise_for_status()
-        
-        # Convert to numpy array and decode
-        image_array = np.asarray(bytearray(response.content), dtype="uint8")
-        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-        
-        if image is None:
-            raise ValueError("Failed to decode image")
-            
+        started = time.perf_counter()
+        image = decode_image(download_image_bytes(url), url, started)
         logger.info("✅ Image loaded successfully")
         return image
         
@@ -67,31 +175,91 @@ def read_image_from_url(url):
         logger.error(f"Failed to load image: {str(e)}")
         raise
 
-def predict_objects(image):
+def read_rois_from_url(url, raw_rois, skip_outside=False):
+    """Download an image and return (crops, rois, (height, width)) for the requested regions
+    
+    With skip_outside, JPEG regions are cut from the compressed stream so the
+    pixels outside them are never decoded; otherwise the crops are views into
+    the fully decoded image.
+    """
+    try:
+        started = time.perf_counter()
+        content = download_image_bytes(url)
+        if skip_outside:
+            size = jpeg_dimensions(content)
+            if size is not None:
+                check_size(*size)
+                rois = parse_rois(raw_rois, *size)
+                with tracer.span("decode", {"image.bytes": len(content), "decode.rois": len(rois)}):
+                    crops = decode_jpeg_rois(content, rois)
+                if crops is not None:
+                    return crops, rois, (size[1], size[0])
+        image = decode_image(content, url, started)
+        height, width = image.shape[:2]
+        rois = parse_rois(raw_rois, width, height)
+        return crop_views(image, rois), rois, (height, width)
+        
+    except Exception as e:
+        logger.error(f"Failed to load image regions: {str(e)}")
+        raise
+
+def iter_detections(result, names, chunk_size=256, options=BOXES_ONLY):
+    """Yield detection dicts for one ultralytics result, a chunk of boxes at a time
+    
+    Only chunk_size boxes are converted to Python objects at once, so streamed
+    responses never hold the full list in memory. Masks and keypoints of
+    seg/pose models are encoded per chunk too, and only if options ask for them.
+    """
+    import numpy as np
+    
+    boxes = result.boxes
+    if boxes is None:
+        return
+    for start in range(0, len(boxes), chunk_size):
+        end = start + chunk_size
+        # Rounded a chunk at a time in NumPy rather than per value in Python
+        class_ids = to_numpy(boxes.cls[start:end]).astype(np.int64).tolist()
+        confidences = np.round(to_numpy(boxes.conf[start:end]).astype(np.float64), 3).tolist()
+        bboxes = np.round(to_numpy(boxes.xyxy[start:end]).astype(np.float64), 2).tolist()
+        extras = chunk_extras(result, start, end, options)
+        for i, (class_id, confidence, (x1, y1, x2, y2)) in enumerate(zip(class_ids, confidences, bboxes)):
+            detection = {
+                "class_id": class_id,
+                "class_name": names[class_id],
+                "confidence": confidence,
+                "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}
+            }
+            if extras:
+                for field, values in extras.items():
+                    detection[field] = values[i]
+            yield detection
+
+def result_to_detections(result, names, options=BOXES_ONLY):
+    """Convert one ultralytics result into the API's list of detection dicts"""
+    return list(iter_detections(result, names, options=options))
+
+def predict_options(imgsz=None):
+    """Extra keyword arguments for model.predict (the model's own default size when None)"""
+    return {"imgsz": imgsz} if imgsz else {}
+
+def run_predict(handle, source, imgsz=None):
+    """handle.model.predict, timed as a trace span"""
+    with tracer.span("predict", {"model": handle.name, "imgsz": imgsz or 0}):
+        return handle.model.predict(source=source, verbose=False, **predict_options(imgsz))
+
+def predict_objects(image, model_name=None, imgsz=None, options=BOXES_ONLY):
     """Run YOLO prediction on image"""
     try:
         logger.info("Running YOLO prediction...")
-        results = model.predict(source=image, verbose=False)
-        
-        detections = []
-        for result in results:
-            if result.boxes is not None:
-                for box in result.boxes:
-                    class_id = int(box.cls[0])
-                    confidence = float(box.conf[0])
-                    bbox = box.xyxy[0].tolist()
-                    
-                    detections.append({
-                        "class_id": class_id,
-                        "class_name": model.names[class_id],
-                        "confidence": round(confidence, 3),
-                        "bbox": {
-                            "x1": round(bbox[0], 2),
-                            "y1": round(bbox[1], 2),
-                            "x2": round(bbox[2], 2),
-                            "y2": round(bbox[3], 2)
-                        }
-                    })
+        with registry.acquire(model_name) as handle:
+            names = handle.table.names
+            results = run_predict(handle, image, imgsz)
+        
+        with tracer.span("boxes") as span:
+            detections = []
+            for result in results:
+                detections.extend(result_to_detections(result, names, options))
+            span.set_attribute("detections", len(detections))
         
         logger.info(f"✅ Found {len(detections)} objects")
         return detections
@@ -100,6 +268,90 @@ def predict_objects(image):
         logger.error(f"Prediction failed: {str(e)}")
         raise
 
+def predict_objects_lazy(image, model_name=None, imgsz=None, options=BOXES_ONLY):
+    """Run YOLO prediction now; boxes become dicts only as the caller consumes them"""
+    with registry.acquire(model_name) as handle:
+        names = handle.table.names
+        results = run_predict(handle, image, imgsz)
+    return (detection for result in results for detection in iter_detections(result, names, options=options))
+
+def predict_batch(images, model_name=None, imgsz=None, options=BOXES_ONLY):
+    """Run YOLO prediction on several images in one call; one detection list per image"""
+    with registry.acquire(model_name) as handle:
+        names = handle.table.names
+        results = run_predict(handle, list(images), imgsz)
+    with tracer.span("boxes", {"images": len(results)}):
+        return [result_to_detections(result, names, options) for result in results]
+
+def predict_rois(crops, rois, model_name=None, imgsz=None, options=BOXES_ONLY):
+    """Run every ROI crop through one batched inference and map boxes back to the full image"""
+    detections = []
+    for index, (roi, crop_detections) in enumerate(zip(rois, predict_batch(crops, model_name, imgsz, options))):
+        detections.extend(offset_detections(crop_detections, roi, index))
+    return detections
+
+def run_self_test():
+    """Decode the embedded test image and run it through the default model"""
+    image = decode_self_test_image()
+    with registry.acquire() as handle:
+        handle.model.predict(source=image, verbose=False)
+        return model_backend(handle.model)
+
+monitor = HealthMonitor(self_test=run_self_test)
+rate_limiter = RateLimiter.from_env()
+
+def client_key():
+    """API key identifying the calling team (anonymous callers share one bucket)"""
+    return request.headers.get("X-API-Key") or "anonymous"
+
+@app.before_request
+def track_request_start():
+    """Count /predict calls towards queue depth and latency for /readyz, and start their trace"""
+    if request.endpoint in ("predict", "predict_render"):
+        g.started = monitor.request_started()
+        span = tracer.start_request(f"{request.method} {request.path}", request.headers.get("traceparent"))
+        if span.recording:
+            span.set_attribute("http.request.method", request.method)
+            span.set_attribute("http.route", request.path)
+            tracer.activate(span)
+            g.trace_span = span
+
+@app.after_request
+def tag_traced_response(response):
+    """Tell the caller which trace their request landed in"""
+    span = g.get("trace_span")
+    if span is not None:
+        span.set_attribute("http.response.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.set_status(STATUS_ERROR)
+        response.headers["X-Trace-Id"] = f"{span.trace_id:032x}"
+    return response
+
+@app.after_request
+def add_server_timing(response):
+    """Report the time spent on the request minus the image download, for replays to compare"""
+    started = g.get("started")
+    if started is not None:
+        server_ms = (time.perf_counter() - started) * 1000 - g.get("download_ms", 0.0)
+        response.headers["Server-Timing"] = f"app;dur={server_ms:.2f}"
+        pending = g.pop("replay_entry", None)
+        if pending is not None:
+            recorder.record(*pending, server_ms)
+    return response
+
+@app.teardown_request
+def track_request_end(exc):
+    started = g.pop("started", None)
+    if started is not None:
+        monitor.request_finished(started)
+    span = g.pop("trace_span", None)
+    if span is not None:
+        # Streamed responses only get here once the last chunk is written
+        tracer.activate(None)
+        if exc is not None:
+            span.record_error(exc)
+        span.end()
+
 @app.route("/", methods=["GET"])
 def health_check():
     """Health check endpoint"""
@@ -111,7 +363,7 @@ def health_check():
         }
         
         # Check if model can be loaded (but don't actually load it unless needed)
-        if model is not None:
+        if registry.is_resident():
             status["model_status"] = "loaded"
         elif model_loading_error:
             status["model_status"] = "failed"
@@ -125,12 +377,152 @@ def health_check():
         logger.error(f"Health check failed: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route("/healthz", methods=["GET"])
+def liveness():
+    """Cheap liveness probe: the worker is up and answering"""
+    return jsonify(monitor.liveness())
+
+@app.route("/readyz", methods=["GET"])
+def readiness():
+    """Readiness probe: cached self-test inference plus recent latency and queue depth"""
+    ready, report = monitor.readiness()
+    return jsonify(report), 200 if ready else 503
+
+def choose_resolution(shape, model_name, model_requested):
+    """Inference size (and possibly a smaller model) for this image under the current load"""
+    choice = resolution.choose(shape, monitor.in_flight, monitor.latency.p95_ms(), model_requested)
+    if choice.model is not None:
+        try:
+            if not load_model(choice.model):
+                choice.model = None
+        except KeyError:
+            logger.warning(f"OVERLOAD_MODEL {choice.model} is not available")
+            choice.model = None
+    return choice, choice.model or model_name
+
+def model_version(model_name):
+    """Which weights a resident model was loaded from; part of every cache key that outlives a swap"""
+    return registry.get(model_name).version
+
+def inference_size(model_name):
+    """Longest side the model will be run at: the policy's largest step, or the checkpoint's own imgsz"""
+    if resolution.enabled:
+        return resolution.imgsz
+    # ultralytics keeps the training imgsz of a loaded checkpoint in overrides
+    imgsz = (getattr(registry.get(model_name).model, "overrides", None) or {}).get("imgsz")
+    if isinstance(imgsz, (list, tuple)):
+        imgsz = max(imgsz) if imgsz else None
+    return int(imgsz) if imgsz else None
+
+def model_task(model_name):
+    """"detect", "segment", "pose", ... for a resident model"""
+    return getattr(registry.get(model_name).model, "task", "detect")
+
+def detect(data, model_name, api_key, stream_format=None, options=BOXES_ONLY):
+    """Download the request's image and run detection; returns (result, detections, shape)
+    
+    Shared by synchronous /predict responses and callback jobs. With a
+    stream_format, detections is a generator rather than a list.
+    """
+    result = {"success": True, "model": model_name}
+    model_requested = bool(data.get("model"))
+    if data.get("rois") is not None:
+        # Region-of-interest requests only run inference on the crops
+        crops, rois, shape = read_rois_from_url(data["url"], data["rois"], bool(data.get("skip_outside_roi")))
+        rate_limiter.charge(api_key, sum(inference_cost(crop) for crop in crops))
+        largest = max((crop.shape for crop in crops), key=lambda crop_shape: max(crop_shape[:2]))
+        choice, result["model"] = choose_resolution(largest, model_name, model_requested)
+        detections = predict_rois(crops, rois, result["model"], choice.imgsz, options)
+        result["rois"] = [list(roi) for roi in rois]
+        result["resolution"] = choice.info()
+    else:
+        # Download and process image. Large JPEGs are decoded at a reduced size that
+        # still covers the inference size, when it is known; RLE masks come out at the
+        # decoded size, so those requests get the full image
+        max_side = inference_size(model_name) if options.masks != "rle" else None
+        cache_key = None
+        if shared_cache is not None and data.get("cache", True):
+            # Exact repeats are answered from the cache shared by all workers, before decoding
+            started = time.perf_counter()
+            content = download_image_bytes(data["url"])
+            cache_key = result_key(content, model_name, options, (model_version(model_name),))
+            cached = shared_cache.get(cache_key)
+            if cached is not None:
+                shape, fields, detections = decode_entry(cached)
+                result.update(fields)
+                result["cache"] = "hit"
+                return result, detections, shape
+            decoded = decode_content(content, data["url"], started, max_side)
+        else:
+            decoded = read_decoded_from_url(data["url"], max_side)
+        image, shape = decoded.image, decoded.full_shape
+        
+        # Near-duplicates of recent images reuse their (rescaled) detections;
+        # masks and keypoints can't be rescaled that way, so only boxes are cached
+        detections, dedup_info, cacheable = None, None, False
+        use_dedup = dedup.enabled and data.get("dedup", True) and model_task(model_name) == "detect"
+        if use_dedup:
+            dedup_key = model_version(model_name)
+            detections, dedup_info, image_hash = dedup.lookup(image, dedup_key)
+        if detections is None:
+            rate_limiter.charge(api_key, inference_cost(shape))
+            choice, result["model"] = choose_resolution(image.shape, model_name, model_requested)
+            result["resolution"] = choice.info()
+            if stream_format:
+                # Streamed results are never materialized, so they aren't cached either
+                detections = predict_objects_lazy(image, result["model"], choice.imgsz, options)
+            else:
+                detections = predict_objects(image, result["model"], choice.imgsz, options)
+                # Answers degraded for load shouldn't outlive the overload
+                if use_dedup and choice.reason != "load":
+                    dedup.add(image_hash, dedup_key, image.shape, detections)
+                cacheable = cache_key is not None and choice.reason != "load"
+        if decoded.scaled:
+            detections = scale_detections(detections, decoded.scale)
+        if cacheable:
+            fields = {"model": result["model"], "resolution": result["resolution"]}
+            shared_cache.put(cache_key, encode_entry(shape, fields, detections))
+        if dedup_info is not None:
+            result["dedup"] = dedup_info
+    return result, detections, shape
+
+def response_writer(model_name, fields=None):
+    """Template-based JSON writer for a model's detections, limited to the requested fields"""
+    return registry.get(model_name).table.writer(fields)
+
+def detect_shared(data, model_name, api_key, options=BOXES_ONLY):
+    """detect() for buffered results, shared with identical requests already in flight
+    
+    Duplicates arriving while the first one downloads and runs inference wait
+    for its answer (or its error) instead of repeating the work; their copy
+    of the result is marked "coalesced". Only the request that ran inference is charged for it.
+    """
+    if not coalescer.enabled:
+        return detect(data, model_name, api_key, options=options)
+    (result, detections, shape), shared = coalescer.do(
+        request_key(data, model_name, options), lambda: detect(data, model_name, api_key, options=options))
+    result = dict(result)
+    if shared:
+        # Followers get their own list, so nothing done to one response reaches another
+        detections = list(detections)
+        result["coalesced"] = True
+        tracer.current().set_attribute("coalesced", True)
+    return result, detections, shape
+
 @app.route("/predict", methods=["POST"])
 def predict():
     """Object detection endpoint"""
     try:
         logger.info("🔍 Received prediction request")
         
+        # Rate limit before any download or inference work
+        api_key = client_key()
+        decision = rate_limiter.check_request(api_key)
+        if not decision.allowed:
+            response = jsonify({"error": decision.reason, "retry_after": round(decision.retry_after, 2)})
+            response.headers["Retry-After"] = str(max(1, math.ceil(decision.retry_after)))
+            return response, 429
+        
         # Validate request
         if not request.is_json:
             return jsonify({"error": "Request must be JSON"}), 400
@@ -143,25 +535,92 @@ def predict():
         if not image_url:
             return jsonify({"error": "URL cannot be empty"}), 400
         
+        model_name = data.get("model") or registry.default
+        try:
+            stream_format = parse_stream_option(data.get("stream"))
+            fields = parse_fields(data.get("fields"))
+            options = TaskOptions.from_request(data, fields)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        callback_url = data.get("callback_url")
+        if callback_url is not None:
+            validate_callback_url(callback_url)
+            if stream_format:
+                return jsonify({"error": "'stream' and 'callback_url' can't be combined"}), 400
         logger.info(f"Processing image URL: {image_url}")
         
         # Try to load model if not already loaded
-        if not load_model():
-            return jsonify({
-                "error": "YOLO model failed to load", 
-                "details": model_loading_error
-            }), 503
+        try:
+            if not load_model(model_name):
+                return jsonify({
+                    "error": "YOLO model failed to load", 
+                    "details": model_loading_error
+                }), 503
+        except KeyError as e:
+            return jsonify({"error": str(e.args[0])}), 400
+        
+        if callback_url is not None:
+            # Accept now; download, inference and delivery happen in the background
+            request_span = tracer.current()
+            
+            def work():
+                # Runs on a job thread; its spans still belong to the request's trace
+                with tracer.use(request_span), tracer.span("callback_job"):
+                    result, detections, shape = detect_shared(data, model_name, api_key, options)
+                if results_store is not None:
+                    results_store.record(image_url, result["model"], shape, detections)
+                if fields is not None:
+                    writer = response_writer(result["model"], fields)
+                    detections = [writer.select(detection) for detection in detections]
+                return {**result, "detections": detections, "count": len(detections)}
+            
+            job_id = callbacks.submit(callback_url, work)
+            logger.info(f"✅ Accepted callback job {job_id} for {callback_url}")
+            return jsonify({"success": True, "job_id": job_id, "model": model_name, "status": "accepted"}), 202
+        
+        if stream_format:
+            result, detections, shape = detect(data, model_name, api_key, stream_format, options)
+        else:
+            result, detections, shape = detect_shared(data, model_name, api_key, options)
         
-        # Download and process image
-        image = read_image_from_url(image_url)
-        detections = predict_objects(image)
+        if stream_format:
+            logger.info(f"✅ Streaming detections as {stream_format}")
+            if results_store is not None:
+                detections = results_store.tee(detections, image_url, result["model"], shape)
+            return stream_response(detections, result, stream_format, response_writer(result["model"], fields).encode)
         
         logger.info(f"✅ Returning {len(detections)} detections")
-        return jsonify({
-            "success": True,
-            "detections": detections,
-            "count": len(detections)
-        })
+        if results_store is not None:
+            results_store.record(image_url, result["model"], shape, detections)
+        if recorder is not None:
+            # Recorded once the response is built, with the same timing it reports
+            response = {**result, "detections": detections, "count": len(detections)}
+            g.replay_entry = (data, g.pop("image_bytes", None), response)
+        # Detections are written from the model's precomputed templates rather than through jsonify
+        writer = response_writer(result["model"], fields)
+        with tracer.span("encode_json", {"detections": len(detections)}):
+            body = encode_response(result, detections, writer)
+        return app.response_class(body + "\n", mimetype="application/json")
+        
+    except (InvalidROI, InvalidCallback) as e:
+        return jsonify({"error": str(e)}), 400
+        
+    except ImageRejected as e:
+        return jsonify({"error": str(e)}), e.status
+        
+    except CoalesceTimeout as e:
+        return jsonify({"error": str(e)}), 504
+        
+    except CallbacksBusy as e:
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+        
+    except UpstreamUnavailable as e:
+        response = jsonify({"error": str(e)})
+        if e.retry_after is not None:
+            response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+        return response, e.status
         
     except Exception as e:
         error_msg = f"Prediction failed: {str(e)}"
@@ -169,13 +628,189 @@ def predict():
         logger.error(traceback.format_exc())
         return jsonify({"error": error_msg}), 500
 
+@app.route("/predict/render", methods=["GET", "POST"])
+def predict_render():
+    """Detection results drawn onto the image, as JPEG or WebP"""
+    try:
+        api_key = client_key()
+        decision = rate_limiter.check_request(api_key)
+        if not decision.allowed:
+            response = jsonify({"error": decision.reason, "retry_after": round(decision.retry_after, 2)})
+            response.headers["Retry-After"] = str(max(1, math.ceil(decision.retry_after)))
+            return response, 429
+        
+        # Dashboards load renders straight from <img src>, so query strings work too
+        data = request.get_json(silent=True) if request.method == "POST" else request.args
+        if not data or not data.get("url"):
+            return jsonify({"error": "Missing 'url' field in request"}), 400
+        image_url = data["url"]
+        model_name = data.get("model") or registry.default
+        try:
+            fmt, quality, labels = parse_render_options(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        try:
+            if not load_model(model_name):
+                return jsonify({"error": "YOLO model failed to load", "details": model_loading_error}), 503
+        except KeyError as e:
+            return jsonify({"error": str(e.args[0])}), 400
+        
+        started = time.perf_counter()
+        content = download_image_bytes(image_url)
+        key = render_key(content, model_name, fmt, quality, labels, (model_version(model_name),))
+        cached = renderer.cache.get(key)
+        hit = cached is not None
+        if not hit:
+            image = decode_image(content, image_url, started)
+            rate_limiter.charge(api_key, inference_cost(image))
+            choice, used_model = choose_resolution(image.shape, model_name, bool(data.get("model")))
+            detections = predict_objects(image, used_model, choice.imgsz)
+            with tracer.span("render", {"format": fmt, "detections": len(detections)}):
+                cached = (renderer.render(image, detections, fmt, quality, labels), len(detections))
+            # Renders degraded for load shouldn't outlive the overload
+            if choice.reason != "load":
+                renderer.cache.put(key, *cached)
+            logger.info(f"✅ Rendered {len(detections)} detections as {fmt}")
+        
+        body, count = cached
+        response = app.response_class(body, mimetype=MIMETYPES[fmt])
+        response.headers["X-Detections"] = str(count)
+        response.headers["X-Render-Cache"] = "hit" if hit else "miss"
+        response.set_etag(key)
+        return response.make_conditional(request)
+        
+    except ImageRejected as e:
+        return jsonify({"error": str(e)}), e.status
+        
+    except UpstreamUnavailable as e:
+        response = jsonify({"error": str(e)})
+        if e.retry_after is not None:
+            response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+        return response, e.status
+        
+    except Exception as e:
+        error_msg = f"Render failed: {str(e)}"
+        logger.error(error_msg)
+        logger.error(traceback.format_exc())
+        return jsonify({"error": error_msg}), 500
+
+@app.route("/quota", methods=["GET"])
+def quota():
+    """Limits and remaining inference budget for the calling API key"""
+    return jsonify(rate_limiter.usage(client_key()))
+
+@app.route("/upstream", methods=["GET"])
+def upstream_stats():
+    """Circuit breaker states and how much worker time failing fast has saved"""
+    return jsonify(upstream.stats())
+
+@app.route("/dedup", methods=["GET"])
+def dedup_stats():
+    """Near-duplicate cache hit rate and lookup cost"""
+    return jsonify(dedup.stats())
+
+@app.route("/callbacks", methods=["GET"])
+def callback_stats():
+    """Callback jobs waiting, delivered, retried and dead-lettered"""
+    return jsonify(callbacks.stats())
+
+@app.route("/coalesce", methods=["GET"])
+def coalesce_stats():
+    """How many /predict calls shared an identical request's in-flight work"""
+    return jsonify(coalescer.stats())
+
+@app.route("/tracing", methods=["GET"])
+def tracing_stats():
+    """Sampling and span export counters for this worker"""
+    return jsonify(tracer.stats())
+
+@app.route("/cache", methods=["GET"])
+def shared_cache_stats():
+    """Cross-worker result cache occupancy, plus this worker's hit rate"""
+    if shared_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **shared_cache.stats()})
+
+@app.route("/render/cache", methods=["GET"])
+def render_cache_stats():
+    """Rendered image cache size and hit rate"""
+    return jsonify(renderer.cache.stats())
+
+@app.route("/resolution", methods=["GET"])
+def resolution_stats():
+    """Adaptive resolution settings and how often each inference size was picked"""
+    return jsonify(resolution.stats())
+
+@app.route("/search", methods=["GET"])
+def search():
+    """Past /predict results filtered by class, confidence and time, newest first"""
+    if results_store is None:
+        return jsonify({"error": "Result store is disabled (set RESULT_STORE)"}), 503
+    
+    args = request.args
+    try:
+        class_ids = [int(v) for v in args.getlist("class_id")]
+        for class_name in args.getlist("class_name"):
+            # A name no model has produced yet matches nothing rather than everything
+            class_ids.extend(results_store.class_ids(class_name) or [-1])
+        results, next_cursor = results_store.search(
+            class_ids=class_ids or None,
+            min_confidence=float(args.get("min_confidence", 0.0)),
+            since=parse_time(args.get("since")),
+            until=parse_time(args.get("until")),
+            model=args.get("model"),
+            limit=int(args.get("limit", 50)),
+            cursor=int(args["cursor"]) if args.get("cursor") else None,
+        )
+    except ValueError as e:
+        return jsonify({"error": f"Invalid search parameter: {str(e)}"}), 400
+    
+    return jsonify({"results": results, "count": len(results), "next_cursor": next_cursor})
+
+@app.route("/models", methods=["GET"])
+def list_models():
+    """Resident models with their memory footprint and load time"""
+    return jsonify(registry.stats())
+
+@app.route("/models/<name>/swap", methods=["POST"])
+def swap_model(name):
+    """Reload a model from MODEL_DIR and switch traffic to it once it is warm"""
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token or request.headers.get("X-Admin-Token") != admin_token:
+        return jsonify({"error": "Forbidden"}), 403
+    
+    try:
+        handle, drained = registry.swap(name)
+    except KeyError as e:
+        return jsonify({"error": str(e.args[0])}), 404
+    except Exception as e:
+        error_msg = f"Swap failed: {str(e)}"
+        logger.error(error_msg)
+        logger.error(traceback.format_exc())
+        return jsonify({"error": error_msg}), 500
+    
+    global model
+    if name == registry.default:
+        model = handle.model
+    return jsonify({"success": True, "model": handle.info(), "old_drained": drained})
+
+@app.route("/memory", methods=["GET"])
+def memory_stats():
+    """Startup stages and the current shared/private memory split of this worker"""
+    return jsonify({
+        "pid": os.getpid(),
+        "stages": stages.stages,
+        "memory": memory_breakdown(),
+    })
+
 @app.route("/test", methods=["GET"])
 def test():
     """Simple test endpoint"""
     return jsonify({
         "status": "ok", 
         "message": "API is responding",
-        "endpoints": ["/", "/test", "/predict"]
+        "endpoints": ["/", "/test", "/healthz", "/readyz", "/predict", "/predict/render", "/quota", "/upstream", "/dedup", "/callbacks", "/resolution", "/coalesce", "/tracing", "/cache", "/render/cache", "/search", "/models", "/memory"]
     })
 
 if __name__ == "__main__":
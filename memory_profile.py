@@ -0,0 +1,92 @@
+import os
+import time
+import logging
+import importlib
+
+logger = logging.getLogger(__name__)
+
+
+def current_rss():
+    """Resident set size of this process in bytes (0 if unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def memory_breakdown():
+    """RSS split into shared and private pages, from /proc/self/smaps_rollup
+
+    Pss is the fair share of memory for one forked worker: pages still shared
+    with the master (copy-on-write) are divided between every process using them.
+    """
+    breakdown = {"rss": current_rss()}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    key = parts[0].rstrip(":").lower()
+                    breakdown[key] = int(parts[1]) * 1024
+    except OSError:
+        return breakdown
+    return {
+        "rss": breakdown.get("rss", 0),
+        "pss": breakdown.get("pss", 0),
+        "shared": breakdown.get("shared_clean", 0) + breakdown.get("shared_dirty", 0),
+        "private": breakdown.get("private_clean", 0) + breakdown.get("private_dirty", 0),
+    }
+
+
+def profile_imports(modules):
+    """Import modules one after another, recording time and RSS growth for each
+
+    Deltas are cumulative: a module's cost excludes whatever earlier modules
+    already pulled in, which is what a worker actually pays in this order.
+    """
+    report = []
+    for name in modules:
+        rss_before = current_rss()
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+            error = None
+        except Exception as e:
+            error = str(e)
+        rss_after = current_rss()
+        report.append({
+            "module": name,
+            "seconds": time.perf_counter() - start,
+            "rss_delta": max(0, rss_after - rss_before),
+            "rss": rss_after,
+            "error": error,
+        })
+    return report
+
+
+class StageTracker:
+    """Records RSS and elapsed time at named points during startup"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last_rss = current_rss()
+        self.stages = []
+
+    def mark(self, name):
+        rss = current_rss()
+        stage = {
+            "stage": name,
+            "elapsed_s": round(time.perf_counter() - self.started, 3),
+            "rss": rss,
+            "rss_delta": rss - self.last_rss,
+        }
+        self.last_rss = rss
+        self.stages.append(stage)
+        logger.info(f"📏 {name}: RSS {rss / 1e6:.1f} MB ({stage['rss_delta'] / 1e6:+.1f} MB)")
+        return stage
+
+
+# Process-wide tracker so main.py and the gunicorn hooks record into one timeline
+stages = StageTracker()
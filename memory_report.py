@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Per-stage memory breakdown of a worker: imports, app, model load, first inference
+
+Usage: python memory_report.py [--model yolov8n] [--skip-model]
+"""
+
+import argparse
+import os
+
+# Heaviest first-party dependencies, in the order a worker pulls them in
+MODULES = ["flask", "requests", "numpy", "cv2", "torch", "ultralytics"]
+
+
+def mb(value):
+    return f"{value / 1e6:8.1f} MB"
+
+
+def print_table(rows):
+    print(f"{'stage':<24}{'time':>10}{'RSS delta':>14}{'RSS total':>14}")
+    print("-" * 62)
+    for row in rows:
+        print(f"{row['stage']:<24}{row['seconds']:>9.2f}s{mb(row['rss_delta']):>14}"
+              f"{mb(row['rss']):>14}  {row.get('note', '')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=None, help="Model name to load (default: MODEL_NAME)")
+    parser.add_argument("--skip-model", action="store_true", help="Only measure imports")
+    args = parser.parse_args()
+
+    from memory_profile import current_rss, memory_breakdown, profile_imports, StageTracker
+
+    rows = [{"stage": "interpreter", "seconds": 0.0, "rss_delta": current_rss(), "rss": current_rss()}]
+    for entry in profile_imports(MODULES):
+        rows.append({
+            "stage": f"import {entry['module']}",
+            "seconds": entry["seconds"],
+            "rss_delta": entry["rss_delta"],
+            "rss": entry["rss"],
+            "note": "not installed" if entry["error"] else "",
+        })
+
+    tracker = StageTracker()
+    import main as app_module
+    stage = tracker.mark("import main")
+    rows.append({"stage": "import main", "seconds": stage["elapsed_s"],
+                 "rss_delta": stage["rss_delta"], "rss": stage["rss"]})
+
+    if not args.skip_model:
+        registry = app_module.registry
+        try:
+            handle = registry.preload(args.model)
+            stage = tracker.mark("model load")
+            rows.append({"stage": f"load {handle.name}", "seconds": handle.load_time,
+                         "rss_delta": stage["rss_delta"], "rss": stage["rss"],
+                         "note": f"weights {mb(handle.memory_bytes).strip()}"})
+
+            before = stage["elapsed_s"]
+            registry.warmup(handle.model)
+            stage = tracker.mark("first inference")
+            rows.append({"stage": "first inference", "seconds": stage["elapsed_s"] - before,
+                         "rss_delta": stage["rss_delta"], "rss": stage["rss"]})
+        except Exception as e:
+            rows.append({"stage": "model load", "seconds": 0.0, "rss_delta": 0,
+                         "rss": current_rss(), "note": f"failed: {e}"})
+
+    print(f"🧮 Memory report for pid {os.getpid()}")
+    print()
+    print_table(rows)
+    print()
+    breakdown = memory_breakdown()
+    for key in ("rss", "pss", "shared", "private"):
+        if key in breakdown:
+            print(f"{key.upper():<8}{mb(breakdown[key])}")
+    print()
+    print("With PRELOAD_MODEL=1 the shared pages are paid once by the master;")
+    print("each extra gunicorn worker then adds roughly its private memory.")
+
+
+if __name__ == "__main__":
+    main()
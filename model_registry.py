@@ -0,0 +1,249 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from memory_profile import current_rss
+from response_tables import ResponseTable
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.environ.get("MODEL_DIR", "models")
+DEFAULT_MODEL = os.environ.get("MODEL_NAME", "yolov8n")
+MAX_RESIDENT_MODELS = int(os.environ.get("MAX_RESIDENT_MODELS", 2))
+
+# Official weights ultralytics can fetch by name when they are not in MODEL_DIR
+BUILTIN_MODELS = {"yolov8n", "yolov8s", "yolov8m", "yolov8l", "yolov8x"}
+
+
+def load_yolo(path):
+    """Default loader: build an ultralytics YOLO model from a weights file"""
+    from ultralytics import YOLO
+    return YOLO(path)
+
+
+def warm_up(model):
+    """Run one tiny inference so the first real request doesn't pay for it"""
+    import numpy as np
+    from cpu_tuning import tuning
+    
+    # Size torch's and OpenCV's pools for this worker before the first inference starts them
+    tuning.apply_pools()
+    model.predict(source=np.zeros((64, 64, 3), dtype=np.uint8), verbose=False)
+
+
+def parameter_bytes(model):
+    """Size of the model weights in bytes, or None if the model doesn't expose them"""
+    try:
+        return sum(p.numel() * p.element_size() for p in model.model.parameters())
+    except Exception:
+        return None
+
+
+def weights_version(path, loaded_at):
+    """Identifies the weights a handle was loaded from, for keys of caches that outlive a swap
+
+    Workers that loaded the same file agree on it; a swap to replaced weights
+    changes it. Without a file to stat, the load time is all there is.
+    """
+    try:
+        stat = os.stat(path)
+        return f"{path}@{stat.st_mtime_ns}:{stat.st_size}"
+    except OSError:
+        return f"{path}@{loaded_at}"
+
+
+class ModelHandle:
+    """A resident model plus the bookkeeping needed to drain it"""
+
+    def __init__(self, name, path, model, load_time, memory_bytes):
+        self.name = name
+        self.path = path
+        self.model = model
+        self.load_time = load_time
+        self.memory_bytes = memory_bytes
+        self.loaded_at = time.time()
+        self.version = weights_version(path, self.loaded_at)
+        self.retired = False
+        self.in_flight = 0
+        self.requests = 0
+        self._drained = threading.Condition()
+        self._table = None
+
+    @property
+    def table(self):
+        """Precomputed class names and JSON fragments for this model's responses"""
+        if self._table is None:
+            self._table = ResponseTable(self.model.names)
+        return self._table
+
+    def _enter(self):
+        with self._drained:
+            self.in_flight += 1
+            self.requests += 1
+
+    def _exit(self):
+        with self._drained:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._drained.notify_all()
+
+    def wait_drained(self, timeout=None):
+        """Block until no request is using this model; returns False on timeout"""
+        with self._drained:
+            return self._drained.wait_for(lambda: self.in_flight == 0, timeout)
+
+    def info(self):
+        return {
+            "name": self.name,
+            "path": self.path,
+            "load_time_s": round(self.load_time, 3),
+            "memory_bytes": self.memory_bytes,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "loaded_at": self.loaded_at,
+            "version": self.version,
+        }
+
+
+class ModelRegistry:
+    """Loads models by name from a directory and keeps at most max_resident in memory"""
+
+    def __init__(self, model_dir=MODEL_DIR, default=DEFAULT_MODEL,
+                 max_resident=MAX_RESIDENT_MODELS, loader=load_yolo, warmup=warm_up):
+        self.model_dir = model_dir
+        self.default = default
+        self.max_resident = max(1, max_resident)
+        self.loader = loader
+        self.warmup = warmup
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.evictions = 0
+        self.swaps = 0
+
+    def available(self):
+        """Names that can be requested: weights in model_dir plus built-in names"""
+        names = set(BUILTIN_MODELS) | {self.default}
+        if os.path.isdir(self.model_dir):
+            for filename in os.listdir(self.model_dir):
+                stem, ext = os.path.splitext(filename)
+                if ext == ".pt":
+                    names.add(stem)
+        return sorted(names)
+
+    def resolve(self, name):
+        """Map a model name to a weights path, rejecting anything not on offer"""
+        name = name or self.default
+        if name not in self.available():
+            raise KeyError(f"Unknown model '{name}'")
+        local = os.path.join(self.model_dir, f"{name}.pt")
+        return name, local if os.path.exists(local) else f"{name}.pt"
+
+    def _build(self, name, path, warmup=True):
+        logger.info(f"Loading model '{name}' from {path}...")
+        rss_before = current_rss()
+        start = time.perf_counter()
+        model = self.loader(path)
+        if warmup and self.warmup:
+            self.warmup(model)
+        load_time = time.perf_counter() - start
+        memory = parameter_bytes(model)
+        if memory is None:
+            memory = max(0, current_rss() - rss_before)
+        logger.info(f"✅ Model '{name}' ready in {load_time:.2f}s ({memory / 1e6:.1f} MB)")
+        return ModelHandle(name, path, model, load_time, memory)
+
+    def _evict(self):
+        """Drop least recently used models past the cap (caller holds _lock)"""
+        while len(self._resident) > self.max_resident:
+            name, handle = self._resident.popitem(last=False)
+            handle.retired = True
+            self.evictions += 1
+            logger.info(f"Evicted model '{name}' (LRU)")
+
+    def get(self, name=None):
+        """Return the handle for a model, loading it if it is not resident"""
+        name, path = self.resolve(name)
+        with self._lock:
+            handle = self._resident.get(name)
+            if handle is not None:
+                self._resident.move_to_end(name)
+                return handle
+        with self._load_lock:
+            with self._lock:
+                handle = self._resident.get(name)
+                if handle is not None:
+                    self._resident.move_to_end(name)
+                    return handle
+            handle = self._build(name, path)
+            with self._lock:
+                self._resident[name] = handle
+                self._evict()
+            return handle
+
+    def preload(self, name=None):
+        """Load a model without warming it up, for use in a master process before fork
+
+        Running inference starts torch/OpenMP thread pools, which don't survive
+        fork(); the weights themselves are plain memory and stay shared.
+        """
+        name, path = self.resolve(name)
+        with self._load_lock:
+            handle = self._build(name, path, warmup=False)
+            with self._lock:
+                self._resident[name] = handle
+                self._evict()
+        return handle
+
+    @contextmanager
+    def acquire(self, name=None):
+        """Use a model for the duration of one request so swaps can drain it"""
+        while True:
+            handle = self.get(name)
+            handle._enter()
+            if not handle.retired:
+                break
+            # Swapped out between lookup and entry; pick up the replacement
+            handle._exit()
+        try:
+            yield handle
+        finally:
+            handle._exit()
+
+    def swap(self, name, path=None, drain_timeout=30.0):
+        """Atomically replace a model: warm the new one up, switch, then drain the old one"""
+        if path is None:
+            name, path = self.resolve(name)
+        with self._load_lock:
+            new = self._build(name, path)
+            with self._lock:
+                old = self._resident.get(name)
+                self._resident[name] = new
+                self._resident.move_to_end(name)
+                self._evict()
+                self.swaps += 1
+        drained = True
+        if old is not None:
+            old.retired = True
+            drained = old.wait_drained(drain_timeout)
+            logger.info(f"Swapped model '{name}' (old drained: {drained})")
+        return new, drained
+
+    def is_resident(self, name=None):
+        with self._lock:
+            return (name or self.default) in self._resident
+
+    def stats(self):
+        with self._lock:
+            resident = [handle.info() for handle in self._resident.values()]
+        return {
+            "default": self.default,
+            "max_resident": self.max_resident,
+            "resident": resident,
+            "available": self.available(),
+            "evictions": self.evictions,
+            "swaps": self.swaps,
+        }
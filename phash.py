@@ -0,0 +1,178 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEDUP_ENABLED = os.environ.get("DEDUP_ENABLED") == "1"
+DEDUP_THRESHOLD = int(os.environ.get("DEDUP_THRESHOLD", 6))
+DEDUP_CAPACITY = int(os.environ.get("DEDUP_CAPACITY", 10000))
+DEDUP_HASH = os.environ.get("DEDUP_HASH", "dhash")
+# Re-encodes and thumbnails keep their aspect ratio; crops don't
+DEDUP_MAX_ASPECT_DRIFT = float(os.environ.get("DEDUP_MAX_ASPECT_DRIFT", 0.02))
+
+HASH_BITS = 64
+
+
+def _gray(image):
+    import cv2
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+def dhash(image):
+    """64-bit difference hash: sign of horizontal gradients on a 9x8 thumbnail"""
+    import cv2
+    import numpy as np
+
+    small = cv2.resize(_gray(image), (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def phash(image):
+    """64-bit DCT hash: low frequencies of a 32x32 thumbnail compared to their median"""
+    import cv2
+    import numpy as np
+
+    small = cv2.resize(_gray(image), (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].ravel()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+HASHES = {"dhash": dhash, "phash": phash}
+
+
+def rescale_detections(detections, from_shape, to_shape):
+    """Map cached boxes from the image they were computed on to a resized copy"""
+    sy = to_shape[0] / from_shape[0]
+    sx = to_shape[1] / from_shape[1]
+    rescaled = []
+    for detection in detections:
+        bbox = detection["bbox"]
+        rescaled.append({**detection, "bbox": {
+            "x1": round(bbox["x1"] * sx, 2),
+            "y1": round(bbox["y1"] * sy, 2),
+            "x2": round(bbox["x2"] * sx, 2),
+            "y2": round(bbox["y2"] * sy, 2),
+        }})
+    return rescaled
+
+
+class MultiIndexHash:
+    """Hamming-radius search over 64-bit hashes by multi-index hashing
+
+    The hash is split into threshold + 1 chunks. Two hashes within `threshold`
+    bits of each other must agree exactly on at least one chunk (pigeonhole),
+    so candidates come from exact-match lookups in one table per chunk and only
+    those are checked with a full popcount.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD):
+        self.threshold = threshold
+        chunks = threshold + 1
+        widths = [HASH_BITS // chunks + (1 if i < HASH_BITS % chunks else 0) for i in range(chunks)]
+        self._chunks = []
+        shift = HASH_BITS
+        for width in widths:
+            shift -= width
+            self._chunks.append((shift, (1 << width) - 1))
+        self._tables = [{} for _ in self._chunks]
+
+    def _keys(self, value):
+        return [(value >> shift) & mask for shift, mask in self._chunks]
+
+    def add(self, value, item_id):
+        for table, key in zip(self._tables, self._keys(value)):
+            table.setdefault(key, set()).add(item_id)
+
+    def remove(self, value, item_id):
+        for table, key in zip(self._tables, self._keys(value)):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(item_id)
+                if not bucket:
+                    del table[key]
+
+    def candidates(self, value):
+        found = set()
+        for table, key in zip(self._tables, self._keys(value)):
+            found.update(table.get(key, ()))
+        return found
+
+
+class DedupCache:
+    """Near-duplicate image cache: reuse detections for re-encodes, resizes and thumbnails"""
+
+    def __init__(self, enabled=DEDUP_ENABLED, threshold=DEDUP_THRESHOLD, capacity=DEDUP_CAPACITY,
+                 hash_name=DEDUP_HASH, max_aspect_drift=DEDUP_MAX_ASPECT_DRIFT):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.capacity = capacity
+        self.hash_fn = HASHES[hash_name]
+        self.max_aspect_drift = max_aspect_drift
+        self.index = MultiIndexHash(threshold)
+        self._entries = OrderedDict()  # id -> (hash, key, shape, detections)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.lookup_seconds = 0.0
+
+    def lookup(self, image, key):
+        """Return (detections or None, per-request info, hash) for a decoded image
+
+        `key` separates results that must not be shared, e.g. different models.
+        """
+        started = time.perf_counter()
+        value = self.hash_fn(image)
+        height, width = image.shape[:2]
+        best = None
+        with self._lock:
+            for item_id in self.index.candidates(value):
+                cached_value, cached_key, shape, detections = self._entries[item_id]
+                if cached_key != key:
+                    continue
+                distance = (value ^ cached_value).bit_count()
+                if distance > self.threshold:
+                    continue
+                aspect = (width / height) / (shape[1] / shape[0])
+                if abs(aspect - 1) > self.max_aspect_drift:
+                    continue
+                if best is None or distance < best[0]:
+                    best = (distance, item_id, shape, detections)
+            if best is not None:
+                self._entries.move_to_end(best[1])
+            elapsed = time.perf_counter() - started
+            self.lookups += 1
+            self.lookup_seconds += elapsed
+            if best is not None:
+                self.hits += 1
+        info = {"hit": best is not None, "lookup_ms": round(elapsed * 1000, 3)}
+        if best is None:
+            return None, info, value
+        info["distance"] = best[0]
+        return rescale_detections(best[3], best[2], image.shape), info, value
+
+    def add(self, value, key, shape, detections):
+        with self._lock:
+            item_id = self._next_id
+            self._next_id += 1
+            self._entries[item_id] = (value, key, tuple(shape[:2]), detections)
+            self.index.add(value, item_id)
+            while len(self._entries) > self.capacity:
+                old_id, (old_value, *_rest) = self._entries.popitem(last=False)
+                self.index.remove(old_value, old_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "avg_lookup_ms": round(self.lookup_seconds / self.lookups * 1000, 3) if self.lookups else 0.0,
+            }
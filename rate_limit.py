@@ -0,0 +1,219 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import logging
+import threading
+
+from forklocal import ForkLocal
+
+logger = logging.getLogger(__name__)
+
+# One cost unit is one model-input-sized tile of pixels
+COST_UNIT_PIXELS = int(os.environ.get("COST_UNIT_PIXELS", 640 * 640))
+# In-memory buckets untouched for this long (and not in debt) are dropped
+RATE_LIMIT_IDLE_SECONDS = float(os.environ.get("RATE_LIMIT_IDLE_SECONDS", 3600))
+PRUNE_EVERY = 1024
+
+
+def inference_cost(image, tiles=1):
+    """Cost units for one image (or image shape): how many 640x640 tiles its pixels cover, at least `tiles`"""
+    height, width = getattr(image, "shape", image)[:2]
+    return max(tiles, math.ceil(height * width / COST_UNIT_PIXELS))
+
+
+def refill(state, rate, capacity, now):
+    """Top a (tokens, updated_at) bucket up for the time elapsed since its last update"""
+    if state is None:
+        return float(capacity)
+    tokens, updated = state
+    return min(float(capacity), tokens + max(0.0, now - updated) * rate)
+
+
+class MemoryStore:
+    """Buckets in a dict; limits are per worker process"""
+
+    def __init__(self, idle_after=RATE_LIMIT_IDLE_SECONDS):
+        self.idle_after = idle_after
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def transact(self, key, fn):
+        """Atomically apply fn(state) -> (new_state, result) to one bucket"""
+        with self._lock:
+            new_state, result = fn(self._buckets.get(key))
+            self._buckets[key] = new_state
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self._prune(new_state[1])
+            return result
+
+    def peek(self, key):
+        with self._lock:
+            return self._buckets.get(key)
+
+    def _prune(self, now):
+        # A bucket idle this long has refilled; one still in debt keeps its debt
+        cutoff = now - self.idle_after
+        idle = [key for key, (tokens, updated) in self._buckets.items() if updated < cutoff and tokens >= 0]
+        for key in idle:
+            del self._buckets[key]
+
+
+class SQLiteStore:
+    """Buckets in a local SQLite file so every gunicorn worker shares the same limits"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = ForkLocal(threading.local)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        local = self._local.get()
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            local.conn = conn
+        return conn
+
+    def transact(self, key, fn):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            new_state, result = fn(tuple(row) if row else None)
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, new_state[0], new_state[1]),
+            )
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def peek(self, key):
+        row = self._connect().execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        return tuple(row) if row else None
+
+
+def store_from_env(spec=None):
+    """RATE_LIMIT_STORE is "memory" (default) or "sqlite:<path>" """
+    spec = spec or os.environ.get("RATE_LIMIT_STORE", "memory")
+    if spec.startswith("sqlite:"):
+        return SQLiteStore(spec[len("sqlite:"):])
+    return MemoryStore()
+
+
+class Decision:
+    def __init__(self, allowed, reason=None, retry_after=0.0, remaining=None, budget=None):
+        self.allowed = allowed
+        self.reason = reason
+        self.retry_after = retry_after
+        self.remaining = remaining
+        self.budget = budget
+
+
+class RateLimiter:
+    """Per API key token bucket for requests plus a refilling inference-cost budget
+
+    limits maps an API key (or "default") to {"rps", "burst", "cost_per_hour"};
+    a missing or zero value switches that limit off. Only keys listed in
+    limits get buckets of their own; every other key shares the "anonymous"
+    buckets, so minting new keys doesn't buy new tokens.
+    """
+
+    def __init__(self, limits=None, store=None, clock=time.time):
+        self.limits = limits or {}
+        self.store = store or MemoryStore()
+        self.clock = clock
+
+    @classmethod
+    def from_env(cls):
+        limits = {"default": {
+            "rps": float(os.environ.get("RATE_LIMIT_RPS", 0)),
+            "burst": float(os.environ.get("RATE_LIMIT_BURST", 0)),
+            "cost_per_hour": float(os.environ.get("QUOTA_UNITS_PER_HOUR", 0)),
+        }}
+        limits_file = os.environ.get("RATE_LIMITS_FILE")
+        if limits_file:
+            with open(limits_file) as f:
+                limits.update(json.load(f))
+        return cls(limits, store_from_env())
+
+    def limits_for(self, api_key):
+        if api_key in self.limits:
+            return self.limits[api_key]
+        return self.limits.get("default") or {}
+
+    def bucket_for(self, api_key):
+        """Name of the buckets a key draws from"""
+        return api_key if api_key in self.limits and api_key != "default" else "anonymous"
+
+    def _take(self, key, amount, rate, capacity, allow_debt=False):
+        """Take `amount` tokens if there are enough; with allow_debt always take them"""
+        now = self.clock()
+
+        def update(state):
+            tokens = refill(state, rate, capacity, now)
+            allowed = allow_debt or tokens >= amount
+            if allowed:
+                tokens -= amount
+            return (tokens, now), (allowed, tokens)
+
+        return self.store.transact(key, update)
+
+    def check_request(self, api_key):
+        """Admit one request, before any download or inference work is done"""
+        limits = self.limits_for(api_key)
+        rps = limits.get("rps") or 0
+        remaining = None
+        if rps:
+            burst = limits.get("burst") or max(1.0, rps)
+            allowed, remaining = self._take(f"req:{self.bucket_for(api_key)}", 1, rps, burst)
+            if not allowed:
+                return Decision(False, "rate limit exceeded", (1 - remaining) / rps, 0)
+        budget = self.budget(api_key)
+        if budget is not None and budget <= 0:
+            per_hour = limits["cost_per_hour"]
+            return Decision(False, "inference quota exceeded",
+                            (1 - budget) * 3600 / per_hour, remaining, budget)
+        return Decision(True, remaining=remaining, budget=budget)
+
+    def charge(self, api_key, units):
+        """Charge the actual inference cost once the image size is known
+
+        The budget only has to be positive to admit a request, so one large
+        image can overdraw it and the debt is paid back by later refills.
+        """
+        per_hour = self.limits_for(api_key).get("cost_per_hour") or 0
+        if not per_hour:
+            return None
+        _, balance = self._take(f"cost:{self.bucket_for(api_key)}", units, per_hour / 3600, per_hour,
+                                allow_debt=True)
+        return balance
+
+    def budget(self, api_key):
+        """Remaining cost units for a key (None when it has no budget), without touching the store"""
+        per_hour = self.limits_for(api_key).get("cost_per_hour") or 0
+        if not per_hour:
+            return None
+        state = self.store.peek(f"cost:{self.bucket_for(api_key)}")
+        return refill(state, per_hour / 3600, per_hour, self.clock())
+
+    def usage(self, api_key):
+        limits = self.limits_for(api_key)
+        return {
+            "api_key": api_key,
+            "bucket": self.bucket_for(api_key),
+            "limits": limits,
+            "budget_remaining": self.budget(api_key),
+        }
@@ -0,0 +1,233 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from forklocal import ForkLocal
+
+logger = logging.getLogger(__name__)
+
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 2))
+RENDER_QUALITY = int(os.environ.get("RENDER_QUALITY", 85))
+RENDER_CACHE_MB = float(os.environ.get("RENDER_CACHE_MB", 64))
+RENDER_TIMEOUT = float(os.environ.get("RENDER_TIMEOUT", 30))
+
+RENDER_FORMATS = {"jpeg": ".jpg", "webp": ".webp"}
+MIMETYPES = {"jpeg": "image/jpeg", "webp": "image/webp"}
+# cv2.IMWRITE_JPEG_QUALITY / cv2.IMWRITE_WEBP_QUALITY, spelled out so importing this module stays cheap
+QUALITY_FLAGS = {"jpeg": 1, "webp": 64}
+
+# 20 well-separated BGR colors, picked by class_id
+PALETTE = [
+    (56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207),
+    (10, 249, 72), (23, 204, 146), (134, 219, 61), (52, 147, 26), (187, 212, 0),
+    (168, 153, 44), (255, 194, 0), (147, 69, 52), (255, 115, 100), (236, 24, 0),
+    (255, 56, 132), (133, 0, 82), (255, 56, 203), (200, 149, 255), (199, 55, 255),
+]
+
+
+def parse_render_options(data):
+    """(format, quality, labels) from request fields; raises ValueError on bad values"""
+    fmt = str(data.get("format") or "jpeg").lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in RENDER_FORMATS:
+        raise ValueError(f"'format' must be one of {sorted(RENDER_FORMATS)}")
+    quality = data.get("quality")
+    quality = RENDER_QUALITY if quality in (None, "") else int(quality)
+    if not 1 <= quality <= 100:
+        raise ValueError("'quality' must be between 1 and 100")
+    labels = data.get("labels", True)
+    if isinstance(labels, str):
+        labels = labels.lower() not in ("0", "false", "no")
+    return fmt, quality, bool(labels)
+
+
+class LabelSprites:
+    """Anti-aliased text masks, rendered once per string and size and then reused
+
+    Class names get one sprite each; confidences are assembled from digit
+    glyphs, so no text is rasterized per detection after warm-up.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._sprites = {}
+        self._lock = threading.Lock()
+
+    def _rasterize(self, text, scale):
+        import cv2
+        import numpy as np
+        
+        thickness = max(1, int(round(scale * 2)))
+        (width, height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+        mask = np.zeros((height + baseline + 2, width + 2), dtype=np.uint8)
+        cv2.putText(mask, text, (1, height + 1), cv2.FONT_HERSHEY_SIMPLEX, scale, 255, thickness, cv2.LINE_AA)
+        return mask
+
+    def sprite(self, text, scale):
+        key = (text, scale)
+        mask = self._sprites.get(key)
+        if mask is None:
+            mask = self._rasterize(text, scale)
+            with self._lock:
+                if len(self._sprites) >= self.max_entries:
+                    self._sprites.clear()
+                self._sprites[key] = mask
+        return mask
+
+    def label(self, class_name, confidence, scale):
+        import numpy as np
+        
+        parts = [self.sprite(f"{class_name} ", scale)]
+        if confidence is not None:
+            parts.extend(self.sprite(char, scale) for char in f"{confidence:.2f}")
+        height = max(part.shape[0] for part in parts)
+        return np.hstack([np.pad(part, ((height - part.shape[0], 0), (0, 0))) for part in parts])
+
+
+sprites = LabelSprites()
+
+
+def style_for(shape):
+    """Box line thickness and label font scale for an image size"""
+    longest = max(shape[:2])
+    thickness = max(1, int(round(longest / 400)))
+    scale = max(0.3, round(longest / 1600, 1))
+    return thickness, scale
+
+
+def draw_detections(image, detections, labels=True):
+    """A copy of image with boxes and labels drawn on it
+
+    Boxes and label backgrounds are painted as palette indices into one
+    uint8 plane, which is then applied to the image in a single vectorized
+    lookup; label text is stamped into one alpha plane and blended once.
+    """
+    import numpy as np
+    
+    palette = np.array(PALETTE, dtype=np.uint8)
+    height, width = image.shape[:2]
+    thickness, scale = style_for(image.shape)
+    paint = np.zeros((height, width), dtype=np.uint8)
+    text = np.zeros((height, width), dtype=np.uint8) if labels else None
+
+    def clip(x, y):
+        return min(max(int(x), 0), width), min(max(int(y), 0), height)
+
+    for detection in detections:
+        color = detection["class_id"] % len(palette) + 1
+        bbox = detection["bbox"]
+        x1, y1 = clip(bbox["x1"], bbox["y1"])
+        x2, y2 = clip(bbox["x2"], bbox["y2"])
+        if x2 <= x1 or y2 <= y1:
+            continue
+        t = min(thickness, (x2 - x1 + 1) // 2, (y2 - y1 + 1) // 2) or 1
+        paint[y1:y1 + t, x1:x2] = color
+        paint[y2 - t:y2, x1:x2] = color
+        paint[y1:y2, x1:x1 + t] = color
+        paint[y1:y2, x2 - t:x2] = color
+        if labels:
+            mask = sprites.label(detection["class_name"], detection.get("confidence"), scale)
+            # Above the box when there is room, otherwise just inside it
+            ly = y1 - mask.shape[0] if y1 >= mask.shape[0] else y1
+            lh, lw = min(mask.shape[0], height - ly), min(mask.shape[1], width - x1)
+            if lh <= 0 or lw <= 0:
+                continue
+            paint[ly:ly + lh, x1:x1 + lw] = color
+            np.maximum(text[ly:ly + lh, x1:x1 + lw], mask[:lh, :lw], out=text[ly:ly + lh, x1:x1 + lw])
+
+    out = image.copy()
+    painted = paint > 0
+    out[painted] = palette[paint[painted] - 1]
+    if labels:
+        rows, cols = np.nonzero(text)
+        if len(rows):
+            alpha = text[rows, cols, None].astype(np.uint16)
+            out[rows, cols] = ((out[rows, cols] * (255 - alpha) + 255 * alpha) // 255).astype(np.uint8)
+    return out
+
+
+def encode(image, fmt="jpeg", quality=RENDER_QUALITY):
+    import cv2
+    
+    ok, buf = cv2.imencode(RENDER_FORMATS[fmt], image, [QUALITY_FLAGS[fmt], int(quality)])
+    if not ok:
+        raise ValueError(f"Failed to encode {fmt}")
+    return buf.tobytes()
+
+
+def render_key(content, model, fmt, quality, labels, extra=()):
+    """Cache key: hash of the source bytes plus everything that changes the output"""
+    digest = hashlib.sha1(content).hexdigest()
+    params = "|".join(str(part) for part in (model, fmt, quality, int(labels), *extra))
+    return f"{digest}:{hashlib.sha1(params.encode()).hexdigest()[:16]}"
+
+
+class RenderCache:
+    """LRU of encoded renders, bounded by total bytes"""
+
+    def __init__(self, max_bytes=int(RENDER_CACHE_MB * 1e6)):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, count):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[0])
+            self._entries[key] = (body, count)
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+class Renderer:
+    """Draws and encodes on a small thread pool so request threads only wait on the result
+
+    OpenCV releases the GIL while encoding, so renders for different
+    requests overlap, and RENDER_WORKERS bounds how many cores they take.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS, cache=None, timeout=RENDER_TIMEOUT):
+        self.workers = workers
+        self.cache = cache or RenderCache()
+        self.timeout = timeout
+        self._pool = ForkLocal(lambda: ThreadPoolExecutor(self.workers, thread_name_prefix="render"))
+
+    def _render(self, image, detections, fmt, quality, labels):
+        return encode(draw_detections(image, detections, labels), fmt, quality)
+
+    def render(self, image, detections, fmt="jpeg", quality=RENDER_QUALITY, labels=True):
+        future = self._pool.get().submit(self._render, image, detections, fmt, quality, labels)
+        return future.result(timeout=self.timeout)
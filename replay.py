@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Record /predict traffic into a local corpus, replay it against a build, and diff the results
+
+    python replay.py run corpus/ --output new.ndjson                         # in-process app
+    python replay.py run corpus/ --target http://127.0.0.1:5000 --output new.ndjson
+    python replay.py compare corpus/ new.ndjson --iou 0.5 --max-mismatch 0.01 --max-p95-regression 0.25
+
+A corpus is a directory with requests.ndjson (one recorded request per line:
+parameters, image file, response detections and server time) and images/
+holding the image bytes by content hash. The app records into one when
+REPLAY_RECORD_DIR is set. Replays serve the images from a local HTTP server, so
+runs don't depend on the original hosts. `compare` accepts a corpus or a replay
+output on either side and exits 1 when detections or p95 latency regress past
+the thresholds.
+
+Latency is compared on server_ms, the server's own time for the request without
+the image download, as reported in its Server-Timing header. Recorded and
+replayed requests measure it the same way; a replay's client-side latency_ms
+also includes the network and the local image server.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from forklocal import ForkLocal
+
+logger = logging.getLogger(__name__)
+
+REPLAY_RECORD_DIR = os.environ.get("REPLAY_RECORD_DIR")
+REPLAY_SAMPLE_RATE = float(os.environ.get("REPLAY_SAMPLE_RATE", 1.0))
+REPLAY_MAX_ITEMS = int(os.environ.get("REPLAY_MAX_ITEMS", 10000))
+
+# Request fields that only make sense for the original caller
+SKIPPED_FIELDS = {"url", "callback_url", "stream", "fields"}
+
+
+def server_timing(header):
+    """Duration in ms of the "app" metric of a Server-Timing header, or None"""
+    for metric in (header or "").split(","):
+        name, _, params = metric.strip().partition(";")
+        if name != "app":
+            continue
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                try:
+                    return float(value)
+                except ValueError:
+                    return None
+    return None
+
+
+def sniff_extension(content):
+    if content.startswith(b"\xff\xd8"):
+        return ".jpg"
+    if content.startswith(b"\x89PNG"):
+        return ".png"
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return ".webp"
+    return ".bin"
+
+
+class ReplayRecorder:
+    """Appends sampled /predict requests and responses to a corpus directory
+
+    Files are written by a background thread so recording adds no disk I/O
+    to the request; identical images are stored once.
+    """
+
+    def __init__(self, directory, sample_rate=REPLAY_SAMPLE_RATE, max_items=REPLAY_MAX_ITEMS):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_items = max_items
+        self.recorded = 0
+        self._executor = ForkLocal(lambda: ThreadPoolExecutor(1, thread_name_prefix="replay-recorder"))
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "images"), exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        return cls(REPLAY_RECORD_DIR) if REPLAY_RECORD_DIR else None
+
+    def wants(self):
+        return self.recorded < self.max_items and random.random() < self.sample_rate
+
+    def record(self, data, content, response, server_ms):
+        """Queue one request; content is the downloaded image, response the JSON body"""
+        if content is None or not self.wants():
+            return
+        self.recorded += 1
+        self._executor.get().submit(self._write, data, content, response, server_ms)
+
+    def _write(self, data, content, response, server_ms):
+        try:
+            name = hashlib.sha1(content).hexdigest() + sniff_extension(content)
+            path = os.path.join(self.directory, "images", name)
+            if not os.path.exists(path):
+                with open(f"{path}.tmp", "wb") as f:
+                    f.write(content)
+                os.replace(f"{path}.tmp", path)
+            entry = {
+                "id": uuid.uuid4().hex,
+                "recorded_at": time.time(),
+                "url": data.get("url"),
+                "image": name,
+                "params": {k: v for k, v in data.items() if k not in SKIPPED_FIELDS},
+                "status": 200,
+                "detections": response.get("detections"),
+                "server_ms": round(server_ms, 2),
+            }
+            with self._lock:
+                with open(os.path.join(self.directory, "requests.ndjson"), "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+        except Exception as e:
+            logger.error(f"Failed to record request for replay: {str(e)}")
+
+    def flush(self):
+        executor = self._executor.peek()
+        if executor is not None:
+            executor.submit(lambda: None).result()
+
+
+# -- loading ------------------------------------------------------------------
+
+def read_ndjson(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_corpus(directory):
+    return read_ndjson(os.path.join(directory, "requests.ndjson"))
+
+
+def load_results(path):
+    """Results by request id, from a corpus directory or a replay output file"""
+    entries = load_corpus(path) if os.path.isdir(path) else read_ndjson(path)
+    return {entry["id"]: entry for entry in entries}
+
+
+# -- replaying ----------------------------------------------------------------
+
+def http_sender(target, timeout=60):
+    import requests
+
+    session = requests.Session()
+    endpoint = target.rstrip("/") + "/predict"
+
+    def send(payload):
+        response = session.post(endpoint, json=payload, timeout=timeout)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return response.status_code, body, server_timing(response.headers.get("Server-Timing"))
+    return send
+
+
+def app_sender():
+    """Sends to this checkout's app in-process"""
+    import main as app
+
+    client = app.app.test_client()
+
+    def send(payload):
+        response = client.post("/predict", json=payload)
+        return (response.status_code, response.get_json(silent=True) or {},
+                server_timing(response.headers.get("Server-Timing")))
+    return send
+
+
+def replay_corpus(directory, send, concurrency=4, image_server=None):
+    """Replay every recorded request through send(payload); returns result entries in corpus order
+
+    send returns (status, body, server_ms).
+    """
+    from local_server import LocalServer
+
+    entries = load_corpus(directory)
+    server = image_server or LocalServer().start()
+    try:
+        for name in {entry["image"] for entry in entries}:
+            with open(os.path.join(directory, "images", name), "rb") as f:
+                server.route(f"/images/{name}", body=f.read())
+
+        def run(entry):
+            payload = {**entry["params"], "url": server.url(f"/images/{entry['image']}")}
+            started = time.perf_counter()
+            try:
+                status, body, server_ms = send(payload)
+            except Exception as e:
+                status, body, server_ms = 0, {"error": str(e)}, None
+            latency_ms = (time.perf_counter() - started) * 1000
+            return {"id": entry["id"], "status": status, "detections": body.get("detections"),
+                    "error": body.get("error"), "latency_ms": round(latency_ms, 2),
+                    "server_ms": round(server_ms, 2) if server_ms is not None else None}
+
+        with ThreadPoolExecutor(max(1, concurrency)) as pool:
+            return list(pool.map(run, entries))
+    finally:
+        if image_server is None:
+            server.stop()
+
+
+# -- comparing ----------------------------------------------------------------
+
+def iou_matrix(boxes_a, boxes_b):
+    import numpy as np
+
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.where(union > 0, union, 1), 0.0)
+
+
+def match_detections(expected, actual, iou_threshold=0.5):
+    """Greedy one-to-one matching of same-class boxes by IoU
+
+    Returns (matches, missing, extra): matches are (expected, actual, iou)
+    triples, missing are expected boxes with no partner, extra the reverse.
+    """
+    import numpy as np
+
+    def corners(detections):
+        return [[d["bbox"]["x1"], d["bbox"]["y1"], d["bbox"]["x2"], d["bbox"]["y2"]] for d in detections]
+
+    ious = iou_matrix(corners(expected), corners(actual))
+    if ious.size:
+        same_class = np.array([d["class_id"] for d in expected])[:, None] == \
+            np.array([d["class_id"] for d in actual])[None, :]
+        ious = np.where(same_class, ious, 0.0)
+    matches, used_a, used_b = [], set(), set()
+    order = np.argsort(-ious, axis=None) if ious.size else []
+    for flat in order:
+        i, j = divmod(int(flat), ious.shape[1])
+        if ious[i, j] < iou_threshold:
+            break
+        if i in used_a or j in used_b:
+            continue
+        used_a.add(i)
+        used_b.add(j)
+        matches.append((expected[i], actual[j], float(ious[i, j])))
+    missing = [d for i, d in enumerate(expected) if i not in used_a]
+    extra = [d for j, d in enumerate(actual) if j not in used_b]
+    return matches, missing, extra
+
+
+def latency_summary(values):
+    from health import percentile
+
+    return {f"p{q}": percentile(values, q) for q in (50, 90, 95, 99)}
+
+
+def compare_runs(baseline, candidate, iou_threshold=0.5, max_mismatch=0.0, max_p95_regression=0.25):
+    """Diff two result sets (dicts by request id); returns a report with "passed" """
+    mismatched, errors, compared = [], [], 0
+    max_confidence_drift = 0.0
+    for request_id, base in baseline.items():
+        new = candidate.get(request_id)
+        if new is None or base.get("detections") is None:
+            continue
+        compared += 1
+        if new.get("status") != 200 or new.get("detections") is None:
+            errors.append({"id": request_id, "status": new.get("status"), "error": new.get("error")})
+            continue
+        matches, missing, extra = match_detections(base["detections"], new["detections"], iou_threshold)
+        for old, current, _ in matches:
+            max_confidence_drift = max(max_confidence_drift, abs(old["confidence"] - current["confidence"]))
+        if missing or extra:
+            mismatched.append({"id": request_id, "missing": len(missing), "extra": len(extra),
+                               "matched": len(matches)})
+
+    # Both sides are measured by the server, without the download, whether recorded or replayed
+    base_latency = latency_summary([e["server_ms"] for e in baseline.values() if e.get("server_ms") is not None])
+    new_latency = latency_summary([e["server_ms"] for e in candidate.values() if e.get("server_ms") is not None])
+    p95_ratio = None
+    if base_latency["p95"] and new_latency["p95"] is not None:
+        p95_ratio = new_latency["p95"] / base_latency["p95"]
+
+    failures = []
+    mismatch_rate = (len(mismatched) + len(errors)) / compared if compared else 0.0
+    if mismatch_rate > max_mismatch:
+        failures.append(f"{mismatch_rate:.1%} of requests differ (allowed {max_mismatch:.1%})")
+    if p95_ratio is not None and p95_ratio > 1 + max_p95_regression:
+        failures.append(f"p95 latency is {p95_ratio:.2f}x the baseline (allowed {1 + max_p95_regression:.2f}x)")
+    return {
+        "passed": not failures,
+        "failures": failures,
+        "compared": compared,
+        "mismatched": mismatched,
+        "errors": errors,
+        "mismatch_rate": mismatch_rate,
+        "max_confidence_drift": round(max_confidence_drift, 4),
+        "latency_ms": {"baseline": base_latency, "candidate": new_latency, "p95_ratio": p95_ratio},
+    }
+
+
+def print_report(report):
+    print(f"compared {report['compared']} requests: {len(report['mismatched'])} with different detections, "
+          f"{len(report['errors'])} errors, max confidence drift {report['max_confidence_drift']}")
+    for item in report["mismatched"][:10]:
+        print(f"  {item['id']}: {item['missing']} missing, {item['extra']} extra, {item['matched']} matched")
+    for item in report["errors"][:10]:
+        print(f"  {item['id']}: status {item['status']} {item['error'] or ''}")
+    print(f"{'latency':<10}{'p50':>10}{'p90':>10}{'p95':>10}{'p99':>10}")
+    for side in ("baseline", "candidate"):
+        values = report["latency_ms"][side]
+        print(f"{side:<10}" + "".join(f"{values[k]:>10.1f}" if values[k] is not None else f"{'-':>10}"
+                                       for k in ("p50", "p90", "p95", "p99")))
+    if report["passed"]:
+        print("✅ No regression")
+    for failure in report["failures"]:
+        print(f"❌ {failure}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded /predict traffic and diff the results")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Replay a corpus against a build")
+    run.add_argument("corpus")
+    run.add_argument("--output", required=True, help="NDJSON file for the replay results")
+    run.add_argument("--target", help="Base URL of a running build (default: this checkout, in-process)")
+    run.add_argument("--concurrency", type=int, default=4)
+
+    compare = commands.add_parser("compare", help="Diff two runs; exits 1 on regression")
+    compare.add_argument("baseline", help="Corpus directory or replay output")
+    compare.add_argument("candidate", help="Corpus directory or replay output")
+    compare.add_argument("--iou", type=float, default=0.5, help="IoU needed for two boxes to match")
+    compare.add_argument("--max-mismatch", type=float, default=0.0,
+                         help="Fraction of requests allowed to have different detections")
+    compare.add_argument("--max-p95-regression", type=float, default=0.25,
+                         help="Allowed p95 latency increase, as a fraction of the baseline")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.command == "run":
+        send = http_sender(args.target) if args.target else app_sender()
+        started = time.monotonic()
+        results = replay_corpus(args.corpus, send, args.concurrency)
+        with open(args.output, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+        failed = sum(1 for r in results if r["status"] != 200)
+        print(f"✅ Replayed {len(results)} requests in {time.monotonic() - started:.1f}s ({failed} failed)")
+        return 0
+
+    report = compare_runs(load_results(args.baseline), load_results(args.candidate), args.iou,
+                          args.max_mismatch, args.max_p95_regression)
+    print_report(report)
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import os
+import math
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+IMGSZ = int(os.environ.get("IMGSZ", 640))
+ADAPTIVE_IMGSZ = os.environ.get("ADAPTIVE_IMGSZ", "0") == "1"
+# Allowed inference sizes; YOLO strides need multiples of 32
+IMGSZ_STEPS = os.environ.get("IMGSZ_STEPS", "320,416,512,640")
+LATENCY_SLO_MS = float(os.environ.get("LATENCY_SLO_MS", 1000))
+# Requests in flight per worker before resolution starts dropping
+QUEUE_SOFT_LIMIT = int(os.environ.get("QUEUE_SOFT_LIMIT", 2))
+# Smaller model used instead of the default once the lowest resolution isn't enough
+OVERLOAD_MODEL = os.environ.get("OVERLOAD_MODEL") or None
+
+
+def parse_steps(value, max_size):
+    steps = sorted({int(v) for v in str(value).split(",") if v.strip()})
+    for step in steps:
+        if step <= 0 or step % 32:
+            raise ValueError(f"IMGSZ_STEPS entries must be positive multiples of 32, got {step}")
+    steps = [step for step in steps if step <= max_size]
+    return steps if max_size in steps else steps + [max_size]
+
+
+class Choice:
+    def __init__(self, imgsz, model=None, reason="fixed", pressure=0):
+        self.imgsz = imgsz
+        # None keeps the model the request asked for
+        self.model = model
+        self.reason = reason
+        self.pressure = pressure
+
+    def info(self):
+        info = {"imgsz": self.imgsz, "reason": self.reason}
+        if self.model is not None:
+            info["model"] = self.model
+        return info
+
+
+class ResolutionPolicy:
+    """Picks the inference size for an image from its dimensions and the worker's load
+
+    Images are never upscaled: the size is the smallest step that covers the
+    longest side. On top of that, each step of load pressure (in-flight
+    requests beyond the soft limit, or p95 latency over the SLO) moves one
+    step down, and past the smallest step the default model can be swapped
+    for OVERLOAD_MODEL.
+    """
+
+    def __init__(self, enabled=ADAPTIVE_IMGSZ, imgsz=IMGSZ, steps=IMGSZ_STEPS,
+                 latency_slo_ms=LATENCY_SLO_MS, queue_soft_limit=QUEUE_SOFT_LIMIT,
+                 overload_model=OVERLOAD_MODEL):
+        self.enabled = enabled
+        self.imgsz = imgsz
+        self.steps = parse_steps(steps, imgsz)
+        self.latency_slo_ms = latency_slo_ms
+        self.queue_soft_limit = max(1, queue_soft_limit)
+        self.overload_model = overload_model
+        self.chosen = Counter()
+
+    def content_step(self, shape):
+        """Index of the smallest step that is at least the image's longest side"""
+        longest = max(shape[:2])
+        for index, step in enumerate(self.steps):
+            if step >= longest:
+                return index
+        return len(self.steps) - 1
+
+    def pressure(self, in_flight, p95_ms):
+        """Steps to drop for the current load (0 when within limits)"""
+        excess = in_flight - self.queue_soft_limit
+        level = math.ceil(excess / self.queue_soft_limit) if excess > 0 else 0
+        if p95_ms is not None and self.latency_slo_ms and p95_ms > self.latency_slo_ms:
+            level = max(level, 1 + int(p95_ms // (2 * self.latency_slo_ms)))
+        return level
+
+    def choose(self, shape, in_flight=0, p95_ms=None, model_requested=False):
+        if not self.enabled:
+            # Leave the size to the model, as before the policy existed
+            return Choice(None)
+        index = self.content_step(shape)
+        reason = "content" if index < len(self.steps) - 1 else "full"
+        pressure = self.pressure(in_flight, p95_ms)
+        model = None
+        if pressure:
+            reason = "load"
+            if pressure > index and self.overload_model and not model_requested:
+                model = self.overload_model
+            index = max(0, index - pressure)
+        choice = Choice(self.steps[index], model, reason, pressure)
+        self.chosen[choice.imgsz] += 1
+        return choice
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "steps": self.steps,
+            "latency_slo_ms": self.latency_slo_ms,
+            "queue_soft_limit": self.queue_soft_limit,
+            "overload_model": self.overload_model,
+            "chosen": {str(size): n for size, n in sorted(self.chosen.items())},
+        }
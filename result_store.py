@@ -0,0 +1,376 @@
+import os
+import time
+import heapq
+import queue
+import sqlite3
+import logging
+import threading
+import itertools
+from datetime import datetime
+
+from forklocal import ForkLocal
+
+logger = logging.getLogger(__name__)
+
+RESULT_STORE = os.environ.get("RESULT_STORE")
+RESULT_STORE_BATCH = int(os.environ.get("RESULT_STORE_BATCH", 500))
+RESULT_STORE_FLUSH_S = float(os.environ.get("RESULT_STORE_FLUSH_S", 1.0))
+RESULT_STORE_QUEUE = int(os.environ.get("RESULT_STORE_QUEUE", 10000))
+SEARCH_MAX_LIMIT = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    url TEXT,
+    model TEXT,
+    width INTEGER,
+    height INTEGER,
+    count INTEGER
+);
+CREATE TABLE IF NOT EXISTS detections (
+    run_id INTEGER NOT NULL,
+    class_id INTEGER NOT NULL,
+    confidence REAL NOT NULL,
+    x1 REAL, y1 REAL, x2 REAL, y2 REAL
+);
+CREATE TABLE IF NOT EXISTS classes (
+    model TEXT NOT NULL,
+    class_id INTEGER NOT NULL,
+    class_name TEXT NOT NULL,
+    PRIMARY KEY (model, class_id)
+);
+CREATE INDEX IF NOT EXISTS runs_ts ON runs (ts);
+CREATE INDEX IF NOT EXISTS detections_class ON detections (class_id, run_id, confidence);
+CREATE INDEX IF NOT EXISTS detections_run ON detections (run_id, confidence);
+CREATE INDEX IF NOT EXISTS classes_name ON classes (class_name);
+"""
+
+
+def parse_time(value):
+    """Epoch seconds or an ISO 8601 timestamp from a query string"""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+class ResultStore:
+    """Records /predict results in SQLite through a background batched writer
+
+    Run ids are allocated by SQLite when the run row is written, ahead of its
+    detections, and increase with the run timestamps across workers. Searches
+    page through them with a keyset cursor and never use OFFSET.
+    """
+
+    def __init__(self, path, batch_size=RESULT_STORE_BATCH, flush_interval=RESULT_STORE_FLUSH_S,
+                 queue_size=RESULT_STORE_QUEUE):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.written_runs = 0
+        self.written_detections = 0
+        self.dropped = 0
+        self._counter = itertools.count()
+        self._local = ForkLocal(threading.local)
+        self._writer = ForkLocal(self._start_writer)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls):
+        return cls(RESULT_STORE) if RESULT_STORE else None
+
+    def _connect(self):
+        local = self._local.get()
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            local.conn = conn
+        return conn
+
+    # -- writing ------------------------------------------------------------
+
+    def _start_writer(self):
+        jobs = queue.Queue(self.queue_size)
+        threading.Thread(target=self._write_loop, args=(jobs,), name="result-store", daemon=True).start()
+        return jobs
+
+    def _enqueue(self, kind, payload):
+        try:
+            self._writer.get().put_nowait((kind, payload))
+            return True
+        except queue.Full:
+            # Never block a request on the database; losing a record is the lesser evil
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Result store queue full, dropped {self.dropped} records so far")
+            return False
+
+    def open_run(self, url, model, shape, ts=None):
+        """Queue the run row ahead of its detections; returns a handle, or None if it was dropped"""
+        height, width = shape[:2]
+        run = next(self._counter)
+        if self._enqueue("run", (run, ts, url, model, width, height)):
+            return run
+        return None
+
+    def record_detections(self, run, model, detections):
+        if run is None:
+            return
+        rows = []
+        names = {}
+        for d in detections:
+            bbox = d["bbox"]
+            rows.append((d["class_id"], d["confidence"], bbox["x1"], bbox["y1"], bbox["x2"], bbox["y2"]))
+            names[d["class_id"]] = d["class_name"]
+        if rows:
+            self._enqueue("detections", (run, model, names, rows))
+
+    def close_run(self, run, count):
+        if run is not None:
+            self._enqueue("close", (run, count))
+
+    def record(self, url, model, shape, detections, ts=None):
+        """Queue a complete result"""
+        run = self.open_run(url, model, shape, ts)
+        self.record_detections(run, model, detections)
+        self.close_run(run, len(detections))
+
+    def tee(self, detections, url, model, shape, chunk_size=256):
+        """Pass a detection stream through, recording it a chunk at a time
+
+        A stream that is abandoned part way still leaves a run row, counting
+        the detections that were sent.
+        """
+        run = self.open_run(url, model, shape)
+        chunk = []
+        count = 0
+        try:
+            for detection in detections:
+                chunk.append(detection)
+                count += 1
+                if len(chunk) >= chunk_size:
+                    self.record_detections(run, model, chunk)
+                    chunk = []
+                yield detection
+        finally:
+            self.record_detections(run, model, chunk)
+            self.close_run(run, count)
+
+    def _write_loop(self, jobs):
+        known_classes = set()
+        # Caller handles of runs whose rows are written but not yet closed, to their ids
+        open_runs = {}
+        while True:
+            batch = [jobs.get()]
+            deadline = time.monotonic() + self.flush_interval
+            rows = 1
+            while rows < self.batch_size:
+                try:
+                    item = jobs.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(item)
+                rows += len(item[1][3]) if item[0] == "detections" else 1
+            try:
+                self._write_batch(batch, known_classes, open_runs)
+            except Exception as e:
+                logger.error(f"Result store write failed, {len(batch)} items lost: {str(e)}")
+            finally:
+                for _ in batch:
+                    jobs.task_done()
+
+    def _write_batch(self, batch, known_classes, open_runs):
+        conn = self._connect()
+        # Ids come from SQLite and runs are stamped inside the write lock, so ids
+        # and timestamps rise together across workers
+        conn.execute("BEGIN IMMEDIATE")
+        opened, closed, new_classes = {}, [], []
+        runs = detections = 0
+        try:
+            now = time.time()
+            for kind, payload in batch:
+                if kind == "run":
+                    run, ts, url, model, width, height = payload
+                    cursor = conn.execute("INSERT INTO runs (ts, url, model, width, height, count) "
+                                          "VALUES (?, ?, ?, ?, ?, 0)", (ts or now, url, model, width, height))
+                    opened[run] = cursor.lastrowid
+                    runs += 1
+                elif kind == "detections":
+                    run, model, names, rows = payload
+                    run_id = opened.get(run, open_runs.get(run))
+                    if run_id is None:
+                        # Its run row was lost with an earlier batch
+                        continue
+                    conn.executemany("INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     [(run_id,) + row for row in rows])
+                    detections += len(rows)
+                    for class_id, name in names.items():
+                        if (model, class_id) not in known_classes:
+                            new_classes.append((model, class_id, name))
+                elif kind == "close":
+                    run, count = payload
+                    run_id = opened.get(run, open_runs.get(run))
+                    if run_id is not None:
+                        conn.execute("UPDATE runs SET count = ? WHERE id = ?", (count, run_id))
+                    closed.append(run)
+            conn.executemany("INSERT OR IGNORE INTO classes VALUES (?, ?, ?)", new_classes)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        open_runs.update(opened)
+        for run in closed:
+            open_runs.pop(run, None)
+        known_classes.update((model, class_id) for model, class_id, _ in new_classes)
+        self.written_runs += runs
+        self.written_detections += detections
+
+    def flush(self, timeout=10.0):
+        """Wait until everything queued so far is on disk (used by tests and shutdown)"""
+        jobs = self._writer.peek()
+        if jobs is None:
+            return
+        deadline = time.monotonic() + timeout
+        while jobs.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    # -- querying -----------------------------------------------------------
+
+    def class_ids(self, class_name):
+        rows = self._connect().execute(
+            "SELECT DISTINCT class_id FROM classes WHERE class_name = ?", (class_name,)).fetchall()
+        return [row[0] for row in rows]
+
+    def _id_range(self, since, until):
+        """Translate a time window into run id bounds through the runs(ts) index"""
+        conn = self._connect()
+        low = high = None
+        if since is not None:
+            row = conn.execute("SELECT id FROM runs WHERE ts >= ? ORDER BY ts LIMIT 1", (since,)).fetchone()
+            if row is None:
+                return 0, -1
+            low = row[0]
+        if until is not None:
+            row = conn.execute("SELECT id FROM runs WHERE ts < ? ORDER BY ts DESC LIMIT 1", (until,)).fetchone()
+            if row is None:
+                return 0, -1
+            high = row[0]
+        return low, high
+
+    @staticmethod
+    def class_run_sql(conditions, min_confidence=0.0, model=None):
+        """Runs with a detection of one class, newest first
+
+        Walks the (class_id, run_id, confidence) index backwards; DISTINCT is
+        streamed because the rows of one class already arrive ordered by run_id.
+        """
+        where = ["d.class_id = ?"] + [c.replace("r.id", "d.run_id") for c in conditions]
+        join = ""
+        if min_confidence:
+            where.append("d.confidence >= ?")
+        if model is not None:
+            join = " JOIN runs r ON r.id = d.run_id"
+            where.append("r.model = ?")
+        return f"SELECT DISTINCT d.run_id FROM detections d{join} WHERE {' AND '.join(where)} " \
+               f"ORDER BY d.run_id DESC"
+
+    def _class_run_ids(self, conn, class_ids, conditions, params, min_confidence, model, limit):
+        """Newest `limit` runs matching any of class_ids
+
+        One ordered query per class, merged here: a single query over several
+        classes would have SQLite sort every matching row before the LIMIT.
+        """
+        sql = self.class_run_sql(conditions, min_confidence, model)
+        extra = ([min_confidence] if min_confidence else []) + ([model] if model is not None else [])
+        cursors = [conn.cursor().execute(sql, [class_id] + params + extra) for class_id in class_ids]
+        run_ids = []
+        for (run_id,) in heapq.merge(*cursors, reverse=True):
+            if run_ids and run_ids[-1] == run_id:
+                continue
+            run_ids.append(run_id)
+            if len(run_ids) == limit:
+                break
+        for cursor in cursors:
+            cursor.close()
+        return run_ids
+
+    def search(self, class_ids=None, min_confidence=0.0, since=None, until=None, model=None,
+               limit=50, cursor=None):
+        """Runs that contain a matching detection, newest first
+
+        Returns (results, next_cursor). The cursor is the id of the last run on
+        the page; passing it back continues strictly below it.
+        """
+        limit = max(1, min(int(limit), SEARCH_MAX_LIMIT))
+        low, high = self._id_range(since, until)
+        if cursor is not None:
+            high = cursor - 1 if high is None else min(high, cursor - 1)
+
+        conditions, params = [], []
+        if low is not None:
+            conditions.append("r.id >= ?")
+            params.append(low)
+        if high is not None:
+            conditions.append("r.id <= ?")
+            params.append(high)
+        conn = self._connect()
+
+        if class_ids:
+            run_ids = self._class_run_ids(conn, class_ids, conditions, params, min_confidence, model, limit)
+        else:
+            # Newest runs first, probing the (run_id, confidence) index for each
+            if min_confidence:
+                conditions.append("EXISTS (SELECT 1 FROM detections d "
+                                  "WHERE d.run_id = r.id AND d.confidence >= ?)")
+                params.append(min_confidence)
+            if model is not None:
+                conditions.append("r.model = ?")
+                params.append(model)
+            sql = f"SELECT r.id FROM runs r WHERE {' AND '.join(conditions) or '1'} ORDER BY r.id DESC LIMIT ?"
+            run_ids = [row[0] for row in conn.execute(sql, params + [limit])]
+        if not run_ids:
+            return [], None
+
+        placeholders = ",".join("?" * len(run_ids))
+        runs = {row[0]: {"id": row[0], "timestamp": row[1], "url": row[2], "model": row[3],
+                         "width": row[4], "height": row[5], "count": row[6], "matches": []}
+                for row in conn.execute(f"SELECT * FROM runs WHERE id IN ({placeholders})", run_ids)}
+
+        match_sql = f"SELECT d.*, c.class_name FROM detections d " \
+                    f"LEFT JOIN runs r ON r.id = d.run_id " \
+                    f"LEFT JOIN classes c ON c.model = r.model AND c.class_id = d.class_id " \
+                    f"WHERE d.run_id IN ({placeholders})"
+        match_params = list(run_ids)
+        if class_ids:
+            match_sql += f" AND d.class_id IN ({','.join('?' * len(class_ids))})"
+            match_params.extend(class_ids)
+        if min_confidence:
+            match_sql += " AND d.confidence >= ?"
+            match_params.append(min_confidence)
+        for run_id, class_id, confidence, x1, y1, x2, y2, class_name in conn.execute(match_sql, match_params):
+            run = runs.get(run_id)
+            if run is not None:
+                run["matches"].append({"class_id": class_id, "class_name": class_name,
+                                       "confidence": confidence,
+                                       "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}})
+
+        results = [runs[run_id] for run_id in run_ids if run_id in runs]
+        next_cursor = run_ids[-1] if len(run_ids) == limit else None
+        return results, next_cursor
+
+    def stats(self):
+        jobs = self._writer.peek()
+        return {
+            "path": self.path,
+            "written_runs": self.written_runs,
+            "written_detections": self.written_detections,
+            "queued": jobs.qsize() if jobs is not None else 0,
+            "dropped": self.dropped,
+        }
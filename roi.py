@@ -0,0 +1,107 @@
+import os
+import logging
+
+from task_outputs import offset_extras
+
+logger = logging.getLogger(__name__)
+
+MAX_ROIS = int(os.environ.get("MAX_ROIS", 16))
+
+# libjpeg-turbo MCU size (width, height) by TJSAMP_* chroma subsampling constant
+MCU_SIZES = {0: (8, 8), 1: (16, 8), 2: (16, 16), 3: (8, 8), 4: (8, 16), 5: (32, 8), 6: (8, 32)}
+
+_turbo = None
+
+
+class InvalidROI(ValueError):
+    """The request's ROI list is malformed or doesn't fit the image"""
+
+
+def _turbojpeg():
+    """PyTurboJPEG handle, or None when the library isn't installed"""
+    global _turbo
+    if _turbo is None:
+        try:
+            from turbojpeg import TurboJPEG
+            _turbo = TurboJPEG()
+        except Exception:
+            _turbo = False
+    return _turbo or None
+
+
+def parse_rois(raw, width, height):
+    """Validate ROI rectangles from a request and clamp them to the image
+
+    Each ROI is [x1, y1, x2, y2] or {"x1": .., "y1": .., "x2": .., "y2": ..} in
+    pixels. Raises InvalidROI with a client-facing message on bad input.
+    """
+    if not isinstance(raw, list) or not raw:
+        raise InvalidROI("'rois' must be a non-empty list of [x1, y1, x2, y2] rectangles")
+    if len(raw) > MAX_ROIS:
+        raise InvalidROI(f"At most {MAX_ROIS} ROIs per request")
+    rois = []
+    for item in raw:
+        if isinstance(item, dict):
+            item = [item.get(k) for k in ("x1", "y1", "x2", "y2")]
+        try:
+            x1, y1, x2, y2 = (int(round(float(v))) for v in item)
+        except (TypeError, ValueError):
+            raise InvalidROI(f"Invalid ROI {item!r}")
+        x1, x2 = max(0, min(x1, width)), max(0, min(x2, width))
+        y1, y2 = max(0, min(y1, height)), max(0, min(y2, height))
+        if x2 <= x1 or y2 <= y1:
+            raise InvalidROI(f"ROI {item!r} is empty inside a {width}x{height} image")
+        rois.append((x1, y1, x2, y2))
+    return rois
+
+
+def crop_views(image, rois):
+    """Crops as NumPy views into the decoded image (no pixels are copied)"""
+    return [image[y1:y2, x1:x2] for x1, y1, x2, y2 in rois]
+
+
+def align_to_mcu(roi, mcu):
+    """Grow an ROI so its origin sits on an MCU boundary, as lossless JPEG crops require"""
+    x1, y1, x2, y2 = roi
+    mcu_w, mcu_h = mcu
+    return (x1 - x1 % mcu_w, y1 - y1 % mcu_h, x2, y2)
+
+
+def decode_jpeg_rois(data, rois):
+    """Decode only the ROI regions of a JPEG; returns crops or None if unsupported
+
+    Each ROI is cut out of the compressed stream with a lossless libjpeg-turbo
+    crop (whole MCUs, no re-encoding), so the pixels outside it are never
+    decoded. The MCU alignment margin is sliced off the decoded result.
+    """
+    turbo = _turbojpeg()
+    if turbo is None or not data.startswith(b"\xff\xd8"):
+        return None
+    try:
+        width, height, subsample, _ = turbo.decode_header(data)
+        mcu = MCU_SIZES.get(subsample, (16, 16))
+        crops = []
+        for roi in rois:
+            ax1, ay1, x2, y2 = align_to_mcu(roi, mcu)
+            cropped = turbo.crop(data, ax1, ay1, x2 - ax1, y2 - ay1)
+            decoded = turbo.decode(cropped)
+            crops.append(decoded[roi[1] - ay1:y2 - ay1, roi[0] - ax1:x2 - ax1])
+        return crops
+    except Exception as e:
+        logger.warning(f"Partial JPEG decode failed, falling back to full decode: {str(e)}")
+        return None
+
+
+def offset_detections(detections, roi, index):
+    """Map boxes found in a crop back to full-image coordinates"""
+    x1, y1 = roi[0], roi[1]
+    mapped = []
+    for detection in detections:
+        bbox = detection["bbox"]
+        mapped.append({**detection, **offset_extras(detection, x1, y1), "roi": index, "bbox": {
+            "x1": round(bbox["x1"] + x1, 2),
+            "y1": round(bbox["y1"] + y1, 2),
+            "x2": round(bbox["x2"] + x1, 2),
+            "y2": round(bbox["y2"] + y1, 2),
+        }})
+    return mapped
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+Router in front of several copies of the detection service
+
+    python router.py --nodes http://10.0.0.1:5000,http://10.0.0.2:5000 --port 8000
+    python router.py --spawn 3 --port 8000      # three local `python main.py` nodes
+    gunicorn router:app                          # nodes from ROUTER_NODES
+
+/predict and /predict/render are routed by a consistent hash of the image
+URL (or a client-supplied content_hash), so repeats of an image land on the
+node whose result, render and near-duplicate caches already hold it. When
+that node is much busier than the next one on the ring, the request goes to
+the less loaded of the two instead. Other paths go to the least loaded node.
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+import requests
+from flask import Flask, Response, jsonify, request
+from requests.adapters import HTTPAdapter
+
+from forklocal import ForkLocal
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROUTER_NODES = os.environ.get("ROUTER_NODES", "")
+ROUTER_VNODES = int(os.environ.get("ROUTER_VNODES", 160))
+ROUTER_CANDIDATES = int(os.environ.get("ROUTER_CANDIDATES", 2))
+ROUTER_MAX_SKEW = int(os.environ.get("ROUTER_MAX_SKEW", 4))
+ROUTER_POLL_S = float(os.environ.get("ROUTER_POLL_S", 2))
+ROUTER_POLL_TIMEOUT = float(os.environ.get("ROUTER_POLL_TIMEOUT", 1))
+ROUTER_FAIL_AFTER = int(os.environ.get("ROUTER_FAIL_AFTER", 2))
+ROUTER_TIMEOUT = float(os.environ.get("ROUTER_TIMEOUT", 120))
+ROUTER_ADMIN_TOKEN = os.environ.get("ROUTER_ADMIN_TOKEN")
+
+# Paths whose requests carry an image and are worth keeping on one node
+KEYED_PATHS = ("/predict", "/predict/render")
+# Not forwarded in either direction (RFC 7230 section 6.1, plus what requests recomputes)
+HOP_BY_HOP = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te",
+              "trailer", "trailers", "transfer-encoding", "upgrade", "host", "content-length"}
+
+
+def ring_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes
+
+    Adding or removing a node only moves the keys between its points and
+    their predecessors, about 1/N of the key space.
+    """
+
+    def __init__(self, nodes=(), vnodes=ROUTER_VNODES):
+        self.vnodes = vnodes
+        self._points = []
+        self._owners = []
+        self.nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.vnodes):
+            point = ring_hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        kept = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+        self._points = [p for p, _ in kept]
+        self._owners = [o for _, o in kept]
+
+    def preference(self, key, count=1):
+        """The first `count` distinct nodes clockwise from the key's position"""
+        if not self._points:
+            return []
+        count = min(count, len(self.nodes))
+        start = bisect.bisect(self._points, ring_hash(key))
+        found = []
+        for i in range(len(self._points)):
+            owner = self._owners[(start + i) % len(self._points)]
+            if owner not in found:
+                found.append(owner)
+                if len(found) == count:
+                    break
+        return found
+
+    def shares(self):
+        """Fraction of the key space each node owns"""
+        if not self._points:
+            return {}
+        space = 1 << 64
+        owned = Counter()
+        for i, point in enumerate(self._points):
+            previous = self._points[i - 1] if i else self._points[-1] - space
+            owned[self._owners[i]] += point - previous
+        return {node: round(owned[node] / space, 3) for node in sorted(self.nodes)}
+
+
+class Node:
+    """One backend and what the router knows about its load"""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.up = True
+        self.ready = True
+        self.reported_depth = 0
+        self.outstanding = 0
+        self.failures = 0
+        self.routed = 0
+        self.errors = 0
+        self.last_poll = None
+
+    @property
+    def load(self):
+        # Its own report covers other routers' traffic; our count is never stale
+        return max(self.reported_depth, self.outstanding)
+
+    def info(self):
+        return {
+            "url": self.url,
+            "up": self.up,
+            "ready": self.ready,
+            "load": self.load,
+            "reported_depth": self.reported_depth,
+            "outstanding": self.outstanding,
+            "routed": self.routed,
+            "errors": self.errors,
+        }
+
+
+class NoNodes(Exception):
+    """No backend is reachable"""
+
+
+class Router:
+    """Membership, health polling and node choice for the routing app"""
+
+    def __init__(self, nodes=(), candidates=ROUTER_CANDIDATES, max_skew=ROUTER_MAX_SKEW,
+                 poll_interval=ROUTER_POLL_S, poll_timeout=ROUTER_POLL_TIMEOUT,
+                 fail_after=ROUTER_FAIL_AFTER, timeout=ROUTER_TIMEOUT, vnodes=ROUTER_VNODES):
+        self.candidates = candidates
+        self.max_skew = max_skew
+        self.poll_interval = poll_interval
+        self.poll_timeout = poll_timeout
+        self.fail_after = fail_after
+        self.timeout = timeout
+        self.ring = HashRing(vnodes=vnodes)
+        self.nodes = {}
+        self.reasons = Counter()
+        self._lock = threading.Lock()
+        self._session = ForkLocal(self._start_session)
+        for url in nodes:
+            self.join(url)
+
+    @classmethod
+    def from_env(cls):
+        return cls([url.strip() for url in ROUTER_NODES.split(",") if url.strip()])
+
+    def _start_session(self):
+        """This process's connection pool, starting its health poller alongside"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if self.poll_interval:
+            threading.Thread(target=self._poll_loop, name="router-poll", daemon=True).start()
+        return session
+
+    @property
+    def session(self):
+        return self._session.get()
+
+    def join(self, url):
+        node = Node(url)
+        with self._lock:
+            node = self.nodes.setdefault(node.url, node)
+            node.up, node.failures = True, 0
+            self.ring.add(node.url)
+        logger.info(f"➕ Node {node.url} joined ({len(self.ring.nodes)} in ring)")
+        return node
+
+    def leave(self, url):
+        url = url.rstrip("/")
+        with self._lock:
+            node = self.nodes.pop(url, None)
+            self.ring.remove(url)
+        if node is not None:
+            logger.info(f"➖ Node {url} left ({len(self.ring.nodes)} in ring)")
+        return node
+
+    def mark_down(self, node):
+        """Take an unreachable node out of the ring; its keys move to their next owners"""
+        with self._lock:
+            if not node.up:
+                return
+            node.up = False
+            self.ring.remove(node.url)
+        logger.warning(f"⚠️ Node {node.url} is unreachable, removed from the ring")
+
+    def mark_up(self, node):
+        with self._lock:
+            if node.up or node.url not in self.nodes:
+                return
+            node.up, node.failures = True, 0
+            self.ring.add(node.url)
+        logger.info(f"✅ Node {node.url} is back in the ring")
+
+    def poll(self):
+        """Refresh every node's queue depth and readiness from its /readyz"""
+        for node in list(self.nodes.values()):
+            try:
+                response = self.session.get(f"{node.url}/readyz", timeout=self.poll_timeout)
+                report = response.json()
+            except (requests.RequestException, ValueError):
+                node.failures += 1
+                if node.failures >= self.fail_after:
+                    self.mark_down(node)
+                continue
+            node.failures = 0
+            # 503 from /readyz is a busy or unhealthy node, not a missing one:
+            # it keeps its keys and is only skipped while a ready candidate exists
+            node.ready = response.status_code == 200
+            node.reported_depth = int(report.get("queue_depth") or 0)
+            node.last_poll = time.time()
+            self.mark_up(node)
+
+    def _poll_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Router poll failed: {str(e)}")
+
+    def choose(self, key=None):
+        """(node, reason) for a request; reason is "owner", "least_loaded" or "unkeyed"
+
+        The key's owner gets the request unless it is not ready or at least
+        max_skew requests busier than the least loaded of the key's next
+        candidates, which bounds how far a hot key can overload one node.
+        """
+        with self._lock:
+            if key is None:
+                nodes = [node for node in self.nodes.values() if node.up]
+                reason = "unkeyed"
+            else:
+                nodes = [self.nodes[url] for url in self.ring.preference(key, self.candidates)]
+                reason = "owner"
+            if not nodes:
+                raise NoNodes("No backend nodes are available")
+            ready = [node for node in nodes if node.ready] or nodes
+            best = min(ready, key=lambda node: node.load)
+            owner = nodes[0]
+            if key is not None and (owner not in ready or owner.load - best.load >= self.max_skew):
+                owner, reason = best, "least_loaded"
+            elif key is None:
+                owner = best
+            owner.outstanding += 1
+            owner.routed += 1
+            self.reasons[reason] += 1
+            return owner, reason
+
+    def release(self, node):
+        with self._lock:
+            node.outstanding -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "nodes": [node.info() for node in self.nodes.values()],
+                "ring": self.ring.shares(),
+                "routed": dict(self.reasons),
+            }
+
+
+def routing_key(path, body, args):
+    """Image URL or content_hash of a /predict-style request (None for other paths)"""
+    if path not in KEYED_PATHS:
+        return None
+    data = args
+    if body:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+    if not isinstance(data, dict):
+        return None
+    key = data.get("content_hash") or data.get("url")
+    return str(key).strip() if key else None
+
+
+app = Flask(__name__)
+router = Router.from_env()
+
+
+@app.route("/healthz", methods=["GET"])
+def liveness():
+    return jsonify({"status": "alive", "pid": os.getpid(),
+                    "nodes_up": sum(node.up for node in router.nodes.values())})
+
+
+@app.route("/router", methods=["GET"])
+def router_stats():
+    return jsonify(router.stats())
+
+
+@app.route("/router/nodes", methods=["POST", "DELETE"])
+def router_nodes():
+    """Add or remove a backend: {"url": "http://host:port"}"""
+    if not ROUTER_ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ROUTER_ADMIN_TOKEN:
+        return jsonify({"error": "Forbidden"}), 403
+    url = (request.get_json(silent=True) or {}).get("url")
+    if not url or not url.startswith(("http://", "https://")):
+        return jsonify({"error": "'url' must be an http(s) URL"}), 400
+    if request.method == "POST":
+        router.join(url)
+    elif router.leave(url) is None:
+        return jsonify({"error": f"Unknown node {url}"}), 404
+    return jsonify(router.stats())
+
+
+@app.route("/", defaults={"path": ""}, methods=["GET", "POST"])
+@app.route("/<path:path>", methods=["GET", "POST"])
+def forward(path):
+    """Send the request to a backend, trying the next candidate if one can't be reached"""
+    path = "/" + path
+    body = request.get_data()
+    key = routing_key(path, body, request.args)
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP}
+    session = router.session
+    tried = set()
+    while True:
+        try:
+            node, reason = router.choose(key)
+        except NoNodes as e:
+            return jsonify({"error": str(e)}), 503
+        if node.url in tried:
+            router.release(node)
+            return jsonify({"error": "No backend node could be reached"}), 502
+        tried.add(node.url)
+        try:
+            upstream = session.request(request.method, node.url + path, params=request.args,
+                                       data=body, headers=headers, stream=True,
+                                       timeout=(router.poll_timeout * 3, router.timeout))
+            break
+        except requests.ConnectionError as e:
+            # Nothing reached the node, so the request is safe to send elsewhere
+            node.errors += 1
+            router.release(node)
+            router.mark_down(node)
+            logger.warning(f"Forwarding to {node.url} failed: {str(e)}")
+        except requests.RequestException as e:
+            node.errors += 1
+            router.release(node)
+            return jsonify({"error": f"Backend {node.url} failed: {str(e)}"}), 502
+
+    def relay():
+        try:
+            for chunk in upstream.raw.stream(64 * 1024, decode_content=False):
+                yield chunk
+        finally:
+            upstream.close()
+            router.release(node)
+
+    response_headers = [(k, v) for k, v in upstream.raw.headers.items() if k.lower() not in HOP_BY_HOP]
+    response_headers += [("X-Routed-To", node.url), ("X-Route-Reason", reason)]
+    return Response(relay(), status=upstream.status_code, headers=response_headers)
+
+
+def wait_until_up(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/healthz", timeout=1).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def spawn_local_nodes(count, base_port=5001, command=None, env=None):
+    """Start `count` service processes on consecutive ports; returns (processes, urls)
+
+    command defaults to `python main.py`; each process gets its own PORT.
+    """
+    command = command or [sys.executable, "main.py"]
+    processes, urls = [], []
+    for i in range(count):
+        port = base_port + i
+        process_env = dict(os.environ, **(env or {}), PORT=str(port))
+        processes.append(subprocess.Popen(command, env=process_env,
+                                          cwd=os.path.dirname(os.path.abspath(__file__))))
+        urls.append(f"http://127.0.0.1:{port}")
+    for url in urls:
+        if not wait_until_up(url):
+            for process in processes:
+                process.terminate()
+            raise RuntimeError(f"Node {url} did not start")
+    return processes, urls
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", default=ROUTER_NODES, help="Comma-separated backend URLs")
+    parser.add_argument("--spawn", type=int, default=0, help="Start this many local nodes first")
+    parser.add_argument("--base-port", type=int, default=5001)
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    args = parser.parse_args(argv)
+
+    processes = []
+    urls = [url.strip() for url in args.nodes.split(",") if url.strip()]
+    if args.spawn:
+        processes, spawned = spawn_local_nodes(args.spawn, args.base_port)
+        urls += spawned
+    for url in urls:
+        router.join(url)
+    logger.info(f"🚀 Routing port {args.port} to {len(urls)} nodes")
+    try:
+        app.run(host="0.0.0.0", port=args.port, debug=False, threaded=True)
+    finally:
+        for process in processes:
+            process.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import fcntl
+import mmap
+import struct
+import hashlib
+import logging
+import threading
+
+from forklocal import ForkLocal
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH", "")
+SHARED_CACHE_MB = float(os.environ.get("SHARED_CACHE_MB", 64))
+SHARED_CACHE_SLOT_BYTES = int(os.environ.get("SHARED_CACHE_SLOT_BYTES", 8192))
+SHARED_CACHE_STRIPES = int(os.environ.get("SHARED_CACHE_STRIPES", 64))
+SHARED_CACHE_TTL = float(os.environ.get("SHARED_CACHE_TTL", 3600))
+
+MAGIC = b"YOLOSHC1"
+BUCKET_SLOTS = 8
+# magic, slot_bytes, slots
+FILE_HEADER = struct.Struct("<8sII")
+FILE_HEADER_BYTES = 64
+# seq, state, ref, key digest, value length, stored_at
+SLOT_HEADER = struct.Struct("<IBB16sId")
+SEQ = struct.Struct("<I")
+EMPTY, USED = 0, 1
+STATE_OFFSET, REF_OFFSET = 4, 5
+READ_RETRIES = 4
+
+
+def key_digest(key):
+    return hashlib.blake2b(key.encode() if isinstance(key, str) else key, digest_size=16).digest()
+
+
+class SharedCache:
+    """Fixed-size hash table in a memory-mapped file, shared by every process that opens it
+
+    Keys hash to a bucket of BUCKET_SLOTS slots, probed linearly; a full
+    bucket evicts with CLOCK (reads set a slot's reference bit, the bucket's
+    hand clears bits until it finds an unreferenced slot). Writers take one
+    of `stripes` locks, a thread lock plus an fcntl byte-range lock so other
+    processes are excluded too. Readers take no lock: each slot carries a
+    sequence number that is odd while it is being written, and a read that
+    sees it change is retried.
+    """
+
+    def __init__(self, path, size_bytes=int(SHARED_CACHE_MB * 1e6), slot_bytes=SHARED_CACHE_SLOT_BYTES,
+                 stripes=SHARED_CACHE_STRIPES, ttl=SHARED_CACHE_TTL):
+        self.path = path
+        self.slot_bytes = slot_bytes
+        self.capacity = slot_bytes - SLOT_HEADER.size
+        self.buckets = max(1, int(size_bytes // (slot_bytes * BUCKET_SLOTS)))
+        self.slots = self.buckets * BUCKET_SLOTS
+        self.stripes = stripes
+        self.ttl = ttl
+        self._hands_offset = FILE_HEADER_BYTES
+        self._slots_offset = FILE_HEADER_BYTES + -(-self.buckets // 64) * 64
+        self.size = self._slots_offset + self.slots * slot_bytes
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self.too_large = 0
+        self._locks = ForkLocal(lambda: [threading.Lock() for _ in range(self.stripes)])
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._open()
+
+    @classmethod
+    def from_env(cls):
+        return cls(SHARED_CACHE_PATH) if SHARED_CACHE_PATH else None
+
+    def _open(self):
+        """Map the file, initializing it if it is new
+
+        A file made with another geometry may still be mapped by other
+        processes, and shrinking it under them would SIGBUS them. It is
+        replaced by a fresh file instead; they keep the old one until they
+        restart.
+        """
+        expected = FILE_HEADER.pack(MAGIC, self.slot_bytes, self.slots)
+        while True:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_ino != os.stat(self.path).st_ino:
+                    # Someone replaced the file while we waited for the lock; open theirs
+                    os.close(self._fd)
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                    continue
+                header = os.pread(self._fd, FILE_HEADER.size, 0)
+                size = os.fstat(self._fd).st_size
+                if size == 0:
+                    os.ftruncate(self._fd, self.size)
+                    os.pwrite(self._fd, expected, 0)
+                    logger.info(f"✅ Initialized shared cache {self.path}: {self.slots} slots of {self.slot_bytes} bytes")
+                elif header != expected or size != self.size:
+                    self._replace(expected)
+                self._mm = mmap.mmap(self._fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+                return
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _replace(self, header):
+        """Swap a fresh file in at path; called holding the lock on the old one"""
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.ftruncate(fd, self.size)
+        os.pwrite(fd, header, 0)
+        os.replace(tmp, self.path)
+        # The old descriptor keeps its lock until the caller releases it
+        old, self._fd = self._fd, fd
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        fcntl.lockf(old, fcntl.LOCK_UN)
+        os.close(old)
+        logger.warning(f"⚠️ Shared cache {self.path} had another geometry; replaced it with "
+                       f"{self.slots} slots of {self.slot_bytes} bytes (processes using the old one keep it)")
+
+    def _stripe_lock(self, stripe):
+        return self._locks.get()[stripe]
+
+    def _locate(self, digest):
+        bucket = int.from_bytes(digest[:8], "little") % self.buckets
+        return bucket, self._slots_offset + bucket * BUCKET_SLOTS * self.slot_bytes
+
+    def _read_slot(self, offset, digest, now):
+        """Value in the slot at offset if it holds digest; None if not, False if it changed mid-read"""
+        mm = self._mm
+        seq, state, _, slot_digest, length, stored_at = SLOT_HEADER.unpack_from(mm, offset)
+        if seq & 1:
+            return False
+        if state != USED or slot_digest != digest:
+            return None
+        value = mm[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length]
+        if SEQ.unpack_from(mm, offset)[0] != seq:
+            return False
+        if self.ttl and now - stored_at > self.ttl:
+            return None
+        return value
+
+    def get(self, key):
+        """Cached bytes for key, or None"""
+        digest = key_digest(key)
+        _, base = self._locate(digest)
+        now = time.time()
+        for i in range(BUCKET_SLOTS):
+            offset = base + i * self.slot_bytes
+            for _ in range(READ_RETRIES):
+                value = self._read_slot(offset, digest, now)
+                if value is not False:
+                    break
+            else:
+                # A writer keeps getting in the way; wait for it instead
+                stripe = self._locate(digest)[0] % self.stripes
+                with self._stripe_lock(stripe):
+                    fcntl.lockf(self._fd, fcntl.LOCK_SH, 1, stripe)
+                    try:
+                        value = self._read_slot(offset, digest, now)
+                    finally:
+                        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+            if value:
+                self._mm[offset + REF_OFFSET] = 1
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """Store bytes under key; False if they don't fit in a slot"""
+        if len(value) > self.capacity:
+            self.too_large += 1
+            return False
+        digest = key_digest(key)
+        bucket, base = self._locate(digest)
+        stripe = bucket % self.stripes
+        mm = self._mm
+        with self._stripe_lock(stripe):
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                offset = self._choose_slot(bucket, base, digest)
+                seq = SEQ.unpack_from(mm, offset)[0]
+                # A writer killed mid-write leaves seq odd; start from the next odd value either way
+                writing = seq + 1 + (seq & 1)
+                SEQ.pack_into(mm, offset, writing)
+                mm[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(value)] = value
+                SLOT_HEADER.pack_into(mm, offset, writing, USED, 1, digest, len(value), time.time())
+                SEQ.pack_into(mm, offset, writing + 1)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+        self.puts += 1
+        return True
+
+    def _choose_slot(self, bucket, base, digest):
+        """The key's own slot, else a free or expired one, else the CLOCK victim"""
+        mm = self._mm
+        now = time.time()
+        free = None
+        for i in range(BUCKET_SLOTS):
+            offset = base + i * self.slot_bytes
+            _, state, _, slot_digest, _, stored_at = SLOT_HEADER.unpack_from(mm, offset)
+            if state == USED and slot_digest == digest:
+                return offset
+            if free is None and (state != USED or (self.ttl and now - stored_at > self.ttl)):
+                free = offset
+        if free is not None:
+            return free
+        hand_offset = self._hands_offset + bucket
+        hand = mm[hand_offset] % BUCKET_SLOTS
+        while mm[base + hand * self.slot_bytes + REF_OFFSET]:
+            mm[base + hand * self.slot_bytes + REF_OFFSET] = 0
+            hand = (hand + 1) % BUCKET_SLOTS
+        mm[hand_offset] = (hand + 1) % BUCKET_SLOTS
+        self.evictions += 1
+        return base + hand * self.slot_bytes
+
+    def clear(self):
+        for stripe in range(self.stripes):
+            self._stripe_lock(stripe).acquire()
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self.stripes, 0)
+        try:
+            for slot in range(self.slots):
+                offset = self._slots_offset + slot * self.slot_bytes
+                seq = SEQ.unpack_from(self._mm, offset)[0]
+                SLOT_HEADER.pack_into(self._mm, offset, seq + (seq & 1) + 2, EMPTY, 0, bytes(16), 0, 0.0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.stripes, 0)
+            for lock in self._locks.get():
+                lock.release()
+
+    def entries(self):
+        """Slots in use across all processes (a snapshot, read without locks)"""
+        import numpy as np
+
+        states = np.frombuffer(self._mm, dtype=np.uint8, count=self.slots * self.slot_bytes,
+                               offset=self._slots_offset)[STATE_OFFSET::self.slot_bytes]
+        return int(np.count_nonzero(states == USED))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "slots": self.slots,
+            "slot_bytes": self.slot_bytes,
+            "entries": self.entries(),
+            "pid": os.getpid(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "puts": self.puts,
+            "evictions": self.evictions,
+            "too_large": self.too_large,
+        }
+
+
+def result_key(content, model_name, options, extra=()):
+    """Cache key for detections: image content hash plus everything that changes the answer"""
+    parts = (model_name, options.masks, options.mask_stride, int(options.keypoints), *extra)
+    return hashlib.sha1(content).hexdigest() + ":" + "|".join(str(part) for part in parts)
+
+
+def encode_entry(shape, result, detections):
+    return json.dumps({"shape": list(shape), "result": result, "detections": detections},
+                      separators=(",", ":")).encode()
+
+
+def decode_entry(value):
+    """(shape, result fields, detections) from encode_entry's bytes"""
+    entry = json.loads(value)
+    return tuple(entry["shape"]), entry["result"], entry["detections"]
@@ -0,0 +1,104 @@
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+COALESCE_ENABLED = os.environ.get("COALESCE_ENABLED", "1") == "1"
+COALESCE_TIMEOUT = float(os.environ.get("COALESCE_TIMEOUT", 30))
+
+# Request fields that don't change the computed answer, or that only matter through
+# the TaskOptions derived from them (masks, keypoints and fields)
+IGNORED_FIELDS = {"url", "content_hash", "callback_url", "stream", "fields", "masks", "mask_stride", "keypoints"}
+
+
+class CoalesceTimeout(Exception):
+    """A follower gave up waiting for the in-flight request it joined"""
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Runs one computation per key at a time; concurrent callers with the same key share it
+
+    The first caller (the leader) runs the function. Callers arriving while
+    it runs wait for its result, or for its exception, which is raised in
+    every one of them. A follower waits at most `timeout` seconds; the
+    leader itself is never cut short. Nothing is cached: once the flight
+    lands, the next caller starts a new one.
+    """
+
+    def __init__(self, enabled=COALESCE_ENABLED, timeout=COALESCE_TIMEOUT):
+        self.enabled = enabled
+        self.timeout = timeout
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+        self.errors = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """(fn's result, shared) where shared is True for followers"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+                self.leaders += 1
+            else:
+                flight.followers += 1
+                self.followers += 1
+        if leader:
+            try:
+                flight.value = fn()
+            except BaseException as e:
+                flight.error = e
+                if flight.followers:
+                    self.errors += 1
+                raise
+            finally:
+                with self._lock:
+                    self._flights.pop(key, None)
+                flight.done.set()
+                if flight.followers:
+                    logger.info(f"🔗 Shared one computation with {flight.followers} duplicate requests")
+            return flight.value, False
+        if not flight.done.wait(self.timeout):
+            self.timeouts += 1
+            raise CoalesceTimeout(f"Timed out after {self.timeout}s waiting for an identical request in progress")
+        if flight.error is not None:
+            raise flight.error
+        return flight.value, True
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._flights)
+        return {
+            "enabled": self.enabled,
+            "timeout_s": self.timeout,
+            "in_flight": in_flight,
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "timeouts": self.timeouts,
+            "shared_errors": self.errors,
+        }
+
+
+def request_key(data, model_name, options):
+    """Identity of a /predict request's answer: image URL, model and the outputs it computes
+
+    content_hash is the client's claim about the bytes, so it only narrows
+    the key: requests for different URLs never share an answer.
+    """
+    params = {k: v for k, v in data.items() if k not in IGNORED_FIELDS}
+    params["model"] = model_name
+    params["outputs"] = [options.masks, options.mask_stride, options.keypoints]
+    return json.dumps([data.get("url"), data.get("content_hash"), params], sort_keys=True, default=str)
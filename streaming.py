@@ -0,0 +1,87 @@
+import os
+import json
+import logging
+
+from flask import Response, stream_with_context
+
+logger = logging.getLogger(__name__)
+
+# Detections serialized per chunk written to the socket
+STREAM_BATCH = int(os.environ.get("STREAM_BATCH", 64))
+
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+
+def _dumps(value):
+    # Same compact, key-sorted encoding as jsonify so both modes produce identical objects
+    return json.dumps(value, separators=(",", ":"), sort_keys=True)
+
+
+def ndjson_chunks(detections, summary, batch=STREAM_BATCH, encode=_dumps):
+    """One detection per line, then a summary line with the count and "done": true
+
+    A failure half way through is reported as a final line with "done": false,
+    since the 200 status has already been sent.
+    """
+    count = 0
+    lines = []
+    try:
+        for detection in detections:
+            lines.append(encode(detection))
+            count += 1
+            if len(lines) >= batch:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
+        yield _dumps({**summary, "count": count, "done": True}) + "\n"
+    except Exception as e:
+        logger.error(f"Streaming failed after {count} detections: {str(e)}")
+        if lines:
+            yield "\n".join(lines) + "\n"
+        yield _dumps({**summary, "count": count, "done": False, "error": str(e)}) + "\n"
+
+
+def json_chunks(detections, head, batch=STREAM_BATCH, encode=_dumps):
+    """The regular /predict JSON document, written as a chunked array"""
+    fields = [f"{_dumps(key)}:{_dumps(value)}" for key, value in sorted(head.items())]
+    yield "{" + "".join(f"{field}," for field in fields) + '"detections":['
+    count = 0
+    parts = []
+    error = None
+    try:
+        for detection in detections:
+            parts.append(encode(detection))
+            count += 1
+            if len(parts) >= batch:
+                yield ("," if count > len(parts) else "") + ",".join(parts)
+                parts = []
+    except Exception as e:
+        logger.error(f"Streaming failed after {count} detections: {str(e)}")
+        error = str(e)
+    if parts:
+        yield ("," if count > len(parts) else "") + ",".join(parts)
+    tail = f'],"count":{count}'
+    if error is not None:
+        tail += f',"error":{_dumps(error)}'
+    yield tail + "}"
+
+
+def stream_response(detections, head, fmt, encode=_dumps):
+    """Flask response that serializes detections (with encode) while they are being written"""
+    if fmt == "ndjson":
+        chunks = ndjson_chunks(detections, head, encode=encode)
+    else:
+        chunks = json_chunks(detections, head, encode=encode)
+    return Response(stream_with_context(chunks), mimetype=STREAM_FORMATS[fmt])
+
+
+def parse_stream_option(value):
+    """Map the request's "stream" field to a format name, None for a buffered response"""
+    if value in (None, False):
+        return None
+    if value is True:
+        return "ndjson"
+    if value in STREAM_FORMATS:
+        return value
+    raise ValueError(f"'stream' must be true, false or one of {sorted(STREAM_FORMATS)}")
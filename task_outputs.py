@@ -0,0 +1,186 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+MASK_FORMATS = ("polygon", "rle")
+DEFAULT_MASK_FORMAT = os.environ.get("MASK_FORMAT", "polygon")
+MASK_STRIDE = int(os.environ.get("MASK_STRIDE", 1))
+MAX_MASK_STRIDE = 16
+# The detection field each mask format is returned in
+MASK_FIELDS = {"polygon": "polygon", "rle": "mask"}
+
+
+class TaskOptions:
+    """Which segmentation/pose outputs a request wants, parsed from its JSON body"""
+
+    def __init__(self, masks=DEFAULT_MASK_FORMAT, mask_stride=MASK_STRIDE, keypoints=True):
+        self.masks = masks
+        self.mask_stride = mask_stride
+        self.keypoints = keypoints
+
+    @classmethod
+    def from_request(cls, data, fields=None):
+        """Raises ValueError with a client-facing message on bad values
+
+        fields is the parsed "fields" option: outputs it leaves out are turned
+        off, so they are never decoded or encoded.
+        """
+        masks = data.get("masks", DEFAULT_MASK_FORMAT)
+        if masks in (False, None, "none"):
+            masks = None
+        elif masks is True:
+            masks = DEFAULT_MASK_FORMAT
+        elif masks not in MASK_FORMATS:
+            raise ValueError(f"'masks' must be false or one of {list(MASK_FORMATS)}")
+        try:
+            stride = int(data.get("mask_stride", MASK_STRIDE))
+        except (TypeError, ValueError):
+            raise ValueError("'mask_stride' must be an integer")
+        if not 1 <= stride <= MAX_MASK_STRIDE:
+            raise ValueError(f"'mask_stride' must be between 1 and {MAX_MASK_STRIDE}")
+        keypoints = bool(data.get("keypoints", True))
+        if fields is not None:
+            if masks is not None and MASK_FIELDS[masks] not in fields:
+                masks = None
+            keypoints = keypoints and "keypoints" in fields
+        return cls(masks, stride, keypoints)
+
+
+BOXES_ONLY = TaskOptions(masks=None, keypoints=False)
+
+
+def to_numpy(values):
+    """torch tensors (on any device) or array-likes as a NumPy array"""
+    import numpy as np
+
+    if hasattr(values, "cpu"):
+        values = values.cpu()
+    if hasattr(values, "numpy"):
+        values = values.numpy()
+    return np.asarray(values)
+
+
+def resample_masks(masks, orig_shape, stride=1):
+    """Masks at the model's (letterboxed) resolution mapped onto the original image grid
+
+    Nearest-neighbour sampling through one fancy-indexing gather for all masks
+    at once; with stride > 1 only every stride-th pixel of the original grid is
+    produced, which shrinks the RLE and the work proportionally.
+    """
+    import numpy as np
+
+    n, mask_h, mask_w = masks.shape
+    height, width = orig_shape[:2]
+    gain = min(mask_h / height, mask_w / width)
+    pad_y = (mask_h - height * gain) / 2
+    pad_x = (mask_w - width * gain) / 2
+    ys = np.arange(0, height, stride) + stride / 2
+    xs = np.arange(0, width, stride) + stride / 2
+    src_y = np.clip((ys * gain + pad_y).astype(np.intp), 0, mask_h - 1)
+    src_x = np.clip((xs * gain + pad_x).astype(np.intp), 0, mask_w - 1)
+    return masks[:, src_y[:, None], src_x[None, :]] > 0.5
+
+
+def encode_rle(masks):
+    """COCO-style uncompressed RLE (column-major, starting with a run of zeros) for each mask
+
+    All masks are processed together: one diff over the flattened stack finds
+    every run boundary, and the boundaries are then split per mask.
+    """
+    import numpy as np
+
+    n, height, width = masks.shape
+    if n == 0:
+        return []
+    flat = masks.transpose(0, 2, 1).reshape(n, -1).astype(np.int8)
+    edges = np.diff(flat, axis=1, prepend=0) != 0
+    rows, positions = np.nonzero(edges)
+    splits = np.searchsorted(rows, np.arange(1, n))
+    encoded = []
+    for mask_positions in np.split(positions, splits):
+        counts = np.diff(mask_positions, prepend=0, append=height * width)
+        encoded.append({"size": [height, width], "counts": counts.tolist()})
+    return encoded
+
+
+def polygons(masks, start, end, stride=1):
+    """Outline of each mask as a flat [x1, y1, x2, y2, ...] list in image coordinates"""
+    import numpy as np
+
+    outlines = []
+    for points in masks.xy[start:end]:
+        points = np.asarray(points, dtype=np.float32)
+        if stride > 1 and len(points) > 3 * stride:
+            points = points[::stride]
+        outlines.append(np.round(points, 1).reshape(-1).tolist())
+    return outlines
+
+
+def packed_keypoints(keypoints, start, end):
+    """Keypoints as one flat [x, y, conf, x, y, conf, ...] list per detection
+
+    Models without a visibility output get a confidence of 1.0, so the
+    stride is always 3.
+    """
+    import numpy as np
+
+    data = to_numpy(keypoints.data[start:end]).astype(np.float64)
+    if data.shape[-1] == 2:
+        data = np.concatenate([data, np.ones(data.shape[:-1] + (1,))], axis=-1)
+    data[..., :2] = np.round(data[..., :2], 2)
+    data[..., 2] = np.round(data[..., 2], 3)
+    return data.reshape(len(data), -1).tolist()
+
+
+def chunk_extras(result, start, end, options):
+    """Per-detection mask/keypoint lists for boxes[start:end], keyed by response field
+
+    Nothing is read from result.masks or result.keypoints unless the request
+    asked for it, so box-only requests on seg/pose models skip mask decoding.
+    """
+    extras = {}
+    masks = getattr(result, "masks", None)
+    if options.masks and masks is not None:
+        if options.masks == "rle":
+            data = to_numpy(masks.data[start:end])
+            extras["mask"] = encode_rle(resample_masks(data, result.orig_shape, options.mask_stride))
+        else:
+            extras["polygon"] = polygons(masks, start, end, options.mask_stride)
+    keypoints = getattr(result, "keypoints", None)
+    if options.keypoints and keypoints is not None:
+        extras["keypoints"] = packed_keypoints(keypoints, start, end)
+    return extras
+
+
+def offset_extras(detection, x, y):
+    """Shift polygon and keypoint coordinates from a crop into the full image
+
+    RLE masks stay at crop size; mask_origin says where the crop sits.
+    """
+    shifted = {}
+    if "mask" in detection:
+        shifted["mask_origin"] = [x, y]
+    if "polygon" in detection:
+        polygon = detection["polygon"]
+        shifted["polygon"] = [round(v + (x if i % 2 == 0 else y), 1) for i, v in enumerate(polygon)]
+    if "keypoints" in detection:
+        keypoints = list(detection["keypoints"])
+        keypoints[0::3] = [round(v + x, 2) for v in keypoints[0::3]]
+        keypoints[1::3] = [round(v + y, 2) for v in keypoints[1::3]]
+        shifted["keypoints"] = keypoints
+    return shifted
+
+
+def scale_extras(detection, sx, sy):
+    """Scale polygon and keypoint coordinates by (sx, sy), e.g. from a reduced decode to full size"""
+    scaled = {}
+    if "polygon" in detection:
+        polygon = detection["polygon"]
+        scaled["polygon"] = [round(v * (sx if i % 2 == 0 else sy), 1) for i, v in enumerate(polygon)]
+    if "keypoints" in detection:
+        keypoints = list(detection["keypoints"])
+        keypoints[0::3] = [round(v * sx, 2) for v in keypoints[0::3]]
+        keypoints[1::3] = [round(v * sy, 2) for v in keypoints[1::3]]
+        scaled["keypoints"] = keypoints
+    return scaled
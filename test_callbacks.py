@@ -0,0 +1,132 @@
+"""
+Test callback delivery: retries with backoff, per-host caps, dead letters and 202 responses
+"""
+
+import json
+import random
+import threading
+import time
+
+import main
+from callbacks import CallbackDispatcher, DeadLetterStore, Delivery, backoff_delay
+from fake_yolo import FakeYOLO, fake_registry
+from local_server import LocalServer, sample_image_bytes
+
+
+def dispatcher(directory, **kwargs):
+    options = {"backoff_base": 0.01, "backoff_max": 0.05, "max_attempts": 4}
+    options.update(kwargs)
+    return CallbackDispatcher(dead_letters=DeadLetterStore(directory), **options)
+
+
+def flaky(failures, status=503):
+    """Receiver handler that fails the first `failures` requests"""
+    seen = []
+
+    def handler(request_handler, body):
+        seen.append((request_handler.client_address[1], json.loads(body)))
+        if len(seen) <= failures:
+            return status, {}, b"try later"
+        return 200, {}, b"ok"
+    return handler, seen
+
+
+def test_backoff_is_jittered_and_capped():
+    rng = random.Random(1)
+    delays = [backoff_delay(attempt, base=1.0, cap=30, rng=rng) for attempt in range(10) for _ in range(50)]
+    assert all(0 <= d <= 30 for d in delays)
+    assert max(delays[:50]) <= 1.0 and max(delays[-50:]) > 15
+    assert len(set(delays)) == len(delays)
+
+
+def test_retries_until_delivered_over_one_connection(tmp_path, server):
+    handler, seen = flaky(2)
+    url = server.route("/hook", handler=handler)
+    callbacks = dispatcher(tmp_path, max_per_host=1)
+    for i in range(3):
+        callbacks.enqueue(Delivery(f"job{i}", url, {"n": i}))
+    assert callbacks.wait_idle()
+
+    stats = callbacks.stats()
+    assert stats["delivered"] == 3 and stats["retried"] == 2 and stats["dead_letters"] == 0
+    assert sorted(payload["n"] for _, payload in seen[2:]) == [0, 1, 2]
+    # Keep-alive connections from the pool are reused across attempts
+    assert len({port for port, _ in seen}) == 1
+
+
+def test_gives_up_into_dead_letters(tmp_path, server):
+    down, _ = flaky(100, status=500)
+    rejecting, _ = flaky(100, status=400)
+    callbacks = dispatcher(tmp_path)
+    callbacks.enqueue(Delivery("down", server.route("/down", handler=down), {"n": 1}))
+    callbacks.enqueue(Delivery("rejected", server.route("/rejected", handler=rejecting), {"n": 2}))
+    assert callbacks.wait_idle()
+
+    assert server.hits["/down"] == 4 and server.hits["/rejected"] == 1
+    assert callbacks.dead_letters.job_ids() == ["down", "rejected"]
+    record = callbacks.dead_letters.load("down")
+    assert record["attempts"] == 4 and record["last_error"] == "HTTP 500" and record["payload"] == {"n": 1}
+
+    # Once the receiver is back, a dead letter can be sent again
+    server.route("/down", status=200)
+    callbacks.redeliver("down")
+    assert callbacks.wait_idle()
+    assert callbacks.dead_letters.job_ids() == ["rejected"]
+    assert callbacks.stats()["delivered"] == 1
+
+
+def test_concurrency_is_capped_per_host(tmp_path, server):
+    active, peak = [0], {}
+    lock = threading.Lock()
+
+    def slow(name):
+        def handler(request_handler, body):
+            with lock:
+                active[0] += 1
+                peak[name] = max(peak.get(name, 0), active[0])
+            time.sleep(0.1)
+            with lock:
+                active[0] -= 1
+            return 200, {}, b"ok"
+        return handler
+
+    callbacks = dispatcher(tmp_path, max_per_host=2, delivery_workers=6)
+    busy_url = server.route("/hook", handler=slow("busy"))
+    for i in range(8):
+        callbacks.enqueue(Delivery(f"busy{i}", busy_url, {}))
+    started = time.monotonic()
+    done = threading.Event()
+    with LocalServer() as other:
+        other.route("/hook", handler=lambda *_: (done.set(), (200, {}, b"ok"))[1])
+        callbacks.enqueue(Delivery("other", other.url("/hook"), {}))
+        # The other host isn't stuck behind the busy one's backlog
+        assert done.wait(2) and time.monotonic() - started < 0.3
+        assert callbacks.wait_idle()
+    assert peak["busy"] == 2 and server.hits["/hook"] == 8
+
+
+def test_predict_with_callback_returns_202(monkeypatch, tmp_path, server, client):
+    monkeypatch.setattr(main, "registry", fake_registry(FakeYOLO(delay=0.2)))
+    main.registry.get()
+    monkeypatch.setattr(main, "callbacks", dispatcher(tmp_path))
+    image_url = server.route("/photo.jpg", body=sample_image_bytes())
+    handler, seen = flaky(1)
+    hook = server.route("/hook", handler=handler)
+
+    started = time.monotonic()
+    response = client.post("/predict", json={"url": image_url, "callback_url": hook})
+    assert response.status_code == 202 and time.monotonic() - started < 0.2
+    job_id = response.get_json()["job_id"]
+    assert main.callbacks.wait_idle()
+
+    payload = seen[-1][1]
+    assert payload["job_id"] == job_id and payload["success"]
+    assert payload["count"] == len(payload["detections"]) == 3
+
+    client.post("/predict", json={"url": server.url("/missing.jpg"), "callback_url": hook})
+    assert main.callbacks.wait_idle()
+    assert not seen[-1][1]["success"] and "404" in seen[-1][1]["error"]
+
+    assert client.post("/predict", json={"url": image_url, "callback_url": "ftp://x"}).status_code == 400
+    assert client.post("/predict", json={"url": image_url, "callback_url": hook,
+                                         "stream": True}).status_code == 400
@@ -0,0 +1,146 @@
+"""
+Test CPU budget detection, per-worker thread splits and the worker x thread auto-tuner
+"""
+
+import os
+import subprocess
+import sys
+import threading
+
+import cv2
+import pytest
+from werkzeug.serving import make_server
+
+import cpu_tuning
+import main
+from cpu_tuning import WorkerTuning, autotune, cgroup_cpu_limit, choose_best, split_cpus
+from fake_yolo import FakeYOLO
+from local_server import sample_image_bytes
+from model_registry import warm_up
+from replay import ReplayRecorder
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_cgroup_quota_is_read(tmp_path):
+    root = str(tmp_path)
+    assert cgroup_cpu_limit(root) is None
+    write(os.path.join(root, "cpu", "cpu.cfs_quota_us"), "150000\n")
+    write(os.path.join(root, "cpu", "cpu.cfs_period_us"), "100000\n")
+    assert cgroup_cpu_limit(root) == 1.5
+    write(os.path.join(root, "cpu.max"), "max 100000\n")
+    assert cgroup_cpu_limit(root) is None
+    write(os.path.join(root, "cpu.max"), "200000 100000\n")
+    assert cgroup_cpu_limit(root) == 2.0
+    cpus, usable = cpu_tuning.available_cpus(root)
+    assert usable == min(2, len(cpus))
+
+
+def test_cores_are_split_between_workers():
+    plans = split_cpus(list(range(8)), 8, 3)
+    assert [block for block, _ in plans] == [[0, 1], [2, 3, 4], [5, 6, 7]]
+    assert [threads for _, threads in plans] == [2, 3, 3]
+    # Only as many cores as the quota allows, and a fixed thread count when given
+    assert split_cpus(list(range(8)), 4, 2, threads=1) == [([0, 1], 1), ([2, 3], 1)]
+    # More workers than cores share them round-robin
+    assert split_cpus([0, 1], 2, 4) == [([0], 1), ([1], 1), ([0], 1), ([1], 1)]
+    tuning = WorkerTuning({})
+    assert tuning.claim_slot([0, 2], 4) == 1 and tuning.claim_slot([0, 1], 2) == 0
+
+
+class FakeTorch:
+    def __init__(self):
+        self.threads = None
+        self.interop = []
+
+    def set_num_threads(self, n):
+        self.threads = n
+
+    def set_num_interop_threads(self, n):
+        if self.interop:
+            raise RuntimeError("already set")
+        self.interop.append(n)
+
+
+@pytest.fixture
+def cpu_state(monkeypatch):
+    """Puts the thread env vars, CPU affinity and OpenCV's pool size back after the test"""
+    for name in cpu_tuning.THREAD_ENV_VARS:
+        monkeypatch.delenv(name, raising=False)
+    affinity, cv2_threads = os.sched_getaffinity(0), cv2.getNumThreads()
+    yield cv2_threads
+    os.sched_setaffinity(0, affinity)
+    cv2.setNumThreads(cv2_threads)
+
+
+def test_worker_settings_are_applied(monkeypatch, cpu_state):
+    tuning = WorkerTuning({"threads": 3, "affinity": True})
+    applied = tuning.configure(slot=0, workers=1)
+    assert applied["threads"] == 3 and os.environ["OMP_NUM_THREADS"] == "3"
+    assert cv2.getNumThreads() == 3
+    assert os.sched_getaffinity(0) == set(applied["cpus"])
+
+    torch = FakeTorch()
+    tuning.apply_pools(torch)
+    tuning.apply_pools(torch)
+    assert torch.threads == 3 and torch.interop == [cpu_tuning.TORCH_INTEROP_THREADS]
+    # Nothing is applied until the worker has been configured
+    fresh = FakeTorch()
+    WorkerTuning({}).apply_pools(fresh)
+    assert fresh.threads is None
+
+    # Model warm-up sizes the pools again, after the libraries are imported
+    cv2.setNumThreads(cpu_state + 5)
+    monkeypatch.setattr(cpu_tuning, "tuning", tuning)
+    warm_up(FakeYOLO())
+    assert cv2.getNumThreads() == 3
+
+
+def test_opencv_is_capped_without_preload():
+    # A worker of an app that wasn't preloaded: nothing has imported cv2 when it is configured
+    script = ("import sys, cpu_tuning\n"
+              "assert 'cv2' not in sys.modules\n"
+              "cpu_tuning.WorkerTuning({'threads': 3}).configure(slot=0, workers=1)\n"
+              "import cv2\n"
+              "print(cv2.getNumThreads())\n")
+    env = {**os.environ, "CPU_TUNING": "1"}
+    output = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True)
+    assert output.stdout.split()[-1] == "3"
+
+
+def test_choose_best_prefers_throughput_within_budget():
+    runs = [
+        {"workers": 1, "threads": 4, "throughput_rps": 10, "p99_ms": 300, "errors": 0},
+        {"workers": 4, "threads": 1, "throughput_rps": 25, "p99_ms": 900, "errors": 0},
+        {"workers": 2, "threads": 2, "throughput_rps": 22, "p99_ms": 400, "errors": 0},
+        {"workers": 8, "threads": 1, "throughput_rps": 40, "p99_ms": 350, "errors": 3},
+    ]
+    assert choose_best(runs)["workers"] == 4
+    assert choose_best(runs, max_p99_ms=500)["workers"] == 2
+    assert choose_best(runs, max_p99_ms=100) is None
+
+
+def test_autotune_sweeps_combinations(monkeypatch, tmp_path, registry, server, client):
+    launched = []
+
+    def launch(workers, threads):
+        # One in-process server stands in for each gunicorn configuration
+        launched.append((workers, threads))
+        app_server = make_server("127.0.0.1", 0, main.app, threaded=True)
+        threading.Thread(target=app_server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{app_server.server_port}", app_server.shutdown
+
+    monkeypatch.setattr(main, "recorder", ReplayRecorder(str(tmp_path)))
+    for i in range(3):
+        url = server.route(f"/{i}.jpg", body=sample_image_bytes(64 + i, 48))
+        client.post("/predict", json={"url": url, "dedup": False})
+    main.recorder.flush()
+    monkeypatch.setattr(main, "recorder", None)
+    best, runs = autotune(str(tmp_path), launch, [1, 2, 4], [1, 2], concurrency=2, rounds=1, usable=4)
+    assert launched == [(1, 1), (1, 2), (2, 1), (2, 2), (4, 1)]
+    assert all(run["requests"] == 3 and run["errors"] == 0 for run in runs)
+    assert (best["workers"], best["threads"]) in launched
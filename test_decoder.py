@@ -0,0 +1,108 @@
+"""
+Test header sniffing, early size rejection and reduced-size JPEG decoding
+"""
+
+import struct
+
+import cv2
+import numpy as np
+
+import decoder
+from decoder import ImageTooLarge, UnsupportedImage, decode, sniff
+from local_server import sample_image_bytes
+
+
+def encoded(ext, width=96, height=64, params=()):
+    return sample_image_bytes(width, height, ext=ext) if not params else \
+        cv2.imencode(ext, np.zeros((height, width, 3), np.uint8), list(params))[1].tobytes()
+
+
+def with_exif_orientation(jpeg, orientation):
+    """Insert an APP1 Exif segment carrying only an Orientation tag"""
+    tiff = b"II*\x00" + struct.pack("<I", 8) + struct.pack("<H", 1)
+    tiff += struct.pack("<HHIHH", 0x0112, 3, 1, orientation, 0) + struct.pack("<I", 0)
+    payload = b"Exif\x00\x00" + tiff
+    return jpeg[:2] + b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload + jpeg[2:]
+
+
+def test_sniffing_formats_and_sizes():
+    cases = {
+        "jpeg": encoded(".jpg"),
+        "png": encoded(".png"),
+        "bmp": encoded(".bmp"),
+        "webp": encoded(".webp", params=(cv2.IMWRITE_WEBP_QUALITY, 80)),
+        "avif": encoded(".avif", params=(cv2.IMWRITE_AVIF_QUALITY, 80)),
+    }
+    for fmt, data in cases.items():
+        info = sniff(data)
+        assert (info.format, info.width, info.height) == (fmt, 96, 64), (fmt, vars(info))
+    lossless = sniff(encoded(".webp", params=(cv2.IMWRITE_WEBP_QUALITY, 101)))
+    assert (lossless.width, lossless.height) == (96, 64)
+    gif = sniff(b"GIF89a" + struct.pack("<HH", 300, 200) + b"\x00" * 16)
+    assert (gif.format, gif.width, gif.height) == ("gif", 300, 200)
+    heic = sniff(struct.pack(">I", 24) + b"ftypheic" + b"\x00" * 4 + b"mif1heic")
+    assert heic.format == "heif" and heic.width is None
+    assert sniff(b"<html>not an image</html>") is None
+
+
+def test_oversized_images_are_rejected_before_decoding(monkeypatch):
+    decodes = []
+    imdecode = cv2.imdecode
+    monkeypatch.setattr(cv2, "imdecode", lambda *args: decodes.append(1) or imdecode(*args))
+    # A PNG header claiming 100000x100000 pixels, with nothing behind it
+    bomb = b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + struct.pack(">II", 100000, 100000)
+    for data, limit in ((bomb, None), (encoded(".jpg", 400, 300), 100_000)):
+        try:
+            decode(data, max_pixels=limit)
+            assert False
+        except ImageTooLarge as e:
+            assert e.status == 413
+    assert not decodes
+    try:
+        decode(struct.pack(">I", 24) + b"ftypheic" + b"\x00" * 16)
+        assert False
+    except UnsupportedImage as e:
+        assert e.status == 415
+    assert decode(encoded(".jpg", 400, 300), max_pixels=120_000).image.shape == (300, 400, 3)
+
+
+def test_large_jpegs_decode_at_reduced_size():
+    big = sample_image_bytes(2560, 1920)
+    decoded = decode(big, max_side=640, scaling=True)
+    assert decoded.image.shape == (480, 640, 3) and decoded.scale == (4.0, 4.0)
+    assert decoded.full_shape == (1920, 2560, 3)
+    # Never below the inference size, and only for JPEG
+    assert decode(big, max_side=1000, scaling=True).scale == (2.0, 2.0)
+    assert not decode(sample_image_bytes(1000, 800), max_side=640, scaling=True).scaled
+    assert not decode(sample_image_bytes(2560, 1920, ext=".png"), max_side=640, scaling=True).scaled
+    assert not decode(big, max_side=640, scaling=False).scaled
+
+    # EXIF rotation is applied, and the scale follows the rotated axes
+    rotated = decode(with_exif_orientation(sample_image_bytes(2560, 1280), 6), max_side=640, scaling=True)
+    assert rotated.image.shape == (640, 320, 3) and rotated.full_shape == (2560, 1280, 3)
+
+
+def test_predict_maps_reduced_decodes_back(monkeypatch, model, registry, server, client):
+    monkeypatch.setattr(decoder, "DECODE_SCALING", True)
+    url = server.route("/big.jpg", body=sample_image_bytes(2560, 1920))
+    body = client.post("/predict", json={"url": url, "dedup": False}).get_json()
+    assert model.last_shapes == [(480, 640, 3)]
+    assert body["detections"][0]["bbox"] == {"x1": 40.0, "y1": 48.0, "x2": 160.0, "y2": 176.0}
+
+    streamed = client.post("/predict", json={"url": url, "stream": True}).get_data(as_text=True)
+    assert '"x1":40.0' in streamed.splitlines()[0]
+
+    client.post("/predict", json={"url": url, "dedup": False, "masks": "rle"})
+    assert model.last_shapes == [(1920, 2560, 3)]
+
+    # Without the policy the reduction follows the checkpoint's imgsz, or is skipped if unknown
+    model.overrides = {"imgsz": 1280}
+    client.post("/predict", json={"url": url, "dedup": False})
+    assert model.last_shapes == [(960, 1280, 3)] and "imgsz" not in model.last_kwargs
+    model.overrides = {}
+    client.post("/predict", json={"url": url, "dedup": False})
+    assert model.last_shapes == [(1920, 2560, 3)]
+
+    monkeypatch.setattr(decoder, "MAX_IMAGE_PIXELS", 1_000_000)
+    rejected = client.post("/predict", json={"url": server.route("/huge.jpg", body=sample_image_bytes(2000, 1000))})
+    assert rejected.status_code == 413 and "pixel limit" in rejected.get_json()["error"]
@@ -0,0 +1,39 @@
+"""
+Test per-process state that is rebuilt after a fork
+"""
+
+import multiprocessing
+import os
+
+from forklocal import ForkLocal
+
+
+def report_child(local, parent_value, results):
+    inherited = local.peek()
+    value = local.get()
+    results.put((inherited, value is not parent_value and value == os.getpid()))
+
+
+def test_each_process_builds_its_own():
+    built = []
+    local = ForkLocal(lambda: built.append(os.getpid()) or os.getpid())
+    assert local.peek() is None
+    parent_value = local.get()
+    assert local.get() is parent_value and local.peek() is parent_value and built == [os.getpid()]
+
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    # Fork while the lock is held, as a master thread might be doing at that moment
+    local._lock.acquire()
+    try:
+        child = context.Process(target=report_child, args=(local, parent_value, results))
+        child.start()
+    finally:
+        local._lock.release()
+    child.join(10)
+    if child.is_alive():
+        child.kill()
+    assert child.exitcode == 0, "child deadlocked on the inherited lock"
+    inherited, rebuilt = results.get(timeout=1)
+    assert inherited is None and rebuilt
+    assert local.get() is parent_value and built == [os.getpid()]
@@ -0,0 +1,80 @@
+"""
+Test the /healthz and /readyz endpoints
+"""
+
+import pytest
+
+import main
+from fake_yolo import FakeYOLO, fake_registry
+from health import HealthMonitor, LatencyWindow, percentile
+
+
+@pytest.fixture
+def monitor(monkeypatch, registry):
+    """monitor(**kwargs) installs a fresh HealthMonitor as main.monitor"""
+    return lambda **kwargs: monkeypatch.setattr(
+        main, "monitor", HealthMonitor(self_test=main.run_self_test, **kwargs))
+
+
+def test_percentile_and_window():
+    assert percentile([], 95) is None
+    assert percentile(list(range(1, 101)), 95) == 95
+    assert percentile([3.0], 95) == 3.0
+
+    window = LatencyWindow(window_s=10)
+    window.record(0.5, now=1.0)
+    window.record(0.1, now=20.0)
+    assert window.recent(now=20.0) == [0.1]
+
+
+def test_healthz_is_cheap(monitor, model, client):
+    monitor()
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "alive"
+    assert model.calls == 0
+    assert not main.registry.is_resident()
+
+
+def test_readyz_caches_self_test(monitor, model, client):
+    monitor(interval=60)
+    for _ in range(5):
+        response = client.get("/readyz")
+        assert response.status_code == 200
+    report = response.get_json()
+    assert report["status"] == "ready"
+    assert report["self_test"]["backend"]["type"] == "FakeYOLO"
+    # One warm-up on load plus a single self-test for all five probes
+    assert model.calls == 2
+
+
+class BrokenYOLO(FakeYOLO):
+    def predict(self, source=None, verbose=False, **kwargs):
+        if self.calls >= 1:
+            raise RuntimeError("CUDA wedged")
+        return super().predict(source=source, verbose=verbose, **kwargs)
+
+
+def test_readyz_reports_failures(monkeypatch, monitor, client):
+    monkeypatch.setattr(main, "registry", fake_registry(BrokenYOLO()))
+    monitor()
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert "self-test failed" in response.get_json()["reasons"]
+
+
+def test_readyz_reports_overload(monitor, client):
+    monitor(max_queue=2)
+    for _ in range(3):
+        main.monitor.request_started()
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["queue_depth"] == 3
+
+
+def test_readyz_reports_slow_workers(monitor, client):
+    monitor(max_p95_ms=1000)
+    main.monitor.latency.record(2.0)
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["p95_latency_ms"] == 2000.0
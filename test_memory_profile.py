@@ -0,0 +1,59 @@
+"""
+Test the startup memory profiling and the gunicorn worker recycling hook
+"""
+
+import logging
+import mmap
+import runpy
+
+from memory_profile import StageTracker, memory_breakdown, profile_imports
+
+
+def test_profile_imports_reports_time_and_rss():
+    report = profile_imports(["json", "module_that_does_not_exist"])
+    assert [entry["module"] for entry in report] == ["json", "module_that_does_not_exist"]
+    assert report[0]["error"] is None
+    assert report[1]["error"]
+    for entry in report:
+        assert entry["seconds"] >= 0
+        assert entry["rss_delta"] >= 0
+
+
+def test_stage_tracker_records_deltas():
+    tracker = StageTracker()
+    first = tracker.mark("start")
+    # An anonymous mapping always gets fresh pages, whatever the heap already holds
+    ballast = mmap.mmap(-1, 32 * 1024 * 1024)
+    ballast[::4096] = b"x" * len(ballast[::4096])  # touch every page
+    second = tracker.mark("ballast")
+    assert second["rss"] > first["rss"]
+    assert second["rss_delta"] >= 16 * 1024 * 1024
+    assert [s["stage"] for s in tracker.stages] == ["start", "ballast"]
+    ballast.close()
+
+
+def test_memory_breakdown_splits_shared_and_private():
+    breakdown = memory_breakdown()
+    assert breakdown["rss"] > 0
+    if "pss" in breakdown:
+        assert breakdown["private"] <= breakdown["rss"]
+
+
+class FakeWorker:
+    pid = 1234
+    alive = True
+    log = logging.getLogger("gunicorn.test")
+
+
+def test_post_request_recycles_large_workers():
+    config = runpy.run_path("gunicorn.conf.py")
+    worker = FakeWorker()
+
+    config["post_request"].__globals__["MAX_WORKER_RSS_MB"] = 1
+    config["post_request"](worker, None, {}, None)
+    assert worker.alive is False
+
+    worker = FakeWorker()
+    config["post_request"].__globals__["MAX_WORKER_RSS_MB"] = 1024 * 1024
+    config["post_request"](worker, None, {}, None)
+    assert worker.alive is True
@@ -0,0 +1,137 @@
+"""
+Test the model registry: per-request selection, LRU cap and hot-swap
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+import main
+from decoder import Decoded
+from fake_yolo import FakeYOLO
+from model_registry import ModelRegistry
+
+
+def make_registry(model_dir, max_resident=2, loaded=None, load_delay=0.0):
+    def loader(path):
+        time.sleep(load_delay)
+        model = FakeYOLO()
+        model.path = path
+        if loaded is not None:
+            loaded.append(path)
+        return model
+
+    return ModelRegistry(model_dir=model_dir, default="base",
+                         max_resident=max_resident, loader=loader)
+
+
+def touch_weights(model_dir, *names):
+    for name in names:
+        with open(os.path.join(model_dir, f"{name}.pt"), "wb") as f:
+            f.write(b"weights")
+
+
+def test_selects_models_by_name_from_directory(tmp_path):
+    model_dir = str(tmp_path)
+    touch_weights(model_dir, "base", "custom")
+    registry = make_registry(model_dir)
+
+    assert "custom" in registry.available()
+    handle = registry.get("custom")
+    assert handle.path == os.path.join(model_dir, "custom.pt")
+    assert registry.get().name == "base"
+
+    try:
+        registry.get("../etc/passwd")
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("unknown model names must be rejected")
+
+
+def test_lru_cap_evicts_least_recently_used(tmp_path):
+    model_dir = str(tmp_path)
+    touch_weights(model_dir, "base", "a", "b")
+    loaded = []
+    registry = make_registry(model_dir, max_resident=2, loaded=loaded)
+
+    registry.get("base")
+    registry.get("a")
+    registry.get("base")  # base is now most recently used
+    registry.get("b")     # evicts a
+
+    assert registry.is_resident("base")
+    assert registry.is_resident("b")
+    assert not registry.is_resident("a")
+    assert registry.evictions == 1
+
+    registry.get("a")
+    assert len(loaded) == 4
+
+
+def test_reports_load_time_and_memory(tmp_path):
+    model_dir = str(tmp_path)
+    registry = make_registry(model_dir, load_delay=0.05)
+    info = registry.get().info()
+    assert info["load_time_s"] >= 0.05
+    assert info["memory_bytes"] >= 0
+    assert registry.stats()["resident"][0]["name"] == "base"
+
+
+def test_hot_swap_under_load(tmp_path):
+    model_dir = str(tmp_path)
+    touch_weights(model_dir, "base")
+    registry = make_registry(model_dir, load_delay=0.05)
+    old = registry.get()
+    image = np.zeros((8, 8, 3), dtype=np.uint8)
+
+    stop = threading.Event()
+    seen = set()
+    errors = []
+
+    def client():
+        while not stop.is_set():
+            try:
+                with registry.acquire() as handle:
+                    # A model must be warm before it takes traffic
+                    assert handle.model.calls >= 1
+                    handle.model.predict(source=image)
+                    seen.add(id(handle))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=client) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    new, drained = registry.swap("base")
+    time.sleep(0.05)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    assert not errors, errors
+    assert drained
+    assert old.retired and old.in_flight == 0
+    assert registry.get() is new
+    assert seen == {id(old), id(new)}
+
+
+def test_predict_endpoint_routes_by_model(monkeypatch, tmp_path, client):
+    touch_weights(tmp_path, "base", "custom")
+    monkeypatch.setattr(main, "registry", make_registry(str(tmp_path)))
+    monkeypatch.setattr(main, "model", None)
+    monkeypatch.setattr(main, "read_decoded_from_url",
+                        lambda url, max_side=None: Decoded(np.zeros((32, 32, 3), dtype=np.uint8)))
+    response = client.post("/predict", json={"url": "http://example/x.jpg", "model": "custom"})
+    assert response.status_code == 200
+    assert response.get_json()["model"] == "custom"
+    assert response.get_json()["count"] == 3
+
+    response = client.post("/predict", json={"url": "http://example/x.jpg", "model": "missing"})
+    assert response.status_code == 400
+
+    names = [m["name"] for m in client.get("/models").get_json()["resident"]]
+    assert names == ["custom"]
@@ -0,0 +1,106 @@
+"""
+Test perceptual-hash deduplication of near-identical images
+"""
+
+import random
+
+import cv2
+import numpy as np
+
+import main
+from phash import DedupCache, MultiIndexHash, dhash, phash, rescale_detections
+
+
+def photo(seed, width=640, height=480):
+    """Smooth random texture that survives resizing, like a real photo"""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, size=(12, 16, 3), dtype=np.uint8)
+    return cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+
+
+def reencode(image, quality=40):
+    ok, buf = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+def test_multi_index_hash_matches_brute_force():
+    rng = random.Random(7)
+    index = MultiIndexHash(threshold=6)
+    values = {}
+    for item_id in range(2000):
+        values[item_id] = rng.getrandbits(64)
+        index.add(values[item_id], item_id)
+    # Plant near neighbours of a query
+    query = rng.getrandbits(64)
+    for item_id, flips in enumerate(range(0, 9), start=2000):
+        value = query
+        for bit in rng.sample(range(64), flips):
+            value ^= 1 << bit
+        values[item_id] = value
+        index.add(value, item_id)
+
+    expected = {i for i, v in values.items() if (v ^ query).bit_count() <= 6}
+    found = {i for i in index.candidates(query) if (values[i] ^ query).bit_count() <= 6}
+    assert found == expected and len(expected) >= 7
+
+    index.remove(values[2000], 2000)
+    assert 2000 not in index.candidates(query)
+
+
+def test_hashes_tolerate_resizes_and_reencodes():
+    original = photo(1)
+    variants = [reencode(original), cv2.resize(original, (160, 120), interpolation=cv2.INTER_AREA),
+                reencode(cv2.resize(original, (320, 240), interpolation=cv2.INTER_AREA), 60)]
+    for hash_fn in (dhash, phash):
+        base = hash_fn(original)
+        for variant in variants:
+            assert (base ^ hash_fn(variant)).bit_count() <= 6
+        assert (base ^ hash_fn(photo(2))).bit_count() > 10
+
+
+def test_cache_rescales_boxes():
+    cache = DedupCache(enabled=True)
+    original = photo(3)
+    detections = [{"class_id": 2, "class_name": "car", "confidence": 0.9,
+                   "bbox": {"x1": 64.0, "y1": 48.0, "x2": 320.0, "y2": 240.0}}]
+    found, info, value = cache.lookup(original, "yolov8n")
+    assert found is None and not info["hit"]
+    cache.add(value, "yolov8n", original.shape, detections)
+
+    thumb = cv2.resize(original, (160, 120), interpolation=cv2.INTER_AREA)
+    found, info, _ = cache.lookup(thumb, "yolov8n")
+    assert info["hit"] and info["lookup_ms"] >= 0
+    assert found[0]["bbox"] == {"x1": 16.0, "y1": 12.0, "x2": 80.0, "y2": 60.0}
+
+    # Other models and cropped (different aspect) images don't share results
+    assert cache.lookup(thumb, "yolov8s")[0] is None
+    assert cache.lookup(original[:, :400], "yolov8n")[0] is None
+    assert cache.stats()["hit_rate"] == 0.25
+
+    assert rescale_detections(detections, (480, 640), (480, 640)) == detections
+
+
+def test_predict_reuses_detections_for_thumbnails(monkeypatch, model, registry, server, client):
+    monkeypatch.setattr(main, "dedup", DedupCache(enabled=True))
+    original = photo(4)
+    _, full = cv2.imencode(".jpg", original)
+    _, thumb = cv2.imencode(".jpg", cv2.resize(original, (320, 240), interpolation=cv2.INTER_AREA))
+    full_url = server.route("/full.jpg", body=full.tobytes())
+    thumb_url = server.route("/thumb.jpg", body=thumb.tobytes())
+
+    first = client.post("/predict", json={"url": full_url}).get_json()
+    calls = model.calls
+    second = client.post("/predict", json={"url": thumb_url}).get_json()
+    assert model.calls == calls
+    assert second["dedup"]["hit"] and not first["dedup"]["hit"]
+    assert second["detections"][0]["bbox"]["x2"] == round(first["detections"][0]["bbox"]["x2"] / 2, 2)
+
+    client.post("/predict", json={"url": thumb_url, "dedup": False})
+    assert model.calls == calls + 1
+    assert client.get("/dedup").get_json()["hits"] == 1
+
+    # Detections from weights that were swapped out aren't reused
+    main.registry.swap(main.registry.default)
+    calls = model.calls
+    after_swap = client.post("/predict", json={"url": thumb_url}).get_json()
+    assert not after_swap["dedup"]["hit"] and model.calls == calls + 1
@@ -0,0 +1,121 @@
+"""
+Test per-key rate limiting and inference quota accounting
+"""
+
+import multiprocessing
+
+import numpy as np
+
+import main
+from rate_limit import MemoryStore, RateLimiter, SQLiteStore, inference_cost
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_over_time():
+    clock = FakeClock()
+    limits = {"rps": 2, "burst": 3}
+    limiter = RateLimiter({"default": limits, "team-a": limits, "team-b": limits}, MemoryStore(), clock)
+
+    assert [limiter.check_request("team-a").allowed for _ in range(4)] == [True, True, True, False]
+    assert limiter.check_request("team-b").allowed  # separate bucket per configured key
+
+    decision = limiter.check_request("team-a")
+    assert decision.retry_after == 0.5
+    clock.now += 0.5
+    assert limiter.check_request("team-a").allowed
+    assert not limiter.check_request("team-a").allowed
+
+
+def test_cost_budget_weighted_by_pixels():
+    clock = FakeClock()
+    limiter = RateLimiter({"default": {"cost_per_hour": 10}}, MemoryStore(), clock)
+
+    assert inference_cost(np.zeros((100, 100, 3))) == 1
+    assert inference_cost(np.zeros((1920, 1080, 3))) == 6
+
+    assert limiter.check_request("team-a").allowed
+    limiter.charge("team-a", 6)
+    assert limiter.check_request("team-a").allowed
+    limiter.charge("team-a", 6)  # overdraws the budget to -2
+    decision = limiter.check_request("team-a")
+    assert not decision.allowed
+    assert decision.reason == "inference quota exceeded"
+    assert decision.retry_after == 3 * 360
+
+    clock.now += 3 * 360
+    assert limiter.check_request("team-a").allowed
+
+
+def test_per_key_overrides():
+    limiter = RateLimiter({"default": {"rps": 1, "burst": 1}, "batch-team": {}}, MemoryStore(), FakeClock())
+    assert all(limiter.check_request("batch-team").allowed for _ in range(50))
+    assert limiter.check_request("other").allowed
+    assert not limiter.check_request("other").allowed
+
+
+def test_unknown_keys_share_one_bucket():
+    clock = FakeClock()
+    store = MemoryStore(idle_after=60)
+    limiter = RateLimiter({"default": {"rps": 1, "burst": 2, "cost_per_hour": 10}}, store, clock)
+    # Rotating keys draws from the same anonymous bucket
+    assert [limiter.check_request(f"key-{i}").allowed for i in range(3)] == [True, True, False]
+    assert limiter.check_request("default").allowed is False
+    assert limiter.usage("key-9")["bucket"] == "anonymous"
+
+    # Reading the budget doesn't write a bucket
+    assert limiter.budget("key-1") == 10 and store.peek("cost:anonymous") is None
+
+    # Idle buckets are dropped, but not ones still in debt
+    limiter.charge("key-1", 25)
+    clock.now += 120
+    for i in range(1024):
+        store.transact(f"other-{i}", lambda state: ((1.0, clock.now), None))
+    assert store.peek("req:anonymous") is None and store.peek("cost:anonymous") is not None
+
+
+def take_tokens(path, attempts, results):
+    limiter = RateLimiter({"default": {"rps": 0.001, "burst": 30}}, SQLiteStore(path))
+    results.put(sum(limiter.check_request("shared").allowed for _ in range(attempts)))
+
+
+def test_sqlite_store_is_shared_across_processes(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    path = str(tmp_path / "limits.db")
+    SQLiteStore(path)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=take_tokens, args=(path, 20, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sum(results.get() for _ in workers) == 30
+
+
+def test_predict_rejects_before_download(monkeypatch, registry, client):
+    downloads = []
+
+    def fake_download(url, max_side=None):
+        downloads.append(url)
+        raise RuntimeError("stop after the rate limiter")
+
+    limits = {"rps": 0.001, "burst": 1}
+    monkeypatch.setattr(main, "rate_limiter",
+                        RateLimiter({"default": limits, "noisy": limits, "quiet": limits}, MemoryStore()))
+    monkeypatch.setattr(main, "read_decoded_from_url", fake_download)
+    headers = {"X-API-Key": "noisy"}
+    client.post("/predict", json={"url": "http://example/a.jpg"}, headers=headers)
+    response = client.post("/predict", json={"url": "http://example/a.jpg"}, headers=headers)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert len(downloads) == 1
+
+    response = client.post("/predict", json={"url": "http://example/a.jpg"}, headers={"X-API-Key": "quiet"})
+    assert response.status_code != 429
+    assert len(downloads) == 2
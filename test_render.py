@@ -0,0 +1,111 @@
+"""
+Test annotated image rendering and the /predict/render cache
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+import main
+import render
+from local_server import sample_image_bytes
+from render import LabelSprites, Renderer, draw_detections, encode, parse_render_options
+
+
+PALETTE = np.array(render.PALETTE, dtype=np.uint8)
+
+
+def box(class_id, x1, y1, x2, y2, name="car", confidence=0.87):
+    return {"class_id": class_id, "class_name": name, "confidence": confidence,
+            "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}}
+
+
+def test_boxes_and_labels_are_drawn():
+    image = np.zeros((400, 400, 3), dtype=np.uint8)
+    out = draw_detections(image, [box(2, 50, 100, 200, 300), box(5, 250, 10, 390, 120, "bus")])
+    assert image.max() == 0
+    assert (out[200, 50] == PALETTE[2]).all() and (out[299, 120] == PALETTE[2]).all()
+    assert (out[60, 389] == PALETTE[5]).all()
+    assert out[200, 120].max() == 0
+    # White label text sits on a colored strip above the first box
+    strip = out[80:100, 50:120]
+    assert (strip == 255).all(axis=2).any() and (strip == PALETTE[2]).all(axis=2).any()
+    # The second box is at the top edge, so its label goes inside it
+    assert (out[10:25, 250:300] == 255).all(axis=2).any()
+
+    plain = draw_detections(image, [box(2, 50, 100, 200, 300)], labels=False)
+    assert not (plain == 255).all(axis=2).any()
+    # Degenerate and out-of-frame boxes are skipped or clipped
+    draw_detections(image, [box(1, 500, 500, 600, 600), box(1, -20, -20, 30, 30), box(1, 5, 5, 5, 9)])
+
+
+def test_label_sprites_are_reused():
+    sprites = LabelSprites()
+    calls = []
+    rasterize = sprites._rasterize
+    sprites._rasterize = lambda text, scale: calls.append(text) or rasterize(text, scale)
+    first = sprites.label("person", 0.91, 0.4)
+    second = sprites.label("person", 0.19, 0.4)
+    assert first.shape[0] == second.shape[0] and first.dtype == np.uint8
+    assert sorted(calls) == sorted(["person ", "0", ".", "9", "1"])
+
+
+def test_encoding_options():
+    image = cv2.imdecode(np.frombuffer(sample_image_bytes(320, 240), np.uint8), cv2.IMREAD_COLOR)
+    low, high = encode(image, "jpeg", 20), encode(image, "jpeg", 95)
+    assert low[:2] == b"\xff\xd8" and len(low) < len(high)
+    webp = encode(image, "webp", 80)
+    assert webp[:4] == b"RIFF" and webp[8:12] == b"WEBP"
+    assert parse_render_options({"format": "JPG", "quality": "50", "labels": "false"}) == ("jpeg", 50, False)
+    for bad in ({"format": "gif"}, {"quality": 0}, {"quality": "best"}):
+        try:
+            parse_render_options(bad)
+            assert False, bad
+        except ValueError:
+            pass
+
+
+def test_render_route_caches_by_image_and_params(monkeypatch, model, registry, server, client):
+    threads = []
+    registry.get()
+    monkeypatch.setattr(main, "renderer", Renderer(workers=1))
+    draw_detections = render.draw_detections
+
+    def draw(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return draw_detections(*args, **kwargs)
+    monkeypatch.setattr(render, "draw_detections", draw)
+
+    url = server.route("/scene.jpg", body=sample_image_bytes(320, 240))
+    calls = model.calls
+
+    first = client.get(f"/predict/render?url={url}&quality=70")
+    assert first.status_code == 200 and first.mimetype == "image/jpeg"
+    assert first.headers["X-Render-Cache"] == "miss" and first.headers["X-Detections"] == "3"
+    decoded = cv2.imdecode(np.frombuffer(first.data, np.uint8), cv2.IMREAD_COLOR)
+    assert decoded.shape == (240, 320, 3)
+    assert threads and threads[0].startswith("render")
+
+    again = client.post("/predict/render", json={"url": url, "quality": 70})
+    assert again.headers["X-Render-Cache"] == "hit" and again.data == first.data
+    assert model.calls == calls + 1
+
+    not_modified = client.get(f"/predict/render?url={url}&quality=70",
+                              headers={"If-None-Match": first.headers["ETag"]})
+    assert not_modified.status_code == 304 and not not_modified.data
+
+    webp = client.get(f"/predict/render?url={url}&format=webp")
+    assert webp.mimetype == "image/webp" and webp.headers["X-Render-Cache"] == "miss"
+    assert model.calls == calls + 2
+    assert client.get("/render/cache").get_json()["entries"] == 2
+
+    # New weights draw new boxes, under a new ETag
+    main.registry.swap(main.registry.default)
+    calls = model.calls
+    swapped = client.get(f"/predict/render?url={url}&quality=70")
+    assert swapped.headers["X-Render-Cache"] == "miss" and swapped.headers["ETag"] != first.headers["ETag"]
+    assert model.calls == calls + 1
+
+    assert client.get(f"/predict/render?url={url}&format=bmp").status_code == 400
+    assert client.get("/predict/render").status_code == 400
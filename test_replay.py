@@ -0,0 +1,87 @@
+"""
+Test recording /predict traffic and replaying it to catch detection and latency regressions
+"""
+
+import json
+import os
+
+import main
+import replay
+from fake_yolo import FakeYOLO, fake_registry
+from local_server import sample_image_bytes
+from replay import ReplayRecorder, compare_runs, load_results, match_detections, replay_corpus, server_timing
+
+
+def det(class_id, x1, y1, x2, y2, confidence=0.9):
+    return {"class_id": class_id, "class_name": str(class_id), "confidence": confidence,
+            "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}}
+
+
+def test_matching_by_class_and_iou():
+    expected = [det(0, 0, 0, 10, 10), det(0, 20, 20, 30, 30), det(2, 0, 0, 10, 10)]
+    actual = [det(0, 21, 21, 31, 31), det(0, 1, 0, 11, 10), det(2, 50, 50, 60, 60), det(5, 0, 0, 10, 10)]
+    matches, missing, extra = match_detections(expected, actual, iou_threshold=0.5)
+    assert [(m[0]["bbox"]["x1"], m[1]["bbox"]["x1"]) for m in matches] == [(0, 1), (20, 21)]
+    assert missing == [expected[2]] and {d["class_id"] for d in extra} == {2, 5}
+    assert match_detections([], [], 0.5) == ([], [], [])
+
+
+def record_corpus(monkeypatch, server, client, directory, model, download_delay=0):
+    monkeypatch.setattr(main, "registry", fake_registry(model))
+    monkeypatch.setattr(main, "recorder", ReplayRecorder(directory))
+    for i, (width, height) in enumerate([(64, 48), (320, 240), (64, 48)]):
+        url = server.route(f"/{i}.jpg", body=sample_image_bytes(width, height), delay=download_delay)
+        assert client.post("/predict", json={"url": url, "dedup": False}).status_code == 200
+    # Streamed responses and failures aren't recorded
+    client.post("/predict", json={"url": server.url("/0.jpg"), "stream": True}).get_data()
+    client.post("/predict", json={"url": server.url("/missing.jpg")})
+    main.recorder.flush()
+    monkeypatch.setattr(main, "recorder", None)
+
+
+def run_build(monkeypatch, directory, model):
+    monkeypatch.setattr(main, "registry", fake_registry(model))
+    return {r["id"]: r for r in replay_corpus(directory, replay.app_sender(), concurrency=2)}
+
+
+def test_record_and_replay_same_build_passes(monkeypatch, tmp_path, server, client):
+    directory = str(tmp_path)
+    # Slow image hosts don't count towards the recorded time
+    record_corpus(monkeypatch, server, client, directory, FakeYOLO(), download_delay=0.2)
+    corpus = load_results(directory)
+    assert len(corpus) == 3
+    assert all(0 < entry["server_ms"] < 200 for entry in corpus.values())
+    # Identical images are stored once
+    assert len(os.listdir(os.path.join(directory, "images"))) == 2
+    entry = next(iter(corpus.values()))
+    assert entry["params"] == {"dedup": False} and len(entry["detections"]) == 3
+
+    candidate = run_build(monkeypatch, directory, FakeYOLO())
+    assert all(0 < result["server_ms"] <= result["latency_ms"] for result in candidate.values())
+    report = compare_runs(corpus, candidate, max_p95_regression=10.0)
+    assert report["passed"] and report["compared"] == 3 and not report["mismatched"]
+    assert server_timing("db;dur=3, app;desc=\"x\";dur=12.5") == 12.5 and server_timing(None) is None
+
+
+def test_regressions_fail_the_comparison(monkeypatch, tmp_path, server, client):
+    directory = str(tmp_path)
+    record_corpus(monkeypatch, server, client, directory, FakeYOLO())
+    baseline = run_build(monkeypatch, directory, FakeYOLO())
+
+    # A build that mislabels one box, moves another and drops the third
+    shifted = FakeYOLO(detections=[(0, 0.88, 10.0, 12.0, 40.0, 44.0), (2, 0.9, 300.0, 300.0, 320.0, 320.0)])
+    report = compare_runs(baseline, run_build(monkeypatch, directory, shifted), max_p95_regression=10.0)
+    assert not report["passed"] and report["mismatch_rate"] == 1.0
+    assert report["mismatched"][0]["missing"] >= 1
+
+    slow = run_build(monkeypatch, directory, FakeYOLO(delay=0.1))
+    report = compare_runs(baseline, slow, max_p95_regression=0.5)
+    assert not report["passed"] and not report["mismatched"]
+    assert "p95 latency" in report["failures"][0]
+
+    output = os.path.join(directory, "slow.ndjson")
+    with open(output, "w") as f:
+        for result in slow.values():
+            f.write(json.dumps(result) + "\n")
+    assert replay.main(["compare", directory, output, "--max-p95-regression", "1000"]) == 0
+    assert replay.main(["compare", output, directory, "--max-mismatch", "0", "--iou", "0.99"]) == 0
@@ -0,0 +1,69 @@
+"""
+Test the adaptive inference resolution policy
+"""
+
+import main
+from phash import DedupCache
+from fake_yolo import FakeYOLO, fake_registry
+from local_server import sample_image_bytes
+from resolution import ResolutionPolicy, parse_steps
+
+
+def test_small_images_are_not_upscaled():
+    policy = ResolutionPolicy(enabled=True)
+    assert policy.steps == [320, 416, 512, 640]
+    assert policy.choose((200, 300)).imgsz == 320
+    assert policy.choose((400, 500)).imgsz == 512
+    assert policy.choose((1080, 1920)).info() == {"imgsz": 640, "reason": "full"}
+    assert ResolutionPolicy(enabled=False).choose((200, 300)).info() == {"imgsz": None, "reason": "fixed"}
+    assert parse_steps("320,960", 640) == [320, 640]
+
+
+def test_load_steps_resolution_down():
+    policy = ResolutionPolicy(enabled=True, queue_soft_limit=2, latency_slo_ms=500)
+    assert policy.choose((1080, 1920), in_flight=2).imgsz == 640
+    assert policy.choose((1080, 1920), in_flight=3).info() == {"imgsz": 512, "reason": "load"}
+    assert policy.choose((1080, 1920), in_flight=6).imgsz == 416
+    assert policy.choose((1080, 1920), in_flight=1, p95_ms=600).imgsz == 512
+    assert policy.choose((1080, 1920), in_flight=1, p95_ms=1100).imgsz == 416
+    assert policy.choose((1080, 1920), in_flight=50).imgsz == 320
+    assert policy.choose((1080, 1920), in_flight=50).model is None
+
+    policy.overload_model = "tiny"
+    assert policy.choose((1080, 1920), in_flight=50).info() == {"imgsz": 320, "reason": "load", "model": "tiny"}
+    assert policy.choose((1080, 1920), in_flight=50, model_requested=True).model is None
+    assert policy.choose((200, 300), in_flight=3).model == "tiny"
+
+
+def test_predict_reports_resolution(monkeypatch, server, client):
+    model = FakeYOLO()
+    monkeypatch.setattr(main, "registry", fake_registry(model, default="yolov8s"))
+    monkeypatch.setattr(main, "resolution",
+                        ResolutionPolicy(enabled=True, queue_soft_limit=2, overload_model="yolov8n"))
+    monkeypatch.setattr(main, "dedup", DedupCache(enabled=True))
+    monkeypatch.setattr(main.monitor, "in_flight", main.monitor.in_flight)
+    small = server.route("/small.jpg", body=sample_image_bytes(300, 200))
+    large = server.route("/large.jpg", body=sample_image_bytes(1280, 720))
+
+    response = client.post("/predict", json={"url": small}).get_json()
+    assert response["resolution"] == {"imgsz": 320, "reason": "content"}
+    assert model.last_kwargs["imgsz"] == 320 and model.last_shapes == [(200, 300, 3)]
+
+    response = client.post("/predict", json={"url": large, "stream": "json"}).get_json()
+    assert response["resolution"] == {"imgsz": 640, "reason": "full"} and response["model"] == "yolov8s"
+
+    # Pretend other requests are queued on this worker
+    main.monitor.in_flight += 8
+    response = client.post("/predict", json={"url": large}).get_json()
+    assert response["resolution"] == {"imgsz": 320, "reason": "load", "model": "yolov8n"}
+    assert response["model"] == "yolov8n" and model.last_kwargs["imgsz"] == 320
+    assert client.get("/resolution").get_json()["chosen"] == {"320": 2, "640": 1}
+
+    # Once the load is gone the degraded answer isn't reused as a near-duplicate
+    main.monitor.in_flight -= 8
+    response = client.post("/predict", json={"url": large}).get_json()
+    assert response["resolution"] == {"imgsz": 640, "reason": "full"} and not response["dedup"]["hit"]
+
+    monkeypatch.setattr(main, "resolution", ResolutionPolicy(enabled=False))
+    response = client.post("/predict", json={"url": small, "dedup": False}).get_json()
+    assert response["resolution"] == {"imgsz": None, "reason": "fixed"} and "imgsz" not in model.last_kwargs
@@ -0,0 +1,97 @@
+"""
+Test the per-model response tables, the template writer and the "fields" option
+"""
+
+import json
+
+import main
+from fake_yolo import FakeYOLO, fake_registry
+from local_server import sample_image_bytes
+from response_tables import FIELDS, ResponseTable, encode_response, parse_fields
+
+NAMES = {0: "person", 2: 'say "cheese"', 5: "café"}
+
+
+def reference(value):
+    """jsonify's encoding outside debug mode"""
+    return json.dumps(value, separators=(",", ":"), sort_keys=True)
+
+
+def sample_detections():
+    return [
+        {"class_id": 2, "class_name": 'say "cheese"', "confidence": 0.931,
+         "bbox": {"x1": 10.0, "y1": 12.5, "x2": 40.25, "y2": 44.0}},
+        {"class_id": 5, "class_name": "café", "confidence": 0.5,
+         "bbox": {"x1": 1.5, "y1": 2.5, "x2": 8.25, "y2": 9.75},
+         "polygon": [1.5, 2.5, 8.2, 9.7], "keypoints": [1.0, 2.0, 0.9], "roi": 1},
+        {"class_id": 0, "class_name": "person", "confidence": 0.1,
+         "bbox": {"x1": 0.0, "y1": 0.0, "x2": 3.0, "y2": 4.0},
+         "mask": {"size": [4, 3], "counts": [2, 3, 7]}, "mask_origin": [5, 6]},
+    ]
+
+
+def test_table_and_writer_match_jsonify():
+    table = ResponseTable(NAMES)
+    assert table.names == ["person", None, 'say "cheese"', None, None, "café"]
+    assert table.writer() is table.writer() and table.writer(("bbox",)) is table.writer(("bbox",))
+    detections = sample_detections()
+    writer = table.writer()
+    for detection in detections:
+        assert writer.encode(detection) == reference(detection)
+    head = {"success": True, "model": "m", "resolution": {"imgsz": 640}}
+    assert encode_response(head, detections, writer) == reference({**head, "detections": detections, "count": 3})
+    assert encode_response(head, [], writer) == reference({**head, "detections": [], "count": 0})
+
+
+def test_fields_select_a_subset():
+    assert parse_fields(None) is None
+    assert parse_fields("confidence, bbox") == ("bbox", "confidence")
+    assert parse_fields(["class_id", "class_id"]) == ("class_id",)
+    for bad in ("", [], "bbox,colour", 3, [1]):
+        try:
+            parse_fields(bad)
+            assert False, bad
+        except ValueError:
+            pass
+
+    table = ResponseTable(NAMES)
+    detections = sample_detections()
+    for fields in [("bbox",), ("class_id",), ("class_name",), ("bbox", "confidence"),
+                   ("class_id", "polygon", "roi"), ("keypoints",), ("mask", "mask_origin"), FIELDS]:
+        writer = table.writer(fields)
+        for detection in detections:
+            expected = {name: value for name, value in detection.items() if name in fields}
+            assert writer.encode(detection) == reference(expected), fields
+            assert writer.select(detection) == expected
+
+
+def test_predict_fields_option(monkeypatch, registry, server, client):
+    url = server.route("/scene.jpg", body=sample_image_bytes(64, 48))
+    full = client.post("/predict", json={"url": url, "dedup": False})
+    body = full.get_json()
+    assert full.mimetype == "application/json" and body["count"] == 3
+    assert body["detections"][0] == {"class_id": 2, "class_name": "car", "confidence": 0.931,
+                                     "bbox": {"x1": 10.0, "y1": 12.0, "x2": 40.0, "y2": 44.0}}
+    assert full.get_data(as_text=True) == reference(body) + "\n"
+
+    trimmed = client.post("/predict", json={"url": url, "dedup": False, "fields": "class_id,confidence"})
+    assert trimmed.get_json()["detections"] == [
+        {"class_id": d["class_id"], "confidence": d["confidence"]} for d in body["detections"]]
+    assert len(trimmed.get_data()) < len(full.get_data())
+
+    streamed = client.post("/predict", json={"url": url, "dedup": False, "stream": "ndjson",
+                                             "fields": ["bbox"]})
+    lines = [json.loads(line) for line in streamed.get_data(as_text=True).splitlines()]
+    assert lines[:3] == [{"bbox": d["bbox"]} for d in body["detections"]] and lines[3]["done"]
+
+    bad = client.post("/predict", json={"url": url, "fields": "class_name,colour"})
+    assert bad.status_code == 400 and "colour" in bad.get_json()["error"]
+
+    # Masks and keypoints the response leaves out are never decoded
+    for task in ("segment", "pose"):
+        model = FakeYOLO(task=task)
+        monkeypatch.setattr(main, "registry", fake_registry(model))
+        trimmed = client.post("/predict", json={"url": url, "dedup": False, "fields": ["bbox", "class_id"]})
+        assert trimmed.get_json()["detections"][0] == {"class_id": 2, "bbox": body["detections"][0]["bbox"]}
+        result = model.last_results[0]
+        assert (result.masks or result.keypoints).reads == 0, task
@@ -0,0 +1,123 @@
+"""
+Test the persistent result store and the /search endpoint
+"""
+
+import os
+import time
+
+import main
+from local_server import sample_image_bytes
+from result_store import ResultStore, parse_time
+
+
+def detection(class_id, class_name, confidence):
+    return {"class_id": class_id, "class_name": class_name, "confidence": confidence,
+            "bbox": {"x1": 1.0, "y1": 2.0, "x2": 3.0, "y2": 4.0}}
+
+
+def filled_store(directory, runs=120):
+    store = ResultStore(os.path.join(directory, "results.db"), flush_interval=0.05)
+    for i in range(runs):
+        detections = [detection(0, "person", 0.3 + (i % 7) / 10)]
+        if i % 3 == 0:
+            detections.append(detection(2, "car", 0.9))
+        store.record(f"http://img/{i}.jpg", "yolov8n" if i % 2 else "yolov8s", (480, 640, 3), detections,
+                     ts=1000.0 + i)
+    store.flush()
+    return store
+
+
+def test_search_filters_and_pages(tmp_path):
+    store = filled_store(str(tmp_path))
+    assert store.stats()["written_runs"] == 120
+
+    cars = store.class_ids("car")
+    assert cars == [2]
+    seen, cursor = [], None
+    while True:
+        page, cursor = store.search(class_ids=cars, limit=15, cursor=cursor)
+        seen.extend(page)
+        if cursor is None:
+            break
+    assert len(seen) == 40
+    assert [r["url"] for r in seen] == [f"http://img/{i}.jpg" for i in range(117, -1, -3)]
+    assert all(m["class_name"] == "car" for r in seen for m in r["matches"])
+
+    confident, _ = store.search(class_ids=[0], min_confidence=0.85, limit=500)
+    assert {r["url"] for r in confident} == {f"http://img/{i}.jpg" for i in range(120) if i % 7 == 6}
+
+    window, _ = store.search(since=1010, until=1020, model="yolov8n", limit=500)
+    assert [r["timestamp"] for r in window] == [1019.0, 1017.0, 1015.0, 1013.0, 1011.0]
+    cars_by_model, _ = store.search(class_ids=cars, model="yolov8n", limit=500)
+    assert [r["url"] for r in cars_by_model] == [f"http://img/{i}.jpg" for i in range(117, -1, -6)]
+
+    assert store.search(since=5000)[0] == []
+
+
+def test_workers_and_abandoned_streams(tmp_path):
+    path = str(tmp_path / "results.db")
+    # Two stores on one file stand in for two workers recording at the same moment
+    workers = [ResultStore(path, flush_interval=0.01) for _ in range(2)]
+    for i in range(50):
+        for n, store in enumerate(workers):
+            store.record(f"http://img/{n}-{i}.jpg", "yolov8n", (480, 640), [detection(0, "person", 0.5)])
+    for store in workers:
+        store.flush()
+    results, _ = workers[0].search(limit=500)
+    assert len(results) == 100 and len({r["id"] for r in results}) == 100
+    assert all(r["count"] == 1 and len(r["matches"]) == 1 for r in results)
+
+    # A client that hangs up mid-stream still leaves a run for what it was sent
+    store = workers[0]
+    stream = store.tee(iter([detection(0, "person", 0.5)] * 5), "http://img/stream.jpg", "yolov8n",
+                       (480, 640), chunk_size=2)
+    assert [next(stream) for _ in range(3)]
+    stream.close()
+    store.flush()
+    latest, _ = store.search(limit=1)
+    assert latest[0]["url"] == "http://img/stream.jpg" and latest[0]["count"] == 3
+    assert len(latest[0]["matches"]) == 3
+
+
+def test_queries_use_indexes(tmp_path):
+    store = filled_store(str(tmp_path), runs=10)
+    conn = store._connect()
+    for model in (None, "yolov8n"):
+        sql = store.class_run_sql(["r.id <= ?"], 0.5, model)
+        params = [2, 99, 0.5] + ([model] if model else [])
+        plan = " ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+        assert "COVERING INDEX detections_class" in plan and "TEMP B-TREE" not in plan, plan
+
+    # Several classes are merged from one such query each, never sorted by SQLite
+    queries = []
+    conn.set_trace_callback(queries.append)
+    results, _ = store.search(class_ids=[0, 2], min_confidence=0.5, model="yolov8n", limit=3)
+    conn.set_trace_callback(None)
+    assert [r["url"] for r in results] == ["http://img/9.jpg", "http://img/5.jpg", "http://img/3.jpg"]
+    for sql in queries:
+        plan = " ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"))
+        assert "TEMP B-TREE" not in plan, (sql, plan)
+    plan = " ".join(row[3] for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT r.id FROM runs r WHERE EXISTS (SELECT 1 FROM detections d "
+        "WHERE d.run_id = r.id AND d.confidence >= 0.5) ORDER BY r.id DESC"))
+    assert "INDEX detections_run" in plan and "TEMP B-TREE" not in plan
+    assert parse_time("2024-01-01T00:00:00+00:00") == 1704067200.0 and parse_time("12.5") == 12.5
+
+
+def test_predict_results_are_searchable(monkeypatch, tmp_path, registry, server, client):
+    monkeypatch.setattr(main, "results_store", ResultStore(str(tmp_path / "results.db"), flush_interval=0.05))
+    url = server.route("/street.jpg", body=sample_image_bytes())
+    buffered = client.post("/predict", json={"url": url}).get_json()
+    client.post("/predict", json={"url": url, "stream": True}).get_data()
+    main.results_store.flush()
+
+    class_name = buffered["detections"][0]["class_name"]
+    found = client.get(f"/search?class_name={class_name}&limit=1").get_json()
+    assert found["count"] == 1 and found["next_cursor"] is not None
+    assert found["results"][0]["url"] == url and found["results"][0]["width"] == 64
+    rest = client.get(f"/search?class_name={class_name}&cursor={found['next_cursor']}").get_json()
+    assert rest["count"] == 1 and rest["next_cursor"] is None
+
+    assert client.get("/search?class_name=unicorn").get_json()["count"] == 0
+    assert client.get(f"/search?since={time.time() + 60}").get_json()["count"] == 0
+    assert client.get("/search?min_confidence=high").status_code == 400
@@ -0,0 +1,77 @@
+"""
+Test region-of-interest requests: validation, zero-copy crops and box mapping
+"""
+
+import numpy as np
+import pytest
+
+import roi
+from decoder import jpeg_dimensions
+from local_server import sample_image_bytes
+
+
+def test_parse_rois_validates_and_clamps():
+    assert roi.parse_rois([[10, 20, 50, 60], {"x1": 0, "y1": 0, "x2": 999, "y2": 30}], 100, 80) == \
+        [(10, 20, 50, 60), (0, 0, 100, 30)]
+    for bad in ([], "0,0,1,1", [[1, 2, 3]], [[50, 50, 10, 10]], [[200, 200, 300, 300]],
+                [[0, 0, 1, 1]] * (roi.MAX_ROIS + 1)):
+        try:
+            roi.parse_rois(bad, 100, 80)
+        except roi.InvalidROI:
+            pass
+        else:
+            raise AssertionError(f"{bad!r} should be rejected")
+
+
+def test_crops_are_views_and_boxes_map_back():
+    image = np.zeros((80, 100, 3), dtype=np.uint8)
+    crops = roi.crop_views(image, [(10, 20, 50, 60)])
+    assert crops[0].shape == (40, 40, 3)
+    assert np.shares_memory(crops[0], image)
+
+    detections = [{"class_id": 2, "class_name": "car", "confidence": 0.9,
+                   "bbox": {"x1": 1.0, "y1": 2.0, "x2": 3.0, "y2": 4.0}}]
+    mapped = roi.offset_detections(detections, (10, 20, 50, 60), 3)
+    assert mapped[0]["bbox"] == {"x1": 11.0, "y1": 22.0, "x2": 13.0, "y2": 24.0}
+    assert mapped[0]["roi"] == 3
+
+
+def test_jpeg_header_and_mcu_alignment():
+    assert jpeg_dimensions(sample_image_bytes(123, 45)) == (123, 45)
+    assert jpeg_dimensions(sample_image_bytes(20, 10, ext=".png")) is None
+    assert jpeg_dimensions(b"\xff\xd8garbage") is None
+    assert roi.align_to_mcu((17, 33, 90, 70), (16, 16)) == (16, 32, 90, 70)
+
+
+def test_partial_jpeg_decode_matches_full_decode():
+    if roi._turbojpeg() is None:
+        pytest.skip("libjpeg-turbo not available")
+    import cv2
+
+    data = sample_image_bytes(256, 192, quality=95)
+    full = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    rois = [(17, 33, 120, 150), (0, 0, 256, 192)]
+    crops = roi.decode_jpeg_rois(data, rois)
+    for (x1, y1, x2, y2), crop in zip(rois, crops):
+        assert crop.shape == (y2 - y1, x2 - x1, 3)
+        assert np.abs(crop.astype(int) - full[y1:y2, x1:x2]).max() <= 8
+
+
+def test_predict_batches_rois_into_one_call(model, registry, server, client):
+    registry.get()  # load and warm up before counting calls
+    url = server.route("/shelf.jpg", body=sample_image_bytes(200, 100))
+    for skip in (False, True):
+        calls = model.calls
+        response = client.post("/predict", json={
+            "url": url, "rois": [[10, 20, 60, 80], [100, 0, 200, 50]], "skip_outside_roi": skip})
+        assert response.status_code == 200
+        result = response.get_json()
+        assert model.calls == calls + 1
+        assert model.last_shapes == [(60, 50, 3), (50, 100, 3)]
+        assert result["count"] == 6
+        assert result["rois"] == [[10, 20, 60, 80], [100, 0, 200, 50]]
+        second = [d for d in result["detections"] if d["roi"] == 1]
+        assert second[0]["bbox"]["x1"] == 110.0
+
+    response = client.post("/predict", json={"url": url, "rois": [[500, 500, 600, 600]]})
+    assert response.status_code == 400
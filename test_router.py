@@ -0,0 +1,143 @@
+"""
+Test consistent-hash routing across several local service processes
+"""
+
+import json
+import socket
+import sys
+
+import pytest
+
+from local_server import sample_image_bytes
+from router import HashRing, Router, app, spawn_local_nodes
+import router as router_module
+
+# A service process answering with FakeYOLO, so nodes start quickly without weights
+NODE_COMMAND = [sys.executable, "-c", (
+    "import os, main\n"
+    "from fake_yolo import fake_registry\n"
+    "main.registry = fake_registry()\n"
+    "main.app.run(host='127.0.0.1', port=int(os.environ['PORT']), threaded=True)\n"
+)]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_ring_moves_few_keys():
+    nodes = [f"http://node{i}:5000" for i in range(4)]
+    ring = HashRing(nodes)
+    keys = [f"https://img.example.com/{i}.jpg" for i in range(10000)]
+    before = {key: ring.preference(key)[0] for key in keys}
+    assert all(0.15 < share < 0.35 for share in ring.shares().values())
+
+    ring.add("http://node4:5000")
+    after = {key: ring.preference(key)[0] for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert 0.1 < len(moved) / len(keys) < 0.3
+    assert all(after[key] == "http://node4:5000" for key in moved)
+
+    ring.remove("http://node1:5000")
+    final = {key: ring.preference(key)[0] for key in keys}
+    assert all(final[key] == after[key] for key in keys if after[key] != "http://node1:5000")
+    assert len(set(ring.preference(keys[0], 3))) == 3 and HashRing().preference("x") == []
+
+
+def test_owner_unless_overloaded():
+    router = Router(["http://a:1", "http://b:1", "http://c:1"], poll_interval=0, max_skew=4)
+    key = "https://img.example.com/cat.jpg"
+    owner, second = [router.nodes[url] for url in router.ring.preference(key, 2)]
+    node, reason = router.choose(key)
+    assert node is owner and reason == "owner"
+    router.release(node)
+
+    owner.reported_depth = 3
+    assert router.choose(key)[0] is owner
+    router.release(owner)
+    owner.reported_depth = 4
+    node, reason = router.choose(key)
+    assert node is second and reason == "least_loaded"
+    router.release(node)
+
+    owner.reported_depth, owner.ready = 0, False
+    assert router.choose(key)[0] is second
+    router.release(second)
+    # Requests without an image go to whichever node is least busy
+    second.reported_depth = 9
+    assert router.choose(None)[0] not in (owner, second)
+
+
+def test_node_changes_need_the_admin_token(monkeypatch):
+    monkeypatch.setattr(router_module, "router", Router(["http://node0:5000"], poll_interval=0))
+    client = app.test_client()
+    # Without a configured token nobody may change the ring
+    monkeypatch.setattr(router_module, "ROUTER_ADMIN_TOKEN", None)
+    for method in (client.post, client.delete):
+        assert method("/router/nodes", json={"url": "http://node0:5000"}).status_code == 403
+    monkeypatch.setattr(router_module, "ROUTER_ADMIN_TOKEN", "secret")
+    assert client.post("/router/nodes", json={"url": "http://evil:5000"},
+                       headers={"X-Admin-Token": "guess"}).status_code == 403
+    assert client.post("/router/nodes", json={"url": "http://node1:5000"},
+                       headers={"X-Admin-Token": "secret"}).status_code == 200
+    assert sorted(router_module.router.ring.nodes) == ["http://node0:5000", "http://node1:5000"]
+
+
+@pytest.fixture
+def nodes():
+    """Three local service processes as (processes, ports, urls), stopped after the test"""
+    ports = [free_port() for _ in range(3)]
+    processes, urls = [], []
+    for port in ports:
+        started, started_urls = spawn_local_nodes(1, port, NODE_COMMAND)
+        processes += started
+        urls += started_urls
+    yield processes, ports, urls
+    for process in processes:
+        process.terminate()
+        process.wait()
+
+
+def test_local_cluster_routing_and_failover(monkeypatch, nodes, server):
+    processes, ports, urls = nodes
+    monkeypatch.setattr(router_module, "router", Router(urls, poll_interval=0, fail_after=1))
+    monkeypatch.setattr(router_module, "ROUTER_ADMIN_TOKEN", "secret")
+    admin = {"X-Admin-Token": "secret"}
+    client = app.test_client()
+    images = [server.route(f"/{i}.jpg", body=sample_image_bytes(64, 48)) for i in range(12)]
+
+    first = client.post("/predict", json={"url": images[0]})
+    assert first.status_code == 200 and first.get_json()["count"] == 3
+    owner = first.headers["X-Routed-To"]
+    for _ in range(3):
+        again = client.post("/predict", json={"url": images[0]})
+        assert again.headers["X-Routed-To"] == owner
+    assert client.get(f"/predict/render?url={images[0]}").headers["X-Routed-To"] == owner
+    spread = {client.post("/predict", json={"url": url}).headers["X-Routed-To"] for url in images}
+    assert len(spread) >= 2
+
+    streamed = client.post("/predict", json={"url": images[0], "stream": True})
+    summary = json.loads(streamed.get_data(as_text=True).strip().splitlines()[-1])
+    assert summary["done"] and summary["count"] == 3
+    assert client.get("/healthz").get_json()["nodes_up"] == 3
+
+    # The owner dies: its keys fail over and it leaves the ring
+    index = urls.index(owner)
+    processes[index].terminate()
+    processes[index].wait()
+    moved = client.post("/predict", json={"url": images[0]})
+    assert moved.status_code == 200 and moved.headers["X-Routed-To"] != owner
+    assert owner not in router_module.router.ring.nodes
+
+    # It comes back on the same port and gets its keys back after the next poll
+    processes[index] = spawn_local_nodes(1, ports[index], NODE_COMMAND)[0][0]
+    router_module.router.poll()
+    assert client.post("/predict", json={"url": images[0]}).headers["X-Routed-To"] == owner
+    stats = client.get("/router").get_json()
+    assert len(stats["ring"]) == 3 and stats["routed"]["owner"] >= 5
+
+    assert client.delete("/router/nodes", json={"url": owner}, headers=admin).status_code == 200
+    assert client.post("/predict", json={"url": images[0]}).headers["X-Routed-To"] != owner
+    assert client.post("/router/nodes", json={"url": "ftp://x"}, headers=admin).status_code == 400
@@ -0,0 +1,134 @@
+"""
+Test the memory-mapped result cache shared by worker processes
+"""
+
+import hashlib
+import multiprocessing
+import os
+
+import main
+from local_server import sample_image_bytes
+from shared_cache import BUCKET_SLOTS, SEQ, SharedCache
+
+
+def one_bucket(path, **kwargs):
+    return SharedCache(path, size_bytes=BUCKET_SLOTS * 256, slot_bytes=256, **kwargs)
+
+
+def test_get_put_and_limits(tmp_path):
+    directory = str(tmp_path)
+    cache = SharedCache(os.path.join(directory, "cache"), size_bytes=1_000_000, slot_bytes=1024)
+    assert cache.get("a") is None
+    assert cache.put("a", b"first") and cache.get("a") == b"first"
+    assert cache.put("a", b"second") and cache.get("a") == b"second"
+    assert not cache.put("big", b"x" * 1024) and cache.get("big") is None
+    assert cache.entries() == 1
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2 and stats["too_large"] == 1
+
+    # Another handle on the same file sees the same entries; another geometry starts over
+    assert SharedCache(cache.path, size_bytes=1_000_000, slot_bytes=1024).get("a") == b"second"
+    resized = SharedCache(cache.path, size_bytes=500_000, slot_bytes=2048)
+    assert resized.get("a") is None and os.path.getsize(cache.path) == resized.size
+    # ...in a new file, so handles still mapping the old one keep working
+    assert cache.get("a") == b"second" and os.listdir(directory) == ["cache"]
+    resized.put("b", b"new")
+    assert SharedCache(cache.path, size_bytes=500_000, slot_bytes=2048).get("b") == b"new"
+
+    expiring = SharedCache(os.path.join(directory, "ttl"), size_bytes=100_000, ttl=1e-9)
+    expiring.put("a", b"gone")
+    assert expiring.get("a") is None
+    cache.clear()
+    assert cache.entries() == 0 and cache.get("a") is None
+
+
+def test_clock_keeps_recently_read_entries(tmp_path):
+    cache = one_bucket(str(tmp_path / "cache"))
+    for i in range(BUCKET_SLOTS):
+        cache.put(f"k{i}", b"v")
+    # The first eviction finds every reference bit set, clears them and takes slot 0
+    cache.put("new0", b"v")
+    assert cache.get("k0") is None and cache.evictions == 1
+    # k1 is read again, so the hand passes over it and evicts k2 instead
+    assert cache.get("k1") == b"v"
+    cache.put("new1", b"v")
+    assert cache.get("k1") == b"v" and cache.get("k2") is None
+    assert cache.get("new0") == b"v" and cache.get("new1") == b"v"
+
+
+def test_slot_left_mid_write_recovers(tmp_path):
+    cache = one_bucket(str(tmp_path / "cache"))
+    cache.put("a", b"first")
+    # A worker SIGKILLed between the two sequence updates leaves the slot odd and half written
+    offset = cache._slots_offset
+    SEQ.pack_into(cache._mm, offset, SEQ.unpack_from(cache._mm, offset)[0] + 1)
+    cache._mm[offset + 40:offset + 45] = b"xxxxx"
+    assert cache.get("a") is None
+    assert cache.put("a", b"second") and cache.get("a") == b"second"
+    assert SEQ.unpack_from(cache._mm, offset)[0] % 2 == 0
+
+
+def value_for(key, version):
+    payload = f"{key}:{version}:".encode() * 20
+    return hashlib.sha1(payload).digest() + payload
+
+
+def hammer(path, worker, rounds, errors):
+    """Rewrite and read a small key set that every process shares; report any torn read"""
+    cache = one_bucket(path)
+    for version in range(rounds):
+        for key in ("a", "b", "c", "d"):
+            cache.put(key, value_for(key, f"{worker}.{version}"))
+            value = cache.get(key)
+            if value is not None and hashlib.sha1(value[20:]).digest() != value[:20]:
+                errors.put(key)
+    cache.put(f"from-{worker}", b"hello")
+
+
+def test_processes_share_one_pool(tmp_path):
+    # Fresh interpreters, like separately started workers (and no fork of a threaded test process)
+    context = multiprocessing.get_context("spawn")
+    path = str(tmp_path / "cache")
+    one_bucket(path)
+    errors = context.Queue()
+    workers = [context.Process(target=hammer, args=(path, i, 300, errors)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+    assert errors.empty()
+    cache = one_bucket(path)
+    assert sum(cache.get(f"from-{i}") == b"hello" for i in range(4)) >= 3
+    for key in ("a", "b", "c", "d"):
+        value = cache.get(key)
+        assert value is None or hashlib.sha1(value[20:]).digest() == value[:20]
+
+
+def test_predict_answers_repeats_from_the_shared_cache(monkeypatch, tmp_path, model, registry, server, client):
+    path = str(tmp_path / "cache")
+    registry.get()
+    monkeypatch.setattr(main, "shared_cache", SharedCache(path, size_bytes=1_000_000))
+    url = server.route("/scene.jpg", body=sample_image_bytes(64, 48))
+    calls = model.calls
+    first = client.post("/predict", json={"url": url, "dedup": False}).get_json()
+    assert "cache" not in first and model.calls == calls + 1
+
+    # A worker opening the same file gets the answer without inference
+    monkeypatch.setattr(main, "shared_cache", SharedCache(path, size_bytes=1_000_000))
+    second = client.post("/predict", json={"url": url, "dedup": False}).get_json()
+    assert second["cache"] == "hit" and model.calls == calls + 1
+    assert second["detections"] == first["detections"]
+    assert second["resolution"] == first["resolution"] and second["model"] == first["model"]
+
+    # Different output options are cached separately, and "cache": false skips it
+    client.post("/predict", json={"url": url, "dedup": False, "masks": "rle"})
+    client.post("/predict", json={"url": url, "dedup": False, "cache": False})
+    assert model.calls == calls + 3
+    assert client.get("/cache").get_json()["entries"] == 2
+
+    # Swapped weights don't get the old model's answers
+    main.registry.swap(main.registry.default)
+    calls = model.calls
+    swapped = client.post("/predict", json={"url": url, "dedup": False}).get_json()
+    assert "cache" not in swapped and model.calls == calls + 1
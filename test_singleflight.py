@@ -0,0 +1,159 @@
+"""
+Test single-flight coalescing of identical in-flight /predict requests
+"""
+
+import threading
+import time
+
+import main
+from fake_yolo import FakeYOLO, fake_registry
+from local_server import sample_image_bytes
+from response_tables import parse_fields
+from singleflight import CoalesceTimeout, SingleFlight, request_key
+from task_outputs import TaskOptions
+from upstream import UpstreamGuard
+
+
+def fire(client_count, body):
+    """POST body to /predict from client_count threads at once; (status, json) per thread"""
+    responses = [None] * client_count
+    start = threading.Barrier(client_count)
+
+    def post(i):
+        client = main.app.test_client()
+        start.wait()
+        response = client.post("/predict", json=body)
+        responses[i] = (response.status_code, response.get_json())
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(client_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def test_followers_share_result_error_and_time_out():
+    flights = SingleFlight(timeout=0.05)
+    release = threading.Event()
+    outcomes = []
+
+    def slow():
+        release.wait()
+        return "answer"
+
+    leader = threading.Thread(target=lambda: outcomes.append(flights.do("k", slow)))
+    leader.start()
+    while not flights.stats()["in_flight"]:
+        time.sleep(0.001)
+    try:
+        flights.do("k", slow)
+        assert False, "follower should have timed out"
+    except CoalesceTimeout:
+        pass
+    release.set()
+    leader.join()
+    assert outcomes == [("answer", False)] and flights.stats()["in_flight"] == 0
+
+    # An error reaches the leader and every follower; the next call starts over
+    flights = SingleFlight(timeout=5)
+    gate = threading.Event()
+    errors = []
+
+    def failing():
+        gate.wait()
+        raise RuntimeError("boom")
+
+    def call():
+        try:
+            flights.do("k", failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while flights.stats()["followers"] < 3:
+        time.sleep(0.001)
+    gate.set()
+    for thread in threads:
+        thread.join()
+    assert errors == ["boom"] * 4
+    assert flights.do("k", lambda: 1) == (1, False)
+    stats = flights.stats()
+    assert stats["leaders"] == 2 and stats["followers"] == 3 and stats["shared_errors"] == 1
+
+
+def key(data, model_name="m"):
+    return request_key(data, model_name, TaskOptions.from_request(data, parse_fields(data.get("fields"))))
+
+
+def test_request_key():
+    base = {"url": "http://x/a.jpg", "masks": "rle"}
+    assert key(base) == key({**base, "stream": None, "callback_url": "http://cb"})
+    assert key(base) != key(base, "other")
+    assert key(base) != key({**base, "masks": "polygon"})
+    assert key(base) != key({**base, "url": "http://x/b.jpg"})
+    # A client-supplied hash can't make another URL's answer its own
+    assert key({"url": "u1", "content_hash": "h"}) != key({"url": "u2", "content_hash": "h"})
+    assert key({**base, "content_hash": "h"}) != key(base)
+    # Field lists share a flight only when they need the same outputs computed
+    assert key({**base, "fields": "bbox"}) == key({**base, "masks": False, "keypoints": False})
+    assert key({**base, "fields": "bbox,mask"}) != key({**base, "fields": "bbox"})
+
+
+def test_followers_get_their_own_detections(monkeypatch):
+    monkeypatch.setattr(main, "coalescer", SingleFlight(timeout=10))
+    release = threading.Event()
+    answers = []
+
+    def slow_detect(data, model_name, api_key, stream_format=None, options=None):
+        release.wait()
+        return {"success": True}, [{"class_id": 0}], (48, 64, 3)
+
+    def call():
+        answers.append(main.detect_shared({"url": "http://x/a.jpg"}, "m", "anonymous"))
+
+    monkeypatch.setattr(main, "detect", slow_detect)
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while main.coalescer.stats()["followers"] < 2:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    lists = [detections for _, detections, _ in answers]
+    assert all(d == [{"class_id": 0}] for d in lists) and len({id(d) for d in lists}) == 3
+    assert sum(bool(result.get("coalesced")) for result, _, _ in answers) == 2
+
+
+def test_concurrent_duplicates_run_one_inference(monkeypatch, server, client):
+    model = FakeYOLO(delay=0.3)
+    monkeypatch.setattr(main, "registry", fake_registry(model))
+    main.registry.get()
+    monkeypatch.setattr(main, "coalescer", SingleFlight(timeout=10))
+    monkeypatch.setattr(main, "upstream", UpstreamGuard())
+    url = server.route("/scene.jpg", body=sample_image_bytes(64, 48), delay=0.1)
+    calls = model.calls
+    responses = fire(8, {"url": url, "cache": False})
+    assert all(status == 200 for status, _ in responses)
+    assert model.calls == calls + 1 and server.hits["/scene.jpg"] == 1
+    detections = [body["detections"] for _, body in responses]
+    assert all(d == detections[0] for d in detections) and len(detections[0]) == 3
+    assert sum(bool(body.get("coalesced")) for _, body in responses) == 7
+
+    # Once the flight lands the next request computes afresh
+    assert "coalesced" not in client.post("/predict", json={"url": url, "cache": False}).get_json()
+    assert model.calls == calls + 2
+
+    # A failed download fails every waiter the same way, after one attempt
+    missing = server.url("/missing.jpg")
+    server.route("/missing.jpg", status=404, body=b"gone", delay=0.2)
+    responses = fire(6, {"url": missing})
+    assert server.hits["/missing.jpg"] == 1
+    assert len({status for status, _ in responses}) == 1 and responses[0][0] >= 400
+    assert len({body["error"] for _, body in responses}) == 1
+
+    stats = client.get("/coalesce").get_json()
+    assert stats["followers"] == 12 and stats["shared_errors"] == 1 and stats["in_flight"] == 0
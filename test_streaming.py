@@ -0,0 +1,83 @@
+"""
+Test streamed /predict responses: same results as buffered mode with bounded memory
+"""
+
+import json
+import random
+import tracemalloc
+
+import pytest
+
+import main
+from fake_yolo import FakeYOLO, fake_registry
+from local_server import sample_image_bytes
+from streaming import json_chunks, ndjson_chunks
+
+
+def crowded_model(count):
+    rng = random.Random(3)
+    detections = [(rng.choice([0, 2, 47]), rng.random(), 10.0 + i % 500, 5.0, 20.0 + i % 500, 30.5)
+                  for i in range(count)]
+    return FakeYOLO(detections=detections)
+
+
+@pytest.fixture
+def crowd(monkeypatch, server):
+    """crowd(count) installs a model that sees count boxes and returns an image URL for it"""
+    def serve(count):
+        monkeypatch.setattr(main, "registry", fake_registry(crowded_model(count)))
+        main.registry.get()
+        return server.route("/crowd.jpg", body=sample_image_bytes())
+    return serve
+
+
+def test_streamed_results_match_buffered(crowd, client):
+    url = crowd(1000)
+    buffered = client.post("/predict", json={"url": url}).get_json()
+
+    response = client.post("/predict", json={"url": url, "stream": True})
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[:-1] == buffered["detections"]
+    assert lines[-1]["done"] and lines[-1]["count"] == buffered["count"] == 1000
+
+    response = client.post("/predict", json={"url": url, "stream": "json"})
+    assert response.get_json() == buffered
+
+    assert client.post("/predict", json={"url": url, "stream": "xml"}).status_code == 400
+
+
+def test_errors_mid_stream_are_reported():
+    def detections():
+        yield {"class_id": 0}
+        yield {"class_id": 1}
+        raise RuntimeError("boom")
+
+    lines = [json.loads(line) for chunk in ndjson_chunks(detections(), {"model": "m"}, batch=1)
+             for line in chunk.splitlines()]
+    assert lines[-1] == {"model": "m", "count": 2, "done": False, "error": "boom"}
+
+    document = json.loads("".join(json_chunks(detections(), {"success": True}, batch=1)))
+    assert document["count"] == 2 and document["error"] == "boom"
+    assert len(document["detections"]) == 2
+
+
+def peak_memory(client, url, payload):
+    tracemalloc.start()
+    try:
+        response = client.post("/predict", json={"url": url, **payload}, buffered=False)
+        received = sum(len(chunk) for chunk in response.response)
+        response.close()
+        return tracemalloc.get_traced_memory()[1], received
+    finally:
+        tracemalloc.stop()
+
+
+def test_streaming_keeps_peak_memory_bounded(crowd, client):
+    url = crowd(50_000)
+    streamed_peak, streamed_bytes = peak_memory(client, url, {"stream": "json"})
+    buffered_peak, _ = peak_memory(client, url, {})
+    assert streamed_bytes > 5_000_000
+    # Only the raw box arrays and one chunk of dicts/strings are alive at a time
+    assert streamed_peak < 8_000_000, streamed_peak
+    assert streamed_peak * 4 < buffered_peak, (streamed_peak, buffered_peak)
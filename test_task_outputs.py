@@ -0,0 +1,103 @@
+"""
+Test mask and keypoint outputs for segmentation and pose models
+"""
+
+import numpy as np
+
+import main
+from fake_yolo import FakeYOLO, fake_registry
+from local_server import sample_image_bytes
+from task_outputs import TaskOptions, encode_rle, offset_extras, resample_masks
+
+
+def decode_rle(rle):
+    height, width = rle["size"]
+    flat = np.zeros(height * width, dtype=bool)
+    position, value = 0, False
+    for count in rle["counts"]:
+        flat[position:position + count] = value
+        position, value = position + count, not value
+    return flat.reshape(width, height).T
+
+
+def test_rle_round_trip():
+    rng = np.random.default_rng(0)
+    masks = rng.random((4, 13, 7)) > 0.6
+    masks[1] = True
+    masks[2] = False
+    encoded = encode_rle(masks)
+    assert len(encoded) == 4 and encoded[0]["size"] == [13, 7]
+    for mask, rle in zip(masks, encoded):
+        assert (decode_rle(rle) == mask).all()
+        assert sum(rle["counts"]) == 13 * 7
+    # A full mask starts with an empty run of zeros, an empty one is a single run
+    assert encoded[1]["counts"] == [0, 91] and encoded[2]["counts"] == [91]
+    assert encode_rle(np.zeros((0, 5, 5), dtype=bool)) == []
+
+
+def test_resample_undoes_letterbox():
+    # A 200x100 image letterboxed into 64x64: gain 0.32, 16 rows of padding top and bottom
+    model_masks = np.zeros((1, 64, 64), dtype=np.float32)
+    model_masks[0, 16:32, 0:32] = 1.0
+    full = resample_masks(model_masks, (100, 200))
+    assert full.shape == (1, 100, 200) and full.dtype == bool
+    ys, xs = np.nonzero(full[0])
+    assert ys.min() == 0 and abs(ys.max() - 49) <= 1
+    assert xs.min() == 0 and abs(xs.max() - 99) <= 1
+    coarse = resample_masks(model_masks, (100, 200), stride=4)
+    assert coarse.shape == (1, 25, 50) and coarse[0, :12, :25].all() and not coarse[0, 13:, 26:].any()
+
+
+def test_options_and_offsets():
+    assert TaskOptions.from_request({}).masks == "polygon"
+    options = TaskOptions.from_request({"masks": "rle", "mask_stride": "4", "keypoints": False})
+    assert (options.masks, options.mask_stride, options.keypoints) == ("rle", 4, False)
+    assert TaskOptions.from_request({"masks": False}).masks is None
+    # Outputs left out of "fields" aren't computed
+    trimmed = TaskOptions.from_request({}, fields=("bbox", "class_id"))
+    assert trimmed.masks is None and trimmed.keypoints is False
+    assert TaskOptions.from_request({"masks": "rle"}, fields=("mask",)).masks == "rle"
+    assert TaskOptions.from_request({"masks": "rle"}, fields=("polygon",)).masks is None
+    assert TaskOptions.from_request({"keypoints": False}, fields=("keypoints",)).keypoints is False
+    for bad in ({"masks": "png"}, {"mask_stride": 0}, {"mask_stride": "x"}, {"mask_stride": 64}):
+        try:
+            TaskOptions.from_request(bad)
+            assert False, bad
+        except ValueError:
+            pass
+    shifted = offset_extras({"polygon": [1.0, 2.0, 3.0, 4.0], "keypoints": [1.0, 2.0, 0.9]}, 10, 20)
+    assert shifted == {"polygon": [11.0, 22.0, 13.0, 24.0], "keypoints": [11.0, 22.0, 0.9]}
+
+
+def post(client, url, **fields):
+    return client.post("/predict", json={"url": url, "dedup": False, **fields})
+
+
+def test_predict_returns_masks_and_keypoints(monkeypatch, server, client):
+    url = server.route("/scene.jpg", body=sample_image_bytes(64, 48))
+
+    seg = FakeYOLO(task="segment")
+    monkeypatch.setattr(main, "registry", fake_registry(seg))
+    detections = post(client, url).get_json()["detections"]
+    assert detections[0]["polygon"] == [10.0, 12.0, 40.0, 12.0, 40.0, 44.0, 10.0, 44.0]
+    assert "keypoints" not in detections[0]
+
+    detections = post(client, url, masks="rle").get_json()["detections"]
+    car = decode_rle(detections[0]["mask"])
+    assert car.shape == (48, 64) and car[20:40, 15:35].all() and not car[0:5].any()
+
+    detections = post(client, url, masks="rle", mask_stride=2).get_json()["detections"]
+    assert detections[0]["mask"]["size"] == [24, 32]
+
+    # Box-only requests never read the masks
+    post(client, url, masks=False)
+    masks = seg.last_results[0].masks
+    assert masks.reads == 0
+    assert post(client, url, masks="bitmap").status_code == 400
+
+    pose = FakeYOLO(task="pose")
+    monkeypatch.setattr(main, "registry", fake_registry(pose))
+    detections = post(client, url).get_json()["detections"]
+    assert detections[0]["keypoints"] == [10.0, 12.0, 0.9, 25.0, 28.0, 0.9, 40.0, 44.0, 0.9]
+    assert "polygon" not in detections[0]
+    assert "keypoints" not in post(client, url, keypoints=False).get_json()["detections"][0]
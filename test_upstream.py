@@ -0,0 +1,125 @@
+"""
+Test the per-host circuit breaker and negative cache against a local flaky image host
+"""
+
+import pytest
+
+import main
+from local_server import sample_image_bytes
+from upstream import UpstreamGuard, UpstreamUnavailable
+
+
+class FakeClock:
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def guard(monkeypatch, registry):
+    """guard(**kwargs) installs a fresh UpstreamGuard as main.upstream"""
+    monkeypatch.setattr(main, "DOWNLOAD_TIMEOUT", 0.2)
+    return lambda **kwargs: monkeypatch.setattr(main, "upstream", UpstreamGuard(**kwargs))
+
+
+def fails_fast(url):
+    try:
+        main.read_image_from_url(url)
+    except UpstreamUnavailable:
+        return True
+    except Exception:
+        return False
+    return False
+
+
+def test_breaker_opens_on_timeouts_and_probes_after_cooldown(guard, server):
+    clock = FakeClock()
+    guard(failure_threshold=3, cooldown=30, clock=clock)
+    url = server.route("/slow.jpg", body=sample_image_bytes(), delay=0.5)
+    for _ in range(3):
+        assert not fails_fast(url)
+    assert server.hits["/slow.jpg"] == 3
+
+    # Open: the host is not contacted at all
+    for _ in range(10):
+        assert fails_fast(url)
+    assert server.hits["/slow.jpg"] == 3
+    stats = main.upstream.stats()
+    assert stats["fast_failures"] == 10
+    assert stats["worker_seconds_saved"] >= 10 * 0.2
+
+    # After the cooldown one probe goes out; the host has recovered
+    server.route("/slow.jpg", body=sample_image_bytes())
+    clock.now += 30
+    image = main.read_image_from_url(url)
+    assert image.shape == (48, 64, 3)
+    assert server.hits["/slow.jpg"] == 4
+    assert main.upstream.breakers[f"127.0.0.1:{server.port}"].state == "closed"
+
+
+def test_half_open_probe_failure_reopens(guard, server):
+    clock = FakeClock()
+    guard(failure_threshold=2, cooldown=10, clock=clock)
+    url = server.route("/down.jpg", status=503, body=b"maintenance")
+    for _ in range(2):
+        assert not fails_fast(url)
+    assert fails_fast(url)
+
+    clock.now += 10
+    assert not fails_fast(url)  # the probe reaches the host and fails
+    assert fails_fast(url)
+    assert server.hits["/down.jpg"] == 3
+
+
+def test_half_open_probe_answered_with_4xx_closes(guard, server):
+    clock = FakeClock()
+    guard(failure_threshold=2, cooldown=10, clock=clock)
+    url = server.route("/flaky.jpg", status=503, body=b"maintenance")
+    for _ in range(2):
+        assert not fails_fast(url)
+    assert fails_fast(url)
+
+    # The probe gets a 403: the host is up, so the next request goes out too
+    server.route("/flaky.jpg", status=403, body=b"forbidden")
+    clock.now += 10
+    assert not fails_fast(url)
+    host = f"127.0.0.1:{server.port}"
+    assert main.upstream.breakers[host].state == "closed" and not main.upstream.breakers[host].probing
+    server.route("/flaky.jpg", body=sample_image_bytes())
+    assert main.read_image_from_url(url).shape == (48, 64, 3)
+    assert server.hits["/flaky.jpg"] == 4
+
+
+def test_negative_cache_for_missing_and_undecodable_images(guard, server):
+    clock = FakeClock()
+    guard(negative_ttl=60, clock=clock)
+    missing = server.url("/missing.jpg")
+    garbage = server.route("/garbage.jpg", body=b"definitely not a jpeg")
+    good = server.route("/good.jpg", body=sample_image_bytes())
+
+    for url in (missing, garbage):
+        assert not fails_fast(url)
+        assert fails_fast(url)
+        assert fails_fast(url)
+    assert server.hits["/missing.jpg"] == 1
+    assert server.hits["/garbage.jpg"] == 1
+
+    # Bad URLs don't count against the host
+    assert main.read_image_from_url(good) is not None
+    assert main.upstream.stats()["negative_cache_hits"] == 4
+
+    clock.now += 61
+    assert not fails_fast(missing)
+    assert server.hits["/missing.jpg"] == 2
+
+
+def test_predict_returns_503_with_retry_after(guard, server, client):
+    guard(failure_threshold=1, cooldown=30)
+    url = server.route("/broken.jpg", status=500)
+    assert client.post("/predict", json={"url": url}).status_code == 500
+    response = client.post("/predict", json={"url": url})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert client.get("/upstream").get_json()["fast_failures"] == 1
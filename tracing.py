@@ -0,0 +1,399 @@
+import os
+import re
+import json
+import time
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from collections import deque
+from urllib.parse import urlsplit, urlunsplit
+
+from forklocal import ForkLocal
+
+logger = logging.getLogger(__name__)
+
+# "memory", "file" or "otlp"; tracing is off when unset
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "")
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.environ.get("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0.01))
+TRACE_BATCH_SIZE = int(os.environ.get("TRACE_BATCH_SIZE", 256))
+TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", 4096))
+TRACE_FLUSH_INTERVAL = float(os.environ.get("TRACE_FLUSH_INTERVAL", 5))
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "yolo-api")
+
+# OTLP span kinds and status codes
+KIND_INTERNAL, KIND_SERVER = 1, 2
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+TRACEPARENT = re.compile(r"([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?")
+LOW_64_BITS = (1 << 64) - 1
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+def parse_traceparent(header):
+    """(trace_id, parent span_id, sampled) from a W3C traceparent header; None if missing or malformed"""
+    if not header:
+        return None
+    match = TRACEPARENT.fullmatch(header.strip())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags, rest = match.groups()
+    if version == "ff" or (version == "00" and rest):
+        return None
+    trace_id, span_id = int(trace_id, 16), int(span_id, 16)
+    if not trace_id or not span_id:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+def format_traceparent(span):
+    return f"00-{span.trace_id:032x}-{span.span_id:016x}-01"
+
+
+def redact_url(url):
+    """url for a span attribute: presigned URLs carry credentials in the query and userinfo, so their values go"""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return "REDACTED"
+    netloc = parts.netloc.rpartition("@")[2]
+    if "@" in parts.netloc:
+        netloc = f"REDACTED:REDACTED@{netloc}"
+    query = "&".join(f"{param.partition('=')[0]}=REDACTED" for param in parts.query.split("&") if param)
+    return urlunsplit((parts.scheme, netloc, parts.path, query, ""))
+
+
+class Span:
+    """One timed operation of a sampled trace"""
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "kind", "attributes",
+                 "start_ns", "end_ns", "status", "status_message")
+    recording = True
+
+    def __init__(self, tracer, name, trace_id, parent_id=None, kind=KIND_INTERNAL, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64) or 1
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes) if attributes else {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_status(self, code, message=""):
+        self.status = code
+        self.status_message = message
+
+    def record_error(self, error):
+        self.set_status(STATUS_ERROR, f"{type(error).__name__}: {error}")
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.tracer.processor.on_end(self)
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6 if self.end_ns is not None else None
+
+    def to_otlp(self):
+        span = {
+            "traceId": f"{self.trace_id:032x}",
+            "spanId": f"{self.span_id:016x}",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": otlp_attributes(self.attributes),
+            "status": {"code": self.status, "message": self.status_message} if self.status_message
+                      else {"code": self.status},
+        }
+        if self.parent_id is not None:
+            span["parentSpanId"] = f"{self.parent_id:016x}"
+        return span
+
+
+class NonRecordingSpan:
+    """Stands in for spans of unsampled requests (and for all of them when tracing is off)"""
+
+    recording = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_status(self, code, message=""):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = NonRecordingSpan()
+
+
+class SpanScope:
+    """Makes a span current for a with block, ending it (with any exception recorded) on exit"""
+
+    __slots__ = ("span", "end_on_exit", "_token")
+
+    def __init__(self, span, end_on_exit=True):
+        self.span = span
+        self.end_on_exit = end_on_exit
+
+    def __enter__(self):
+        self._token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        if self.end_on_exit:
+            if exc is not None:
+                self.span.record_error(exc)
+            self.span.end()
+        return False
+
+
+class NoopScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        return NOOP_SPAN
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SCOPE = NoopScope()
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_attributes(attributes):
+    return [{"key": key, "value": otlp_value(value)} for key, value in attributes.items()]
+
+
+def otlp_payload(spans, service_name=TRACE_SERVICE_NAME):
+    """An OTLP/JSON ExportTraceServiceRequest for a batch of ended spans"""
+    return {"resourceSpans": [{
+        "resource": {"attributes": otlp_attributes({"service.name": service_name, "process.pid": os.getpid()})},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": [span.to_otlp() for span in spans]}],
+    }]}
+
+
+class InMemoryExporter:
+    """Keeps exported spans in a list, for tests and poking around locally"""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+    def clear(self):
+        self.spans = []
+
+
+class FileExporter:
+    """Appends one OTLP/JSON request per batch to a file, like the collector's file exporter"""
+
+    def __init__(self, path=TRACE_FILE, service_name=TRACE_SERVICE_NAME):
+        self.path = path
+        self.service_name = service_name
+
+    def export(self, spans):
+        line = json.dumps(otlp_payload(spans, self.service_name), separators=(",", ":"))
+        with open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class OtlpHttpExporter:
+    """POSTs batches as OTLP/JSON to a collector's /v1/traces endpoint"""
+
+    def __init__(self, endpoint=TRACE_OTLP_ENDPOINT, service_name=TRACE_SERVICE_NAME, timeout=10):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def export(self, spans):
+        import requests
+
+        response = requests.post(self.endpoint, data=json.dumps(otlp_payload(spans, self.service_name)),
+                                 headers={"Content-Type": "application/json"}, timeout=self.timeout)
+        response.raise_for_status()
+
+
+EXPORTERS = {"memory": InMemoryExporter, "file": FileExporter, "otlp": OtlpHttpExporter}
+
+
+class BatchProcessor:
+    """Queues ended spans and hands them to the exporter in batches from a background thread
+
+    Request threads only append to a bounded queue; when the exporter falls
+    behind, new spans are dropped (and counted) rather than slowing requests.
+    """
+
+    def __init__(self, exporter, batch_size=TRACE_BATCH_SIZE, queue_size=TRACE_QUEUE_SIZE,
+                 flush_interval=TRACE_FLUSH_INTERVAL):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.exported = 0
+        self.dropped = 0
+        self.batches = 0
+        self.export_errors = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._export_lock = threading.Lock()
+        self._thread = ForkLocal(self._start_thread)
+
+    def _start_thread(self):
+        self._queue = deque()
+        thread = threading.Thread(target=self._loop, name="trace-export", daemon=True)
+        thread.start()
+        atexit.register(self.flush)
+        return thread
+
+    def on_end(self, span):
+        self._thread.get()
+        with self._cond:
+            if len(self._queue) >= self.queue_size:
+                self.dropped += 1
+                return
+            self._queue.append(span)
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Export everything queued so far"""
+        with self._export_lock:
+            while True:
+                with self._cond:
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                if not batch:
+                    return
+                try:
+                    self.exporter.export(batch)
+                    self.exported += len(batch)
+                    self.batches += 1
+                except Exception as e:
+                    self.export_errors += 1
+                    logger.warning(f"⚠️ Failed to export {len(batch)} spans: {str(e)}")
+
+    def queued(self):
+        return len(self._queue)
+
+
+class Tracer:
+    """Request-scoped spans, sampled per trace and exported in the background
+
+    A request's trace is sampled if its incoming traceparent says so, or, with
+    no traceparent, for sample_rate of trace ids. Everything inside an
+    unsampled (or untraced) request gets NOOP_SPAN, so the hot path pays a
+    context-variable lookup per span and nothing more.
+    """
+
+    def __init__(self, exporter=None, sample_rate=TRACE_SAMPLE_RATE, **batching):
+        self.exporter = exporter
+        self.enabled = exporter is not None
+        self.sample_rate = sample_rate
+        self._bound = int(min(max(sample_rate, 0.0), 1.0) * (1 << 64))
+        self.processor = BatchProcessor(exporter, **batching) if self.enabled else None
+        self.requests = 0
+        self.sampled = 0
+
+    @classmethod
+    def from_env(cls):
+        if not TRACE_EXPORTER:
+            return cls()
+        if TRACE_EXPORTER not in EXPORTERS:
+            logger.warning(f"⚠️ Unknown TRACE_EXPORTER {TRACE_EXPORTER!r}; tracing is off")
+            return cls()
+        logger.info(f"✅ Tracing {TRACE_SAMPLE_RATE:.1%} of requests to the {TRACE_EXPORTER} exporter")
+        return cls(EXPORTERS[TRACE_EXPORTER]())
+
+    def start_request(self, name, traceparent=None):
+        """Server span for an incoming request, continuing the caller's trace if it sent one
+
+        Returns NOOP_SPAN when the trace isn't sampled. The span isn't made
+        current; pass it to activate().
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        self.requests += 1
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = random.getrandbits(128) or 1, None
+            # Decided from the trace id, like OpenTelemetry's TraceIdRatioBased sampler
+            sampled = (trace_id & LOW_64_BITS) < self._bound
+        if not sampled:
+            return NOOP_SPAN
+        self.sampled += 1
+        return Span(self, name, trace_id, parent_id, KIND_SERVER)
+
+    def activate(self, span):
+        """Make span the parent of spans started from here on in this thread (None to clear)"""
+        _current.set(span)
+
+    def current(self):
+        return _current.get() or NOOP_SPAN
+
+    def use(self, span):
+        """with block that makes an existing span current without ending it, e.g. in a worker thread"""
+        return SpanScope(span, end_on_exit=False) if span.recording else NOOP_SCOPE
+
+    def span(self, name, attributes=None):
+        """with block timing a child of the current span; a no-op when there is no sampled parent"""
+        parent = _current.get()
+        if parent is None or not parent.recording:
+            return NOOP_SCOPE
+        return SpanScope(Span(self, name, parent.trace_id, parent.span_id, KIND_INTERNAL, attributes))
+
+    def flush(self):
+        if self.enabled:
+            self.processor.flush()
+
+    def stats(self):
+        stats = {"enabled": self.enabled, "sample_rate": self.sample_rate,
+                 "requests": self.requests, "sampled": self.sampled}
+        if self.enabled:
+            processor = self.processor
+            stats.update({
+                "exporter": type(self.exporter).__name__,
+                "queued": processor.queued(),
+                "exported": processor.exported,
+                "batches": processor.batches,
+                "dropped": processor.dropped,
+                "export_errors": processor.export_errors,
+            })
+        return stats
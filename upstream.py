@@ -0,0 +1,170 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", 5))
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", 30))
+NEGATIVE_CACHE_TTL = float(os.environ.get("NEGATIVE_CACHE_TTL", 60))
+NEGATIVE_CACHE_SIZE = int(os.environ.get("NEGATIVE_CACHE_SIZE", 10000))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of contacting a host that is known to be failing"""
+
+    def __init__(self, message, status=502, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def host_of(url):
+    return urlparse(url).netloc.lower()
+
+
+class CircuitBreaker:
+    """Per-host breaker: opens after consecutive failures, lets one probe through after a cooldown"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        # Typical cost of one failed attempt, used to estimate worker time saved
+        self.failure_seconds = 0.0
+
+    def allow(self):
+        """True if a request may go out; moves open -> half-open once the cooldown is over"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and self.clock() - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def retry_after(self):
+        return max(0.0, self.cooldown - (self.clock() - self.opened_at))
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self, seconds):
+        self.failures += 1
+        self.failure_seconds = seconds if not self.failure_seconds else \
+            0.8 * self.failure_seconds + 0.2 * seconds
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(f"Circuit opened after {self.failures} failures")
+            self.state = OPEN
+            self.opened_at = self.clock()
+            self.probing = False
+
+
+class NegativeCache:
+    """Short-lived memory of URLs that 404'd or didn't decode"""
+
+    def __init__(self, ttl=NEGATIVE_CACHE_TTL, max_size=NEGATIVE_CACHE_SIZE, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self._entries = OrderedDict()
+
+    def get(self, url):
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        expires, reason, seconds = entry
+        if self.clock() >= expires:
+            del self._entries[url]
+            return None
+        return reason, seconds
+
+    def put(self, url, reason, seconds):
+        self._entries[url] = (self.clock() + self.ttl, reason, seconds)
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class UpstreamGuard:
+    """Circuit breakers per image host plus a negative cache, with savings metrics"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN,
+                 negative_ttl=NEGATIVE_CACHE_TTL, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.breakers = {}
+        self.negative = NegativeCache(negative_ttl, clock=clock)
+        self.fast_failures = 0
+        self.negative_hits = 0
+        self.worker_seconds_saved = 0.0
+        self._lock = threading.Lock()
+
+    def _breaker(self, host):
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker(self.failure_threshold, self.cooldown, self.clock)
+        return breaker
+
+    def check(self, url):
+        """Raise UpstreamUnavailable if this URL or its host should not be tried right now"""
+        with self._lock:
+            cached = self.negative.get(url)
+            if cached is not None:
+                reason, seconds = cached
+                self.negative_hits += 1
+                self.worker_seconds_saved += seconds
+                raise UpstreamUnavailable(f"Image recently failed ({reason}), not retrying yet", 502)
+            breaker = self._breaker(host_of(url))
+            if not breaker.allow():
+                self.fast_failures += 1
+                self.worker_seconds_saved += breaker.failure_seconds
+                raise UpstreamUnavailable(f"Image host {host_of(url)} is failing, circuit open",
+                                          503, breaker.retry_after())
+
+    def record_success(self, url):
+        with self._lock:
+            self._breaker(host_of(url)).record_success()
+
+    def record_failure(self, url, seconds):
+        """The host misbehaved (connection error, timeout or 5xx)"""
+        with self._lock:
+            self._breaker(host_of(url)).record_failure(seconds)
+
+    def remember_bad_url(self, url, reason, seconds):
+        """The host is fine but this URL isn't (404/410 or undecodable bytes)"""
+        with self._lock:
+            self._breaker(host_of(url)).record_success()
+            self.negative.put(url, reason, seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "fast_failures": self.fast_failures,
+                "negative_cache_hits": self.negative_hits,
+                "negative_cache_size": len(self.negative),
+                "worker_seconds_saved": round(self.worker_seconds_saved, 3),
+                "hosts": {
+                    host: {"state": b.state, "failures": b.failures}
+                    for host, b in self.breakers.items() if b.state != CLOSED or b.failures
+                },
+            }